@@ -0,0 +1,273 @@
+"""
+reCAPTCHA verification for the checkout.
+
+Tokens are checked against the siteverify endpoint (RECAPTCHA_VERIFY_URL)
+over a small pool of keep-alive connections, so a checkout costs one
+round-trip on a warm connection instead of a TCP + TLS handshake each time.
+
+verify_for_session() remembers the token that verified in the visitor's
+session for RECAPTCHA_TOKEN_CACHE_TIMEOUT seconds: Google answers a token
+only once, and a checkout re-submitted after a validation error would
+otherwise fail on its already-used token. Only that session gets to reuse
+it, and forget_verified() drops it once the order is placed. The a-prefixed
+versions are for async views: averify() asks the verifier from a worker
+thread, so the event loop keeps serving while it answers.
+
+A circuit breaker stops calling the verifier after
+RECAPTCHA_BREAKER_FAILURES consecutive errors, timeouts or answers slower
+than RECAPTCHA_SLOW_THRESHOLD; while it is open verify() raises
+VerifierUnavailable at once and the checkout falls back to the math
+captcha. After RECAPTCHA_BREAKER_COOLDOWN seconds one trial call is let
+through to probe the verifier again.
+"""
+import asyncio
+import hashlib
+import http.client
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+
+
+class VerifierUnavailable(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, at most size of them idle"""
+
+    def __init__(self, url, size=4, timeout=3.0):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _checkin(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post(self, body, headers):
+        """POST body to the pool's URL, returns (status, response bytes)"""
+        connection, reused = self._checkout()
+        try:
+            try:
+                connection.request('POST', self.path, body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server dropped the idle connection: one retry on a fresh one
+                connection.close()
+                connection = self._connect()
+                connection.request('POST', self.path, body, headers)
+                response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(connection)
+        return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class CircuitBreaker:
+    """Closed until failures consecutive failures, then open for cooldown seconds"""
+
+    def __init__(self, failures=3, cooldown=30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def allow(self):
+        """Whether a call may go through; after the cooldown a single trial call does"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def succeeded(self):
+        with self._lock:
+            self._failed = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failed(self):
+        with self._lock:
+            self._failed += 1
+            if self._trial or self._failed >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class RecaptchaClient:
+    def __init__(self, secret, url, timeout=3.0, pool_size=4, slow_threshold=1.0,
+                 breaker_failures=3, breaker_cooldown=30.0):
+        self.secret = secret
+        self.slow_threshold = slow_threshold
+        self.pool = ConnectionPool(url, size=pool_size, timeout=timeout)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**_settings())
+
+    def available(self):
+        """False while the breaker is open: render the math captcha instead"""
+        return not self.breaker.is_open
+
+    def verify(self, token, remote_ip=None):
+        """
+        Whether Google accepts the token.
+
+        Raises VerifierUnavailable when the verifier can't be asked (breaker
+        open) or doesn't answer properly in time.
+        """
+        if not self.breaker.allow():
+            raise VerifierUnavailable('reCAPTCHA verifier circuit is open')
+
+        fields = {'secret': self.secret, 'response': token}
+        if remote_ip:
+            fields['remoteip'] = remote_ip
+        start = time.monotonic()
+        try:
+            status, data = self.pool.post(
+                urlencode(fields), {'Content-Type': 'application/x-www-form-urlencoded'},
+            )
+            payload = json.loads(data) if status == 200 else None
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self.breaker.failed()
+            raise VerifierUnavailable(str(e)) from e
+        if not isinstance(payload, dict):
+            self.breaker.failed()
+            raise VerifierUnavailable(f'reCAPTCHA verifier answered HTTP {status}')
+        success = bool(payload.get('success'))
+
+        # A slow answer still counts, but too many of them trip the breaker
+        if time.monotonic() - start > self.slow_threshold:
+            self.breaker.failed()
+        else:
+            self.breaker.succeeded()
+        return success
+
+    async def averify(self, token, remote_ip=None):
+        """verify() for async views, on a worker thread so the event loop keeps serving"""
+        return await asyncio.to_thread(self.verify, token, remote_ip)
+
+
+def _settings():
+    return {
+        'secret': settings.RECAPTCHA_SECRET_KEY,
+        'url': settings.RECAPTCHA_VERIFY_URL,
+        'timeout': settings.RECAPTCHA_TIMEOUT,
+        'pool_size': settings.RECAPTCHA_POOL_SIZE,
+        'slow_threshold': settings.RECAPTCHA_SLOW_THRESHOLD,
+        'breaker_failures': settings.RECAPTCHA_BREAKER_FAILURES,
+        'breaker_cooldown': settings.RECAPTCHA_BREAKER_COOLDOWN,
+    }
+
+
+_client = None
+_client_settings = None
+_client_lock = threading.Lock()
+
+
+def recaptcha_enabled():
+    return bool(settings.RECAPTCHA_SITE_KEY and settings.RECAPTCHA_SECRET_KEY)
+
+
+def get_recaptcha_client():
+    """The process-wide client (its pool and breaker are shared), rebuilt when the settings change"""
+    global _client, _client_settings
+    current = _settings()
+    with _client_lock:
+        if _client is None or _client_settings != current:
+            if _client is not None:
+                _client.pool.close()
+            _client = RecaptchaClient(**current)
+            _client_settings = current
+        return _client
+
+
+VERIFIED_SESSION_KEY = 'recaptcha_verified'
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _still_verified(remembered, token):
+    return bool(remembered) and remembered['token'] == _digest(token) and remembered['until'] > time.time()
+
+
+def _verified(token):
+    return {'token': _digest(token), 'until': time.time() + settings.RECAPTCHA_TOKEN_CACHE_TIMEOUT}
+
+
+def verify_for_session(request, token):
+    """
+    verify() through the process-wide client, unless this session already
+    verified the token less than RECAPTCHA_TOKEN_CACHE_TIMEOUT seconds ago.
+    """
+    if _still_verified(request.session.get(VERIFIED_SESSION_KEY), token):
+        return True
+    if not get_recaptcha_client().verify(token, request.META.get('REMOTE_ADDR')):
+        return False
+    request.session[VERIFIED_SESSION_KEY] = _verified(token)
+    return True
+
+
+async def averify_for_session(request, token):
+    """verify_for_session() for async views, through the session's async API and averify()"""
+    if _still_verified(await request.session.aget(VERIFIED_SESSION_KEY), token):
+        return True
+    if not await get_recaptcha_client().averify(token, request.META.get('REMOTE_ADDR')):
+        return False
+    await request.session.aset(VERIFIED_SESSION_KEY, _verified(token))
+    return True
+
+
+def forget_verified(request):
+    """Spend the session's verified token: the next order needs a new one"""
+    request.session.pop(VERIFIED_SESSION_KEY, None)
+
+
+async def aforget_verified(request):
+    await request.session.apop(VERIFIED_SESSION_KEY, None)
@@ -0,0 +1,92 @@
+"""
+Local stand-in for Google's siteverify endpoint, for tests and benchmarks.
+
+Tokens starting with 'bad' are rejected and every other token is accepted.
+The server can be made to answer slowly (latency, in seconds) or with
+HTTP 500 (failing), and counts the connections and requests it served so
+tests can tell whether the client reused its connections.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StubVerifierHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real endpoint
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes: don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        fields = parse_qs(self.rfile.read(length).decode())
+        self.server.count('requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.failing:
+            status, payload = 500, {}
+        else:
+            token = fields.get('response', [''])[0]
+            status, payload = 200, {'success': bool(token) and not token.startswith('bad'), 'hostname': 'localhost'}
+            if not payload['success']:
+                payload['error-codes'] = ['invalid-input-response']
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubVerifier(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failing=False, verbose=False):
+        super().__init__((host, port), StubVerifierHandler)
+        self.latency = latency
+        self.failing = failing
+        self.verbose = verbose
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def handle_error(self, request, client_address):
+        # A client that timed out and hung up is expected here, not worth a traceback
+        if not self.verbose:
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/recaptcha/api/siteverify'
+
+    def start(self):
+        """Serve from a daemon thread, returns self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
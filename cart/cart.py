@@ -0,0 +1,131 @@
+"""Cart mutations that keep the stored Cart.item_count / Cart.subtotal counters and the stock holds in sync"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Cart, CartItem
+from .reservations import release, reserve
+
+
+def cart_count_key(user_id):
+    return f'cart:count:{user_id}'
+
+
+def get_cart_count(user_id):
+    """Items in the user's cart, from the cache; never creates a Cart"""
+    key = cart_count_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Cart.objects.filter(user_id=user_id).values_list('item_count', flat=True).first() or 0
+        cache.set(key, count, settings.CART_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+async def aget_cart_count(user_id):
+    """get_cart_count() for async views"""
+    key = cart_count_key(user_id)
+    count = await cache.aget(key)
+    if count is None:
+        count = await Cart.objects.filter(user_id=user_id).values_list('item_count', flat=True).afirst() or 0
+        await cache.aset(key, count, settings.CART_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_cart_count(*user_ids):
+    # After commit, so a rolled back mutation never clears a good value and a
+    # reader can't cache the pre-commit count
+    keys = [cart_count_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _bump_totals(cart, quantity, price):
+    Cart.objects.filter(pk=cart.pk).update(
+        item_count=F('item_count') + quantity,
+        subtotal=F('subtotal') + Value(price * quantity, output_field=DecimalField()),
+    )
+    cart.refresh_from_db(fields=['item_count', 'subtotal'])
+    invalidate_cart_count(cart.user_id)
+
+
+@transaction.atomic
+def add_item(cart, product, quantity=1):
+    """Add quantity units, held for the cart (InsufficientStock when not available)"""
+    reserve(cart, product, quantity)
+    cart_item, created = CartItem.objects.get_or_create(
+        cart=cart,
+        product=product,
+        defaults={'quantity': quantity},
+    )
+    if not created:
+        CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+        cart_item.quantity += quantity
+    _bump_totals(cart, quantity, product.price)
+    return cart_item
+
+
+@transaction.atomic
+def decrease_item(cart_item):
+    """Remove one unit, dropping the line when it was the last one"""
+    cart = cart_item.cart
+    release(cart, cart_item.product_id, 1)
+    if cart_item.quantity > 1:
+        CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') - 1)
+        cart_item.quantity -= 1
+    else:
+        cart_item.delete()
+    _bump_totals(cart, -1, cart_item.product.price)
+
+
+@transaction.atomic
+def remove_item(cart_item):
+    cart = cart_item.cart
+    release(cart, cart_item.product_id)
+    cart_item.delete()
+    _bump_totals(cart, -cart_item.quantity, cart_item.product.price)
+
+
+@transaction.atomic
+def clear_cart(cart):
+    release(cart)
+    cart.items.all().delete()
+    Cart.objects.filter(pk=cart.pk).update(item_count=0, subtotal=Decimal('0'))
+    cart.item_count = 0
+    cart.subtotal = Decimal('0')
+    invalidate_cart_count(cart.user_id)
+
+
+def _actual_totals():
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    actual_count = Coalesce(
+        Subquery(items.annotate(total=Sum('quantity')).values('total'), output_field=PositiveIntegerField()),
+        0,
+    )
+    actual_subtotal = Coalesce(
+        Subquery(
+            items.annotate(total=Sum(F('quantity') * F('product__price'))).values('total'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+    return actual_count, actual_subtotal
+
+
+def recompute_totals(carts):
+    """Recompute the stored counters of a Cart queryset from its items in one UPDATE"""
+    actual_count, actual_subtotal = _actual_totals()
+    invalidate_cart_count(*carts.values_list('user_id', flat=True))
+    return carts.update(item_count=actual_count, subtotal=actual_subtotal)
+
+
+def drifted_carts(carts):
+    """Carts of the queryset whose stored counters no longer match their items"""
+    actual_count, actual_subtotal = _actual_totals()
+    return carts.annotate(
+        actual_count=actual_count,
+        actual_subtotal=actual_subtotal,
+    ).exclude(item_count=F('actual_count'), subtotal=F('actual_subtotal'))
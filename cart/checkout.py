@@ -0,0 +1,88 @@
+"""Order placement: the whole cart -> order conversion in one transaction"""
+from django.db import transaction
+from django.db.models import F
+
+from shop.facets import invalidate_facets
+from shop.models import Order, OrderItem, PointsTransaction, Product
+from shop.page_cache import invalidate_tags, product_tag
+from shop.points import award
+
+from .cart import clear_cart
+from .exceptions import EmptyCart, InsufficientStock
+from .models import StockReservation
+from .reservations import held_quantities, per_product, release
+
+
+def take_stock(quantities, held=None):
+    """
+    Take the quantities out of stock in a single conditional UPDATE.
+
+    held maps products to the units this cart already holds: they are
+    consumed from Product.reserved and count towards what the row can give.
+    Only rows whose available stock (plus the cart's own hold) covers the
+    quantity are decremented. When fewer rows than products were updated, the
+    statement is undone and InsufficientStock is raised with the products
+    that fell short.
+    """
+    held = held or {}
+    wanted = per_product(quantities)
+    own = per_product(held)
+    with transaction.atomic():
+        updated = Product.objects.filter(
+            pk__in=quantities,
+            stock__gte=F('reserved') - own + wanted,
+        ).update(
+            stock=F('stock') - wanted,
+            reserved=F('reserved') - own,
+        )
+        if updated == len(quantities):
+            # Cached pages show these products' stock
+            invalidate_tags(*[product_tag(pk) for pk in quantities])
+            return
+        # Undo the rows that did go through before looking for the short ones
+        transaction.set_rollback(True)
+    short = Product.objects.filter(pk__in=quantities, stock__lt=F('reserved') - own + wanted).order_by('pk')
+    raise InsufficientStock(list(short))
+
+
+@transaction.atomic
+def place_order(cart, user, **shipping):
+    """
+    Turn the cart into an Order: stock, the cart's holds, order lines,
+    points and the emptied cart are written together or not at all.
+    """
+    items = list(cart.items.select_related('product').order_by('product_id'))
+    if not items:
+        raise EmptyCart()
+
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    held = held_quantities(cart)
+    take_stock(quantities, {pk: units for pk, units in held.items() if pk in quantities})
+    StockReservation.objects.filter(cart=cart, product_id__in=quantities).delete()
+    if held.keys() - quantities.keys():
+        # Holds on products no longer in the cart: their units go back to the available stock
+        release(cart)
+
+    order = Order.objects.create(
+        user=user,
+        total_price=sum(item.product.price * item.quantity for item in items),
+        status='pending',
+        **shipping,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=item.product, quantity=item.quantity, price=item.product.price)
+        for item in items
+    ])
+
+    # 1 point per item bought
+    award(user, sum(quantities.values()), PointsTransaction.PURCHASE, order=order)
+
+    clear_cart(cart)
+    # Stock moved with update(), so no post_save. Held units were already out of the available stock:
+    # facets only change when units taken beyond the holds sold a product out
+    beyond = [pk for pk, quantity in quantities.items() if quantity > held.get(pk, 0)]
+    if beyond and Product.objects.filter(pk__in=beyond, stock__lte=F('reserved')).exists():
+        transaction.on_commit(invalidate_facets)
+    return order
@@ -0,0 +1,9 @@
+from .cart import get_cart_count
+
+
+def cart_count(request):
+    """Cart badge count for the navigation, rendered with the page"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {'cart_count': 0}
+    return {'cart_count': get_cart_count(user.pk)}
@@ -0,0 +1,14 @@
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class InsufficientStock(CheckoutError):
+    """Some cart lines ask for more than what is available; nothing was written"""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__(', '.join(product.name for product in products))
@@ -0,0 +1,69 @@
+import http.client
+import json
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from cart.captcha import RecaptchaClient, VerifierUnavailable
+from cart.captcha_stub import StubVerifier
+from shop.bench import format_summary, measure
+
+
+def legacy_verify(url, token):
+    # What confirm_order did before: a new connection for every verification
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        connection.request(
+            'POST', parts.path, urlencode({'secret': 'secret', 'response': token}),
+            {'Content-Type': 'application/x-www-form-urlencoded', 'Connection': 'close'},
+        )
+        return json.loads(connection.getresponse().read()).get('success', False)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Time checkout captcha verification against the local stub verifier: a connection per call '
+        'vs the pooled client, and how fast a slow verifier is failed over '
+        '(locally only the TCP handshake is saved; against Google the TLS handshake is too)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS', help='Stub answer delay')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        cache.clear()
+        with StubVerifier(latency=options['latency']) as stub:
+            client = RecaptchaClient('secret', stub.url)
+            tokens = iter(range(10 ** 9))
+
+            self.stdout.write(format_summary(
+                'new connection per call', measure(lambda: legacy_verify(stub.url, f'token-{next(tokens)}'), repeat),
+            ))
+            connections = stub.connections
+            self.stdout.write(format_summary(
+                'pooled keep-alive client', measure(lambda: client.verify(f'token-{next(tokens)}'), repeat),
+            ))
+            self.stdout.write(f'  connections opened by the pooled client: {stub.connections - connections}')
+
+        # A verifier slower than the threshold: the breaker opens, later calls fail over at once
+        with StubVerifier(latency=0.3) as slow:
+            client = RecaptchaClient('secret', slow.url, timeout=0.2, breaker_failures=3)
+
+            def verify_or_fall_back():
+                try:
+                    client.verify(f'token-{next(tokens)}')
+                except VerifierUnavailable:
+                    pass
+
+            start = time.perf_counter()
+            for _ in range(3):
+                verify_or_fall_back()
+            self.stdout.write(f'slow verifier: breaker open after {(time.perf_counter() - start) * 1000:.0f}ms')
+            self.stdout.write(format_summary('fail-over with the breaker open', measure(verify_or_fall_back, repeat)))
@@ -0,0 +1,107 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.test import Client
+from django.urls import reverse
+
+from cart.cart import add_item
+from cart.models import Cart
+from shop.bench import (
+    benchmark_database, format_summary, load_baselines, regressions, save_baselines, seed_catalog, summarize,
+)
+from shop.models import CustomUser, Product
+
+# Median milliseconds per view, measured on the reference machine with the defaults
+BASELINES = Path(__file__).resolve().parents[2] / 'bench_baselines.json'
+
+
+def timed(func, setup, repeat, warmup=3):
+    """Timings of func over repeat runs, setup() run untimed before each"""
+    for _ in range(warmup):
+        setup()
+        func()
+    timings = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        'Wall-clock time of add_to_cart and confirm_order through the full middleware stack on a seeded '
+        'throwaway database, checked against the stored baselines (cart/bench_baselines.json); '
+        'fails when a median is slower than its baseline by more than the tolerance. Baselines are per '
+        'machine: record them with --update where the check runs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--lines', type=int, default=5, help='Cart lines of each confirmed order')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown, as a ratio')
+        parser.add_argument('--update', action='store_true', help='Store the medians as the new baselines')
+
+    def handle(self, *args, **options):
+        # Production-like: no query log; the math captcha, answered from the session
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = ['testserver']
+        settings.RECAPTCHA_SITE_KEY = ''
+
+        with benchmark_database():
+            seed_catalog(options['products'])
+            # Plenty of stock: every run takes the same path
+            Product.objects.update(stock=F('stock') + options['repeat'] * 10)
+            user = CustomUser.objects.create_user('bench', password='!')
+            client = Client()
+            client.force_login(user)
+            products = list(Product.objects.order_by('pk'))
+            cart = Cart.objects.create(user=user)
+            results = {}
+
+            rotation = iter(range(10 ** 9))
+
+            def add_to_cart():
+                product = products[next(rotation) % len(products)]
+                client.post(reverse('add_to_cart', args=[product.pk]), headers={'X-Requested-With': 'XMLHttpRequest'})
+
+            stats = summarize(timed(add_to_cart, cache.clear, options['repeat']))
+            self.stdout.write(format_summary('add_to_cart', stats))
+            results['add_to_cart'] = stats['p50']
+
+            def fill_cart():
+                for _ in range(options['lines']):
+                    add_item(cart, products[next(rotation) % len(products)])
+                session = client.session
+                session['captcha_answer'] = 7
+                session.save()
+                cache.clear()
+
+            def confirm_order():
+                response = client.post(reverse('confirm_order'), {
+                    'full_name': 'Client Test', 'phone': '0555000000', 'wilaya': '16', 'commune': 'Alger Centre',
+                    'address': '1 rue des Tests', 'captcha': '7',
+                })
+                if response.status_code != 302 or 'success' not in response.url:
+                    raise CommandError('confirm_order did not place the order')
+
+            stats = summarize(timed(confirm_order, fill_cart, options['repeat']))
+            self.stdout.write(format_summary(f"confirm_order ({options['lines']} lines)", stats))
+            results['confirm_order'] = stats['p50']
+
+        if options['update']:
+            save_baselines(BASELINES, {name: round(value, 2) for name, value in results.items()})
+            self.stdout.write(self.style.SUCCESS(f'Baselines stored in {BASELINES.name}'))
+            return
+        slower = regressions(results, load_baselines(BASELINES), options['tolerance'])
+        if slower:
+            raise CommandError('Slower than the baselines: ' + '; '.join(
+                f'{name} {measured:.2f}ms vs {baseline:.2f}ms' for name, measured, baseline in slower
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Within {options['tolerance']:.0%} of the baselines"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cart.captcha_stub import StubVerifier
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve a local reCAPTCHA siteverify stand-in (tokens starting with "bad" are rejected); '
+        'set RECAPTCHA_VERIFY_URL to the printed URL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS', help='Delay every answer')
+        parser.add_argument('--failing', action='store_true', help='Answer every request with HTTP 500')
+
+    def handle(self, *args, **options):
+        server = StubVerifier(
+            options['host'], options['port'],
+            latency=options['latency'], failing=options['failing'], verbose=options['verbosity'] > 1,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Stub verifier listening on {server.url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Return the stock held by lapsed cart reservations (run from cron, or with --every as a worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--every', type=int, default=0, metavar='SECONDS',
+            help='Keep running, sweeping every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            if released or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f'{released} expired reservation(s) released'))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
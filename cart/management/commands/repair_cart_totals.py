@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cart.cart import drifted_carts, recompute_totals
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Find carts whose stored item count / subtotal drifted from their items and fix them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted carts')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        checked = repaired = 0
+        while True:
+            chunk = list(
+                Cart.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            checked += len(chunk)
+
+            with transaction.atomic():
+                drifted = list(drifted_carts(Cart.objects.filter(pk__in=chunk)).values_list('pk', flat=True))
+                if drifted and not options['dry_run']:
+                    recompute_totals(Cart.objects.filter(pk__in=drifted))
+            repaired += len(drifted)
+            if drifted and options['verbosity'] > 1:
+                self.stdout.write(f'Drifted carts: {drifted}')
+
+        action = 'would be repaired' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{checked} cart(s) checked, {repaired} {action}'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:01
+
+from django.db import migrations, models
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    for cart in Cart.objects.prefetch_related('items__product'):
+        items = list(cart.items.all())
+        cart.item_count = sum(item.quantity for item in items)
+        cart.subtotal = sum((item.product.price * item.quantity for item in items), 0)
+        cart.save(update_fields=['item_count', 'subtotal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
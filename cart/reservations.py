@@ -0,0 +1,138 @@
+"""
+Time-limited stock holds for cart lines.
+
+Adding to cart moves units from available to Product.reserved and records a
+StockReservation that expires after CART_RESERVATION_TTL seconds. Available
+stock is then a plain column difference (stock - reserved) that listings can
+filter on without subqueries. Holds are released when the line leaves the
+cart, consumed by the checkout, or returned in bulk by release_expired()
+(the release_expired_reservations command) once they lapse.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from shop.facets import invalidate_facets
+from shop.page_cache import invalidate_tags, product_tag
+from shop.models import Product
+
+from .exceptions import InsufficientStock
+from .models import StockReservation
+
+
+def per_product(quantities):
+    """CASE id WHEN ... THEN quantity expression for a {product_id: quantity} mapping"""
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _availability_changed(product_ids, crossed=False):
+    # Cached pages show the stock. Facets only count available products: they are dropped when one sells out
+    # or comes back (crossed), otherwise their stock totals lag by up to FACET_CACHE_TIMEOUT
+    if crossed:
+        transaction.on_commit(invalidate_facets)
+    invalidate_tags(*[product_tag(pk) for pk in product_ids])
+
+
+def _give_back(quantities):
+    """Take {product_id: units} off Product.reserved; whether a sold-out product is available again"""
+    if len(quantities) == 1:
+        # A line removed or decreased: which conditional UPDATE matches tells whether it was sold out
+        (pk, quantity), = quantities.items()
+        if Product.objects.filter(pk=pk, stock__gt=F('reserved')).update(reserved=F('reserved') - quantity):
+            return False
+        Product.objects.filter(pk=pk).update(reserved=F('reserved') - quantity)
+        return True
+    returned = per_product(quantities)
+    Product.objects.filter(pk__in=quantities).update(reserved=F('reserved') - returned)
+    return Product.objects.filter(
+        pk__in=quantities, stock__gt=F('reserved'), stock__lte=F('reserved') + returned,
+    ).exists()
+
+
+@transaction.atomic
+def reserve(cart, product, quantity=1):
+    """Hold quantity more units of product for the cart, renewing the hold's TTL"""
+    products = Product.objects.filter(pk=product.pk)
+    # Some stock stays available: the usual case, one UPDATE
+    held = products.filter(stock__gt=F('reserved') + quantity).update(reserved=F('reserved') + quantity)
+    sold_out = not held
+    if sold_out:
+        # The last units
+        held = products.filter(stock=F('reserved') + quantity).update(reserved=F('reserved') + quantity)
+    if not held:
+        raise InsufficientStock([product])
+
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    renewed = StockReservation.objects.filter(cart=cart, product=product).update(
+        quantity=F('quantity') + quantity,
+        expires_at=expires_at,
+    )
+    if not renewed:
+        StockReservation.objects.create(cart=cart, product=product, quantity=quantity, expires_at=expires_at)
+    _availability_changed([product.pk], crossed=sold_out)
+
+
+def _return(reservations):
+    """Delete the given (pk, product_id, quantity) holds and give their units back"""
+    if not reservations:
+        return 0
+    quantities = {}
+    for _, product_id, quantity in reservations:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in reservations]).delete()
+    _availability_changed(quantities, crossed=_give_back(quantities))
+    return len(reservations)
+
+
+@transaction.atomic
+def release(cart, product_id=None, quantity=None):
+    """
+    Give back the cart's holds, all of them or those on one product.
+
+    With a quantity, only that many units of the product's hold are returned
+    (a line decreased by one); the rest of the hold stays in place.
+    """
+    reservations = StockReservation.objects.select_for_update().filter(cart=cart)
+    if product_id is not None:
+        reservations = reservations.filter(product_id=product_id)
+    rows = list(reservations.values_list('pk', 'product_id', 'quantity'))
+
+    if quantity is not None and rows and rows[0][2] > quantity:
+        pk, product_id, _ = rows[0]
+        StockReservation.objects.filter(pk=pk).update(quantity=F('quantity') - quantity)
+        _availability_changed([product_id], crossed=_give_back({product_id: quantity}))
+        return
+    _return(rows)
+
+
+def held_quantities(cart):
+    """{product_id: units} the cart holds, locked until the end of the transaction"""
+    return dict(
+        StockReservation.objects.select_for_update()
+        .filter(cart=cart)
+        .values_list('product_id', 'quantity')
+    )
+
+
+def release_expired(batch_size=1000, now=None):
+    """Return the units of lapsed holds to available stock, batch_size holds per transaction"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            released += _return(rows)
+        if len(rows) < batch_size:
+            return released
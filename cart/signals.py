@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from shop.models import Product
+
+from .cart import recompute_totals
+from .models import Cart
+from .reservations import release
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Stored cart subtotals are priced with the current product price
+    if raw or (update_fields is not None and 'price' not in update_fields):
+        return
+    recompute_totals(Cart.objects.filter(items__product=instance))
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_carts(sender, instance, **kwargs):
+    instance._cart_ids = list(Cart.objects.filter(items__product=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # The cascade removed the product's cart lines behind the counters' back
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        recompute_totals(Cart.objects.filter(pk__in=cart_ids))
+
+
+@receiver(pre_delete, sender=Cart)
+def release_cart_holds(sender, instance, **kwargs):
+    # A cascade (user deletion) would drop the holds without returning the units
+    release(instance)
@@ -1,3 +1,674 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import get_resolver, resolve, reverse
+from django.utils import timezone
+
+from shop.bench import load_baselines, regressions
+from shop.facets import get_generation
+from shop.models import Category, CustomUser, Order, OrderItem, Product
+from shop.testing import make_product
+
+from . import views
+from .captcha import RecaptchaClient, VerifierUnavailable, aforget_verified, averify_for_session
+from .captcha_stub import StubVerifier
+from .cart import add_item, clear_cart, decrease_item, get_cart_count, recompute_totals, remove_item
+from .checkout import place_order
+from .management.commands.bench_checkout import BASELINES
+from .exceptions import EmptyCart, InsufficientStock
+from .models import Cart, CartItem, StockReservation
+from .reservations import release_expired
+
+
+class CartTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Chaussures')
+        cls.shoe = make_product(cls.category, name='Air Max', price=Decimal('9000.00'))
+        cls.bag = make_product(cls.category, name='Tote', price=Decimal('2500.50'))
+
+    def setUp(self):
+        cache.clear()
+        self.cart = Cart.objects.create(user=self.user)
+
+    def assertTotals(self, count, subtotal):
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.total_items, cart.total_price), (count, Decimal(subtotal)))
+
+    def test_mutations_keep_counters_in_sync(self):
+        add_item(self.cart, self.shoe)
+        add_item(self.cart, self.shoe)
+        item = add_item(self.cart, self.bag, quantity=3)
+        self.assertTotals(5, '25501.50')
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (5, Decimal('25501.50')))
+
+        decrease_item(CartItem.objects.get(pk=item.pk))
+        self.assertTotals(4, '23001.00')
+        remove_item(CartItem.objects.get(cart=self.cart, product=self.shoe))
+        self.assertTotals(2, '5001.00')
+        clear_cart(self.cart)
+        self.assertTotals(0, '0')
+        self.assertFalse(self.cart.items.exists())
+
+    def test_price_change_reprices_carts(self):
+        add_item(self.cart, self.shoe, quantity=2)
+        self.shoe.price = Decimal('8000.00')
+        self.shoe.save()
+        self.assertTotals(2, '16000.00')
+
+    def test_product_delete_updates_carts(self):
+        add_item(self.cart, self.shoe)
+        add_item(self.cart, self.bag)
+        self.bag.delete()
+        self.assertTotals(1, '9000.00')
+
+    def test_repair_command_fixes_drift(self):
+        add_item(self.cart, self.shoe, quantity=2)
+        Cart.objects.filter(pk=self.cart.pk).update(item_count=7, subtotal=1)
+        out = StringIO()
+        call_command('repair_cart_totals', stdout=out)
+        self.assertIn('1 cart(s) checked, 1 repaired', out.getvalue())
+        self.assertTotals(2, '18000.00')
+
+    def test_cart_view_query_count_does_not_grow_with_items(self):
+        self.client.force_login(self.user)
+        add_item(self.cart, self.shoe)
+        get_cart_count(self.user.pk)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('cart'))
+
+        products = [make_product(self.category, name=f'Modèle {index}') for index in range(49)]
+        for product in products:
+            add_item(self.cart, product)
+        get_cart_count(self.user.pk)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'Modèle 48')
+        self.assertEqual(response.context['cart'].total_items, 50)
+
+    def test_add_and_remove_views_return_stored_count(self):
+        self.client.force_login(self.user)
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = self.client.post(reverse('add_to_cart', args=[self.shoe.pk]), **ajax)
+        self.assertEqual(response.json()['cart_count'], 1)
+        response = self.client.post(reverse('add_to_cart', args=[self.shoe.pk]), **ajax)
+        self.assertEqual(response.json()['cart_count'], 2)
+        item = CartItem.objects.get(cart=self.cart, product=self.shoe)
+        response = self.client.post(reverse('remove_from_cart', args=[item.pk]), {'action': 'decrease'}, **ajax)
+        self.assertEqual(response.json()['cart_count'], 1)
+        self.assertTotals(1, '9000.00')
+
+
+class CartCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Chaussures')
+        cls.shoe = make_product(cls.category, name='Air Max', price=Decimal('9000.00'))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def add(self, quantity=1):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_item(cart, self.shoe, quantity=quantity)
+
+    def test_badge_is_rendered_with_the_page(self):
+        self.add(quantity=3)
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['cart_count'], 3)
+        self.assertContains(response, 'id="cart-count">3</span>')
+        self.assertNotContains(response, reverse('cart_count'))
+
+    def test_count_endpoint_never_creates_a_cart(self):
+        response = self.client.get(reverse('cart_count'))
+        self.assertEqual(response.json(), {'cart_count': 0})
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_count_is_cached_and_invalidated_on_mutation(self):
+        self.add()
+        self.assertEqual(get_cart_count(self.user.pk), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(self.user.pk), 1)
+        self.add()
+        self.assertEqual(get_cart_count(self.user.pk), 2)
+
+    def test_count_endpoint_etag(self):
+        self.add()
+        response = self.client.get(reverse('cart_count'))
+        etag = response['ETag']
+        self.assertEqual(response.json(), {'cart_count': 1})
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(reverse('cart_count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.add()
+        response = self.client.get(reverse('cart_count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'cart_count': 2})
+
+
+@override_settings(ROOT_URLCONF='shop.testing')
+class AsyncCartViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Chaussures')
+        cls.shoe = make_product(cls.category, name='Air Max', stock=2)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_add_count_and_remove(self):
+        await self.async_client.aforce_login(self.user)
+        ajax = {'X-Requested-With': 'XMLHttpRequest'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = await self.async_client.post(reverse('add_to_cart', args=[self.shoe.pk]), headers=ajax)
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(response.json()['cart_count'], 1)
+
+        response = await self.async_client.get(reverse('cart_count'))
+        self.assertEqual(response.json(), {'cart_count': 1})
+        response = await self.async_client.get(reverse('cart_count'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        item = await CartItem.objects.aget(cart__user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = await self.async_client.post(reverse('remove_from_cart', args=[item.pk]), headers=ajax)
+        self.assertEqual(response.json()['cart_count'], 0)
+        self.assertFalse(await CartItem.objects.filter(cart__user=self.user).aexists())
+
+    async def test_out_of_stock_is_refused(self):
+        await self.async_client.aforce_login(self.user)
+        await Product.objects.filter(pk=self.shoe.pk).aupdate(stock=0)
+        response = await self.async_client.post(
+            reverse('add_to_cart', args=[self.shoe.pk]), headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(await Cart.objects.filter(user=self.user).aexists())
+
+    async def test_anonymous_users_are_sent_to_login(self):
+        response = await self.async_client.get(reverse('cart_count'))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_async_views_are_the_ones_served(self):
+        self.assertIs(resolve(reverse('add_to_cart', args=[self.shoe.pk])).func, views.aadd_to_cart)
+        self.assertIs(resolve(reverse('cart_count')).func, views.aupdate_cart_count)
+
+
+class PlaceOrderTests(TestCase):
+    shipping = {
+        'full_name': 'Amine B',
+        'phone': '0555123456',
+        'wilaya': '16',
+        'commune': 'Alger Centre',
+        'address': '1 rue Didouche Mourad',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Chaussures')
+        cls.shoe = make_product(cls.category, name='Air Max', price=Decimal('9000.00'), stock=5)
+        cls.bag = make_product(cls.category, name='Tote', price=Decimal('2500.00'), stock=1)
+
+    def setUp(self):
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_order_written_in_a_fixed_number_of_queries(self):
+        add_item(self.cart, self.shoe, quantity=2)
+        add_item(self.cart, self.bag)
+        # savepoints included; the count does not depend on the number of lines
+        with self.assertNumQueries(23):
+            order = place_order(self.cart, self.user, **self.shipping)
+
+        self.assertEqual(order.total_price, Decimal('20500.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('product__name', 'quantity', 'price')),
+            [('Air Max', 2, Decimal('9000.00')), ('Tote', 1, Decimal('2500.00'))],
+        )
+        self.assertEqual(Product.objects.get(pk=self.shoe.pk).stock, 3)
+        self.assertEqual(Product.objects.get(pk=self.bag.pk).stock, 0)
+        self.assertEqual(self.user.points, 3)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 3)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, 0)
+
+    def lose_bag_to_another_cart(self):
+        """The bag hold lapses and another cart takes the last unit"""
+        StockReservation.objects.filter(product=self.bag).update(expires_at=timezone.now())
+        release_expired()
+        rival = CustomUser.objects.create_user('rival', password='secret-pass-123')
+        add_item(Cart.objects.create(user=rival), self.bag)
+
+    def test_insufficient_stock_writes_nothing(self):
+        add_item(self.cart, self.shoe, quantity=2)
+        add_item(self.cart, self.bag)
+        self.lose_bag_to_another_cart()
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(self.cart, self.user, **self.shipping)
+        self.assertEqual(raised.exception.products, [self.bag])
+
+        shoe = Product.objects.get(pk=self.shoe.pk)
+        self.assertEqual((shoe.stock, shoe.reserved), (5, 2))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 0)
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCart):
+            place_order(self.cart, self.user, **self.shipping)
+
+    @override_settings(RECAPTCHA_SITE_KEY='', RECAPTCHA_SECRET_KEY='')
+    def test_confirm_order_view_reports_short_stock(self):
+        add_item(self.cart, self.bag)
+        self.lose_bag_to_another_cart()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['captcha_answer'] = 7
+        session.save()
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'captcha': '7'})
+        self.assertRedirects(response, reverse('cart'))
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers = 12
+
+    def setUp(self):
+        category = Category.objects.create(name='Chaussures')
+        self.product = make_product(category, name='Air Max', stock=5)
+        self.users = []
+        for index in range(self.buyers):
+            user = CustomUser.objects.create_user(f'client{index}', password='secret-pass-123')
+            # Carts whose holds have lapsed: every buyer races on the same 5 units
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product)
+            self.users.append(user)
+        recompute_totals(Cart.objects.all())
+
+    def checkout(self, user, barrier, outcomes):
+        try:
+            barrier.wait()
+            try:
+                place_order(Cart.objects.get(user=user), user, full_name=user.username)
+                outcomes.append('ordered')
+            except InsufficientStock:
+                outcomes.append('short')
+        finally:
+            connection.close()
+
+    def test_parallel_checkouts_never_oversell(self):
+        barrier = threading.Barrier(self.buyers)
+        outcomes = []
+        threads = [
+            threading.Thread(target=self.checkout, args=(user, barrier, outcomes))
+            for user in self.users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['ordered'] * 5 + ['short'] * 7)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 0)
+        self.assertEqual(OrderItem.objects.aggregate(total=Sum('quantity'))['total'], 5)
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.rival = CustomUser.objects.create_user('rival', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Sacs')
+        cls.bag = make_product(cls.category, name='Tote', stock=3)
+
+    def setUp(self):
+        cache.clear()
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fresh_bag(self):
+        return Product.objects.get(pk=self.bag.pk)
+
+    def test_add_holds_stock_against_other_carts(self):
+        add_item(self.cart, self.bag, quantity=3)
+        self.assertEqual((self.fresh_bag().reserved, self.fresh_bag().available), (3, 0))
+        with self.assertRaises(InsufficientStock):
+            add_item(Cart.objects.create(user=self.rival), self.bag)
+
+        self.client.force_login(self.rival)
+        response = self.client.post(
+            reverse('add_to_cart', args=[self.bag.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(self.fresh_bag().reserved, 3)
+
+    def test_cart_changes_release_holds(self):
+        item = add_item(self.cart, self.bag, quantity=3)
+        decrease_item(CartItem.objects.select_related('cart', 'product').get(pk=item.pk))
+        self.assertEqual(self.fresh_bag().reserved, 2)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+        remove_item(CartItem.objects.select_related('cart', 'product').get(pk=item.pk))
+        self.assertEqual(self.fresh_bag().reserved, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+        add_item(self.cart, self.bag)
+        self.user.delete()
+        self.assertEqual(self.fresh_bag().reserved, 0)
+
+    def test_expired_holds_are_swept_in_bulk(self):
+        add_item(self.cart, self.bag)
+        add_item(Cart.objects.create(user=self.rival), self.bag)
+        StockReservation.objects.filter(cart=self.cart).update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('1 expired reservation(s) released', out.getvalue())
+        self.assertEqual(self.fresh_bag().reserved, 1)
+        self.assertEqual(StockReservation.objects.get().cart.user, self.rival)
+
+    def test_adding_again_renews_the_hold(self):
+        add_item(self.cart, self.bag)
+        StockReservation.objects.update(expires_at=timezone.now())
+        add_item(self.cart, self.bag)
+        hold = StockReservation.objects.get()
+        self.assertEqual(hold.quantity, 2)
+        self.assertGreater(hold.expires_at, timezone.now())
+
+    def test_checkout_consumes_the_hold(self):
+        add_item(self.cart, self.bag, quantity=2)
+        place_order(self.cart, self.user, full_name='Amine B')
+        self.assertEqual((self.fresh_bag().stock, self.fresh_bag().reserved), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_order_releases_holds_left_on_products_no_longer_in_the_cart(self):
+        other = make_product(self.category, name='Cabas', stock=2)
+        add_item(self.cart, self.bag)
+        add_item(self.cart, other, quantity=2)
+        # The line went away without its hold
+        CartItem.objects.filter(cart=self.cart, product=other).delete()
+        place_order(self.cart, self.user, full_name='Amine B')
+        self.assertEqual((self.fresh_bag().stock, self.fresh_bag().reserved), (2, 0))
+        other.refresh_from_db()
+        self.assertEqual((other.stock, other.reserved), (2, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_catalog_shows_available_stock(self):
+        other = make_product(self.category, name='Cabas', stock=2)
+        add_item(self.cart, self.bag, quantity=3)
+        add_item(self.cart, other)
+        response = self.client.get(reverse('products'))
+        self.assertEqual([p.name for p in response.context['products']], ['Cabas'])
+        self.assertEqual(response.context['total_stock'], 1)
+
+        response = self.client.get(reverse('product_detail', args=[self.bag.pk]))
+        self.assertEqual(response.context['product'].available, 0)
+        self.assertContains(response, '0 unité')
+
+    def test_facets_are_dropped_only_when_availability_flips(self):
+        generation = get_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            add_item(self.cart, self.bag)
+            decrease_item(CartItem.objects.get(cart=self.cart))
+        # Stock moved but the product stayed available: the facet cache is kept
+        self.assertEqual(get_generation(), generation)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_item(self.cart, self.bag, quantity=3)
+        self.assertEqual(get_generation(), generation + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            decrease_item(CartItem.objects.get(cart=self.cart))
+        self.assertEqual(get_generation(), generation + 2)
+
+    def test_full_save_keeps_the_reservation_counter(self):
+        stale = Product.objects.get(pk=self.bag.pk)
+        add_item(self.cart, self.bag, quantity=2)
+        stale.stock = 10
+        stale.save()
+        self.assertEqual((self.fresh_bag().stock, self.fresh_bag().reserved), (10, 2))
+
+
+class RecaptchaClientTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = StubVerifier().start()
+        self.addCleanup(self.stub.stop)
+
+    def client_for(self, **kwargs):
+        client = RecaptchaClient('secret', self.stub.url, **kwargs)
+        self.addCleanup(client.pool.close)
+        return client
+
+    def test_verifies_over_one_kept_alive_connection(self):
+        client = self.client_for()
+        self.assertTrue(client.verify('token-1'))
+        self.assertFalse(client.verify('bad-token'))
+        self.assertTrue(client.verify('token-2', remote_ip='127.0.0.1'))
+        self.assertEqual((self.stub.requests, self.stub.connections), (3, 1))
+
+    def test_async_path(self):
+        client = self.client_for()
+
+        async def verify_both():
+            return await asyncio.gather(client.averify('token-1'), client.averify('bad-token'))
+
+        self.assertEqual(asyncio.run(verify_both()), [True, False])
+
+    def test_every_call_asks_the_verifier(self):
+        client = self.client_for()
+        self.assertTrue(client.verify('token-1'))
+        # Nothing remembered process-wide: a replayed token is for the verifier to judge
+        self.assertTrue(client.verify('token-1'))
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_breaker_opens_on_failures_and_probes_after_cooldown(self):
+        client = self.client_for(breaker_failures=2, breaker_cooldown=0.1)
+        self.stub.failing = True
+        for _ in range(2):
+            with self.assertRaises(VerifierUnavailable):
+                client.verify('token-1')
+        self.assertFalse(client.available())
+        with self.assertRaises(VerifierUnavailable):
+            client.verify('token-1')
+        self.assertEqual(self.stub.requests, 2)
+
+        time.sleep(0.15)
+        self.stub.failing = False
+        self.assertTrue(client.available())
+        self.assertTrue(client.verify('token-1'))
+        self.assertTrue(client.available())
+
+    def test_slow_answers_trip_the_breaker(self):
+        client = self.client_for(slow_threshold=0.01, breaker_failures=2)
+        self.stub.latency = 0.03
+        # Slow but answered: the answer still counts
+        self.assertTrue(client.verify('token-1'))
+        self.assertTrue(client.verify('token-2'))
+        self.assertFalse(client.available())
+
+    def test_timeout_is_unavailable(self):
+        client = self.client_for(timeout=0.05)
+        self.stub.latency = 0.2
+        with self.assertRaises(VerifierUnavailable):
+            client.verify('token-1')
+
+
+class CheckoutCaptchaTests(TestCase):
+    shipping = PlaceOrderTests.shipping
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.shoe = make_product(Category.objects.create(name='Chaussures'), name='Air Max', stock=5)
+
+    def setUp(self):
+        cache.clear()
+        self.stub = StubVerifier().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(
+            RECAPTCHA_SITE_KEY='site', RECAPTCHA_SECRET_KEY='secret', RECAPTCHA_VERIFY_URL=self.stub.url,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        add_item(Cart.objects.create(user=self.user), self.shoe)
+        self.client.force_login(self.user)
+
+    def test_order_with_a_verified_token(self):
+        response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['recaptcha_site_key'], 'site')
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'g-recaptcha-response': 'token-1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Order.objects.filter(user=self.user).exists())
+
+    def test_resubmitted_form_reuses_the_token_of_its_session(self):
+        self.client.get(reverse('checkout'))
+        response = self.client.post(
+            reverse('confirm_order'), {**self.shipping, 'commune': '', 'g-recaptcha-response': 'token-1'},
+        )
+        self.assertContains(response, 'La commune est obligatoire.')
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'g-recaptcha-response': 'token-1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stub.requests, 1)
+        # Spent by the order: the next one asks the verifier again
+        self.assertNotIn('recaptcha_verified', self.client.session)
+
+    def test_verified_token_is_not_reused_by_another_session(self):
+        self.client.get(reverse('checkout'))
+        self.client.post(reverse('confirm_order'), {**self.shipping, 'commune': '', 'g-recaptcha-response': 'token-1'})
+        bot = CustomUser.objects.create_user('bot', password='secret-pass-123')
+        add_item(Cart.objects.create(user=bot), self.shoe)
+        other = Client()
+        other.force_login(bot)
+        other.get(reverse('checkout'))
+        other.post(reverse('confirm_order'), {**self.shipping, 'g-recaptcha-response': 'token-1'})
+        # Asked again: Google answers an already-used token with timeout-or-duplicate
+        self.assertEqual(self.stub.requests, 2)
+
+    async def test_async_views_verify_through_the_session_async_api(self):
+        request = RequestFactory().post(reverse('confirm_order'))
+        request.session = SessionStore()
+        self.assertTrue(await averify_for_session(request, 'token-1'))
+        self.assertTrue(await averify_for_session(request, 'token-1'))
+        self.assertFalse(await averify_for_session(request, 'bad-token'))
+        self.assertEqual(self.stub.requests, 2)
+        await aforget_verified(request)
+        self.assertIsNone(await request.session.aget('recaptcha_verified'))
+
+    def test_rejected_token(self):
+        self.client.get(reverse('checkout'))
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'g-recaptcha-response': 'bad-token'})
+        self.assertContains(response, 'La vérification reCAPTCHA a échoué')
+        self.assertFalse(Order.objects.exists())
+
+    def test_unavailable_verifier_falls_back_to_the_math_captcha(self):
+        self.client.get(reverse('checkout'))
+        self.stub.failing = True
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'g-recaptcha-response': 'token-1'})
+        self.assertEqual(response.context['recaptcha_site_key'], '')
+        self.assertFalse(Order.objects.exists())
+
+        answer = self.client.session['captcha_answer']
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'captcha': str(answer)})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Order.objects.exists())
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_math_answer_is_refused_when_recaptcha_was_shown(self):
+        self.client.get(reverse('checkout'))
+        answer = self.client.session['captcha_answer']
+        response = self.client.post(reverse('confirm_order'), {**self.shipping, 'captcha': str(answer)})
+        self.assertContains(response, "Je ne suis pas un robot")
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(RECAPTCHA_SITE_KEY='', RECAPTCHA_SECRET_KEY='')
+class CartQueryBudgetTests(TestCase):
+    """The cart and checkout pages run the same number of queries for 1 line as for 100"""
+
+    SCALES = {'small': 1, 'large': 100}
+    # Page -> queries on cold caches
+    BUDGETS = {
+        'cart': 5,
+        'cart_count': 3,
+        'checkout': 8,
+        'add_to_cart': 17,
+        'remove_from_cart': 13,
+        'confirm_order': 29,
+        'checkout_success': 6,
+        'checkout_cancel': 3,
+    }
+    shipping = PlaceOrderTests.shipping
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        category = Category.objects.create(name='Chaussures')
+        cls.products = [make_product(category, name=f'Produit {index}') for index in range(101)]
+
+    def steps(self, extra):
+        """(page, method, URL or a callable giving it, data or a callable giving it, headers) in checkout order"""
+        return [
+            ('cart', 'get', reverse('cart'), {}, {}),
+            ('cart_count', 'get', reverse('cart_count'), {}, {}),
+            ('checkout', 'get', reverse('checkout'), {}, {}),
+            ('add_to_cart', 'post', reverse('add_to_cart', args=[extra.pk]), {}, {'X-Requested-With': 'XMLHttpRequest'}),
+            (
+                'remove_from_cart', 'post',
+                lambda: reverse('remove_from_cart', args=[CartItem.objects.get(product=extra).pk]), {}, {},
+            ),
+            (
+                'confirm_order', 'post', reverse('confirm_order'),
+                lambda: {**self.shipping, 'captcha': str(self.client.session['captcha_answer'])}, {},
+            ),
+            (
+                'checkout_success', 'get',
+                lambda: reverse('checkout_success', args=[Order.objects.get(user=self.user).order_number]), {}, {},
+            ),
+            ('checkout_cancel', 'get', reverse('checkout_cancel'), {}, {}),
+        ]
+
+    def test_every_page_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('cart.urls').url_patterns}
+        self.assertEqual(names, set(self.BUDGETS))
+        self.assertEqual([step[0] for step in self.steps(self.products[0])], list(self.BUDGETS))
+
+    def test_queries_do_not_grow_with_the_cart(self):
+        self.client.force_login(self.user)
+        extra = self.products[-1]
+        for scale, lines in self.SCALES.items():
+            cart, _ = Cart.objects.get_or_create(user=self.user)
+            for product in self.products[:lines]:
+                add_item(cart, product)
+            for name, method, url, data, headers in self.steps(extra):
+                url = url() if callable(url) else url
+                data = data() if callable(data) else data
+                # Cold caches: the budget holds on a miss
+                cache.clear()
+                with self.subTest(name, scale=scale), self.assertNumQueries(self.BUDGETS[name]):
+                    response = getattr(self.client, method)(url, data, headers=headers)
+                self.assertLess(response.status_code, 400, name)
+            # The next scale's order is the only one again
+            Order.objects.all().delete()
+
+
+class CheckoutBenchmarkTests(TestCase):
+    def test_stored_baselines_cover_the_benchmarked_views(self):
+        baselines = load_baselines(BASELINES)
+        self.assertEqual(set(baselines), {'add_to_cart', 'confirm_order'})
+        self.assertTrue(all(value > 0 for value in baselines.values()))
+
+    def test_slowdowns_past_the_tolerance_are_regressions(self):
+        baselines = {'add_to_cart': 10.0, 'confirm_order': 20.0}
+        results = {'add_to_cart': 12.4, 'confirm_order': 25.5, 'unknown': 99.0}
+        self.assertEqual(regressions(results, baselines, 0.25), [('confirm_order', 25.5, 20.0)])
+        self.assertEqual(regressions(results, baselines, 0.3), [])
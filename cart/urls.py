@@ -1,11 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Async cart views under ASGI only, as for the catalog views (shop.urls)
+if settings.ASYNC_VIEWS:
+    add_to_cart, remove_from_cart, update_cart_count = views.aadd_to_cart, views.aremove_from_cart, views.aupdate_cart_count
+else:
+    add_to_cart, remove_from_cart, update_cart_count = views.add_to_cart, views.remove_from_cart, views.update_cart_count
+
 urlpatterns = [
     path('', views.cart_view, name='cart'),
-    path('add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
-    path('count/', views.update_cart_count, name='cart_count'),
+    path('add/<int:product_id>/', add_to_cart, name='add_to_cart'),
+    path('remove/<int:item_id>/', remove_from_cart, name='remove_from_cart'),
+    path('count/', update_cart_count, name='cart_count'),
     path('checkout/', views.checkout, name='checkout'),
     path('checkout/confirm/', views.confirm_order, name='confirm_order'),
     path('checkout/success/<str:order_number>/', views.checkout_success, name='checkout_success'),
@@ -1,131 +1,207 @@
-from django.shortcuts import render, get_object_or_404, redirect
+import random
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.views.decorators.http import require_POST
 from django.urls import reverse
 from django.conf import settings
+from .captcha import (
+    VerifierUnavailable, forget_verified, get_recaptcha_client, recaptcha_enabled, verify_for_session,
+)
+from .cart import add_item, aget_cart_count, decrease_item, get_cart_count, remove_item
+from .checkout import place_order
+from .exceptions import EmptyCart, InsufficientStock
 from .models import Cart, CartItem
-from shop.models import Product, Order, OrderItem
+from shop.cards import render_cards
+from shop.models import Product, Order
 
 @login_required
 def cart_view(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
-    return render(request, 'cart/cart.html', {'cart': cart})
+    # Totals are stored on the cart, products come in with the items in one query
+    items = list(cart.items.select_related('product'))
+    cards = render_cards([item.product for item in items], 'partials/cart_product.html', request)
+    for item, card in zip(items, cards):
+        item.product_card = card
+    return render(request, 'cart/cart.html', {'cart': cart, 'items': items})
 
-@login_required
-@require_POST
-def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    
-    # Check stock
-    if product.stock <= 0:
-        messages.error(request, "Désolé, ce produit est en rupture de stock.")
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({
-                'success': False,
-                'message': "Rupture de stock"
-            })
-        return redirect('product_detail', product_id=product_id)
-    
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
-    
-    if not created:
-        # Check if we have enough stock
-        if cart_item.quantity >= product.stock:
-            messages.warning(request, f"Stock limité! Il ne reste que {product.stock} unité(s) de {product.name}.")
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return JsonResponse({
-                    'success': False,
-                    'message': f"Stock limité! Il ne reste que {product.stock} unité(s)."
-                })
-            return redirect('product_detail', product_id=product_id)
-        
-        cart_item.quantity += 1
-        cart_item.save()
-    
+def _ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def _out_of_stock(request, product_id):
+    messages.error(request, "Désolé, ce produit est en rupture de stock.")
+    if _ajax(request):
+        return JsonResponse({
+            'success': False,
+            'message': "Rupture de stock"
+        })
+    return redirect('product_detail', product_id=product_id)
+
+def _limited_stock(request, product):
+    messages.warning(request, f"Stock limité! Il ne reste que {product.available} unité(s) de {product.name}.")
+    if _ajax(request):
+        return JsonResponse({
+            'success': False,
+            'message': f"Stock limité! Il ne reste que {product.available} unité(s)."
+        })
+    return redirect('product_detail', product_id=product.pk)
+
+def _added(request, cart, product):
     messages.success(request, f"{product.name} ajouté au panier!")
     
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+    if _ajax(request):
         return JsonResponse({
             'success': True,
             'cart_count': cart.total_items,
             'message': f"{product.name} ajouté au panier!"
         })
     
-    return redirect('product_detail', product_id=product_id)
+    return redirect('product_detail', product_id=product.pk)
 
 @login_required
 @require_POST
-def remove_from_cart(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    product_name = cart_item.product.name
+def add_to_cart(request, product_id):
+    product = get_object_or_404(Product, id=product_id)
+    
+    # Check stock (units held by other carts are not available)
+    if product.available <= 0:
+        return _out_of_stock(request, product_id)
     
+    cart, created = Cart.objects.get_or_create(user=request.user)
+    
+    try:
+        # Holds the unit for the cart until CART_RESERVATION_TTL runs out
+        add_item(cart, product)
+    except InsufficientStock:
+        product.refresh_from_db(fields=['stock', 'reserved'])
+        return _limited_stock(request, product)
+    return _added(request, cart, product)
+
+@login_required
+@require_POST
+async def aadd_to_cart(request, product_id):
+    """add_to_cart for ASGI"""
+    product = await aget_object_or_404(Product, id=product_id)
+    if product.available <= 0:
+        return _out_of_stock(request, product_id)
+    
+    cart, created = await Cart.objects.aget_or_create(user=await request.auser())
+    
+    try:
+        # Transactions are sync only: the helper runs on the request's sync thread
+        await sync_to_async(add_item)(cart, product)
+    except InsufficientStock:
+        await product.arefresh_from_db(fields=['stock', 'reserved'])
+        return _limited_stock(request, product)
+    return _added(request, cart, product)
+
+def _remove(request, cart_item):
+    """decrease_item or remove_item, as the form asked, then the message to show"""
+    product_name = cart_item.product.name
     # If this is a quantity decrease (not complete removal)
     if 'action' in request.POST and request.POST['action'] == 'decrease':
         if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-            messages.info(request, f"Quantité de {product_name} diminuée.")
-        else:
-            cart_item.delete()
-            messages.success(request, f"{product_name} retiré du panier!")
-    else:
-        # Complete removal
-        cart_item.delete()
-        messages.success(request, f"{product_name} retiré du panier!")
-    
-    cart = Cart.objects.get(user=request.user)
+            decrease_item(cart_item)
+            return messages.INFO, f"Quantité de {product_name} diminuée."
+        decrease_item(cart_item)
+        return messages.SUCCESS, f"{product_name} retiré du panier!"
+    # Complete removal
+    remove_item(cart_item)
+    return messages.SUCCESS, f"{product_name} retiré du panier!"
+
+def _removed(request, cart_item, level, message):
+    messages.add_message(request, level, message)
     
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+    if _ajax(request):
         return JsonResponse({
             'success': True,
-            'cart_count': cart.total_items,
-            'message': f"{product_name} retiré du panier!"
+            'cart_count': cart_item.cart.total_items,
+            'message': f"{cart_item.product.name} retiré du panier!"
         })
     
     return redirect('cart')
 
+@login_required
+@require_POST
+def remove_from_cart(request, item_id):
+    cart_item = get_object_or_404(
+        CartItem.objects.select_related('cart', 'product'),
+        id=item_id,
+        cart__user=request.user,
+    )
+    return _removed(request, cart_item, *_remove(request, cart_item))
+
+@login_required
+@require_POST
+async def aremove_from_cart(request, item_id):
+    """remove_from_cart for ASGI"""
+    cart_item = await aget_object_or_404(
+        CartItem.objects.select_related('cart', 'product'),
+        id=item_id,
+        cart__user=await request.auser(),
+    )
+    return _removed(request, cart_item, *await sync_to_async(_remove)(request, cart_item))
+
+def _cart_count_response(request, user, count):
+    etag = quote_etag(f'cart-{user.pk}-{count}')
+    response = get_conditional_response(request, etag=etag) or JsonResponse({'cart_count': count})
+    response.headers.setdefault('ETag', etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 @login_required
 def update_cart_count(request):
-    """API endpoint to get current cart count"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return JsonResponse({'cart_count': cart.total_items})
+    """API endpoint to get current cart count (read only, answered from the cache)"""
+    return _cart_count_response(request, request.user, get_cart_count(request.user.pk))
+
+@login_required
+async def aupdate_cart_count(request):
+    """update_cart_count for ASGI"""
+    user = await request.auser()
+    return _cart_count_response(request, user, await aget_cart_count(user.pk))
+
+
+def _captcha_context(request, fallback=False):
+    """
+    Template context for the checkout's captcha.
+
+    reCAPTCHA when it is configured and its verifier answers, otherwise a
+    math captcha; the choice is kept in the session so confirm_order checks
+    the captcha that was actually shown.
+    """
+    fallback = fallback or not recaptcha_enabled() or not get_recaptcha_client().available()
+    num1 = random.randint(1, 10)
+    num2 = random.randint(1, 10)
+    request.session['captcha_answer'] = num1 + num2
+    request.session['captcha_fallback'] = fallback
+    return {
+        'recaptcha_site_key': '' if fallback else settings.RECAPTCHA_SITE_KEY,
+        'captcha_num1': num1,
+        'captcha_num2': num2,
+    }
 
 
 @login_required
 def checkout(request):
     """Display checkout page with shipping form"""
     cart, _ = Cart.objects.get_or_create(user=request.user)
-    if cart.items.count() == 0:
+    if cart.item_count == 0:
         messages.warning(request, "Votre panier est vide.")
         return redirect('cart')
     
     # Get wilaya choices for the form
     wilaya_choices = Order.WILAYA_CHOICES
     
-    # Check if reCAPTCHA is configured
-    recaptcha_site_key = getattr(settings, 'RECAPTCHA_SITE_KEY', '')
-    
-    # Generate math CAPTCHA as fallback
-    import random
-    num1 = random.randint(1, 10)
-    num2 = random.randint(1, 10)
-    captcha_answer = num1 + num2
-    request.session['captcha_answer'] = captcha_answer
-    
     return render(request, 'cart/checkout.html', {
         'cart': cart,
+        'items': cart.items.select_related('product'),
         'wilaya_choices': wilaya_choices,
-        'recaptcha_site_key': recaptcha_site_key,
-        'captcha_num1': num1,
-        'captcha_num2': num2,
+        **_captcha_context(request),
     })
 
 
@@ -134,7 +210,7 @@ def checkout(request):
 def confirm_order(request):
     """Process the order form and create order"""
     cart, _ = Cart.objects.get_or_create(user=request.user)
-    if cart.items.count() == 0:
+    if cart.item_count == 0:
         messages.error(request, "Votre panier est vide.")
         return redirect('cart')
     
@@ -163,27 +239,19 @@ def confirm_order(request):
     if not address:
         errors.append("L'adresse est obligatoire.")
     
-    # Verify CAPTCHA (reCAPTCHA or math fallback)
-    recaptcha_site_key = getattr(settings, 'RECAPTCHA_SITE_KEY', '')
-    recaptcha_secret_key = getattr(settings, 'RECAPTCHA_SECRET_KEY', '')
-    
-    if recaptcha_site_key and recaptcha_secret_key:
-        # Verify Google reCAPTCHA
+    # Verify the CAPTCHA the checkout page showed (reCAPTCHA or math fallback)
+    verifier_down = False
+    if recaptcha_enabled() and not request.session.get('captcha_fallback'):
         recaptcha_response = request.POST.get('g-recaptcha-response', '')
         if not recaptcha_response:
             errors.append("Veuillez cocher la case 'Je ne suis pas un robot'.")
         else:
-            import requests
-            verify_url = 'https://www.google.com/recaptcha/api/siteverify'
             try:
-                verify_response = requests.post(verify_url, data={
-                    'secret': recaptcha_secret_key,
-                    'response': recaptcha_response
-                }, timeout=5)
-                if not verify_response.json().get('success', False):
+                if not verify_for_session(request, recaptcha_response):
                     errors.append("La vérification reCAPTCHA a échoué. Veuillez réessayer.")
-            except:
-                errors.append("Erreur de vérification. Veuillez réessayer.")
+            except VerifierUnavailable:
+                verifier_down = True
+                errors.append("La vérification reCAPTCHA est indisponible. Veuillez résoudre le calcul.")
     else:
         # Fallback to math CAPTCHA
         captcha_answer = request.session.get('captcha_answer')
@@ -200,58 +268,41 @@ def confirm_order(request):
     
     if errors:
         wilaya_choices = Order.WILAYA_CHOICES
-        # Generate new CAPTCHA for retry
-        import random
-        num1 = random.randint(1, 10)
-        num2 = random.randint(1, 10)
-        request.session['captcha_answer'] = num1 + num2
+        # New CAPTCHA for the retry, the math one if the verifier just failed
         return render(request, 'cart/checkout.html', {
             'cart': cart,
+            'items': cart.items.select_related('product'),
             'wilaya_choices': wilaya_choices,
             'errors': errors,
             'form_data': request.POST,
-            'recaptcha_site_key': recaptcha_site_key,
-            'captcha_num1': num1,
-            'captcha_num2': num2,
+            **_captcha_context(request, fallback=verifier_down),
         })
     
     # Clear CAPTCHA from session
-    if 'captcha_answer' in request.session:
-        del request.session['captcha_answer']
-    
-    # Create the order
-    order = Order.objects.create(
-        user=request.user,
-        total_price=cart.total_price,
-        full_name=full_name,
-        phone=phone,
-        wilaya=wilaya,
-        commune=commune,
-        address=address,
-        postal_code=postal_code,
-        notes=notes if notes else None,
-        status='pending'
-    )
+    request.session.pop('captcha_answer', None)
+    request.session.pop('captcha_fallback', None)
     
-    # Create order items and update stock
-    for item in cart.items.all():
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity,
-            price=item.product.price
+    try:
+        order = place_order(
+            cart,
+            request.user,
+            full_name=full_name,
+            phone=phone,
+            wilaya=wilaya,
+            commune=commune,
+            address=address,
+            postal_code=postal_code,
+            notes=notes if notes else None,
         )
-        # Reduce stock
-        item.product.stock = max(0, item.product.stock - item.quantity)
-        item.product.save()
-    
-    # Add points to user
-    request.user.points += cart.total_items
-    request.user.save()
-    
-    # Clear cart
-    cart.items.all().delete()
+    except InsufficientStock as e:
+        names = ', '.join(product.name for product in e.products)
+        messages.error(request, f"Stock insuffisant pour : {names}. Veuillez ajuster votre panier.")
+        return redirect('cart')
+    except EmptyCart:
+        messages.error(request, "Votre panier est vide.")
+        return redirect('cart')
     
+    forget_verified(request)
     messages.success(request, f"Votre commande #{order.order_number} a été confirmée!")
     return redirect('checkout_success', order_number=order.order_number)
 
@@ -259,7 +310,10 @@ def confirm_order(request):
 @login_required
 def checkout_success(request, order_number):
     """Display order confirmation page"""
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    # Lines and their products in two queries, however long the order
+    order = get_object_or_404(
+        Order.objects.prefetch_related('items__product'), order_number=order_number, user=request.user,
+    )
     return render(request, 'cart/checkout_success.html', {'order': order})
 
 
@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# The catalog views that overlap their reads (settings.ASYNC_VIEWS)
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_STARTUP:
+    # Before the server takes traffic (shop.warmup)
+    from shop.warmup import warm_up
+
+    warm_up()
@@ -67,12 +67,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First: its latency covers every other middleware (shop.metrics)
+    'shop.metrics.MetricsMiddleware',
+    # Appends request traces to LOADTEST_RECORD_PATH when it is set (shop.loadtest)
+    'shop.loadtest.TraceRecorderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Sends the reads of catalog and leaderboard GETs to the replica
+    'shop.replicas.ReplicaMiddleware',
+    # Needs the user, and must see the messages cookie on the way out
+    'shop.page_cache.AnonymousPageCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,7 +89,9 @@ ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing renders for shop.metrics
+        'BACKEND': 'shop.metrics.DjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates'],  # Add this line
         'APP_DIRS': True,
         'OPTIONS': {
@@ -91,6 +101,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'shop.context_processors.language_context',
+                'cart.context_processors.cart_count',
             ],
         },
     },
@@ -111,8 +122,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # Writers take the lock at BEGIN and queue behind each other (up to
+            # timeout seconds) instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # A file, not the shared-cache in-memory database, so concurrent
+            # checkout tests get SQLite's real locking
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Catalog and leaderboard reads (shop.replicas). With SQLite a copy of the
+    # primary made by `manage.py refresh_replica`; point it at a streaming
+    # replica on other backends
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': 'PRAGMA query_only = ON',
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
+DATABASE_ROUTERS = ['shop.replicas.ReplicaRouter']
 
 
 # Password validation
@@ -145,6 +182,12 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATIC_URL = '/static/'
+# collectstatic's target: hashed names and their gzip copies (shop.staticfiles)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'shop.staticfiles.PrecompressedManifestStaticFilesStorage'},
+}
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
@@ -152,6 +195,72 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Make sure DEBUG is True in development
 DEBUG = True
 
+# Cache. Besides cached values it holds the invalidation state every worker must see:
+# the page cache's tag versions (shop.page_cache), the facet and product card
+# generations (shop.facets, shop.cards) and the ranking generation (shop.ranking).
+# LocMemCache is private to its process: with it, a change only reaches the pages,
+# facets and ranking tree of the process that made it; the others serve stale pages,
+# facets and cards until their timeouts and keep their ranking tree. Run a single
+# process with it, or set REDIS_URL (e.g. redis://127.0.0.1:6379/0, needs the redis
+# package) so all workers share one cache.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'pointsshop',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pointsshop',
+        }
+    }
+
+# Catalog listing: products rendered per page / infinite-scroll fragment
+PRODUCTS_PER_PAGE = 24
+# Seconds a facet result (sidebar counts, totals) stays cached
+FACET_CACHE_TIMEOUT = 300
+# Seconds a rendered product card stays cached (dropped when its product changes)
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Seconds an anonymous catalog page stays cached (dropped earlier when what it shows changes)
+PAGE_CACHE_TIMEOUT = 120
+# Threads resizing uploaded images in the background (0: resize inline, after the commit)
+IMAGE_WORKERS = 2
+# WebP/JPEG quality of the resized images
+IMAGE_QUALITY = 80
+# Seconds the navigation cart badge count stays cached (cleared on cart changes)
+CART_COUNT_CACHE_TIMEOUT = 600
+# Seconds an add-to-cart holds the units before release_expired_reservations returns them
+CART_RESERVATION_TTL = 15 * 60
+# Least seconds between two rebuilds of a process's ranking tree when other processes changed points
+RANKING_REFRESH = 60
+# Serve home, products and product_detail with their async views, which overlap their
+# reads; set by core.asgi. Under WSGI the sync views skip the event loop and thread hops
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+# Load catalogs, URL resolvers and templates when a worker starts, not on its first requests
+WARMUP_ON_STARTUP = True
+# Database alias of the read replica (shop.replicas)
+REPLICA_DATABASE = 'replica'
+# Seconds between two copies of the SQLite primary to the replica (refresh_replica)
+REPLICA_REFRESH_INTERVAL = 5
+# Seconds the replica may lag: an older SQLite copy is not used, and a visitor who
+# wrote reads from the primary for as long
+REPLICA_MAX_LAG = 15
+# Share of requests whose queries, database and render time are recorded (shop.metrics)
+METRICS_SAMPLE_RATE = 1.0
+# Seconds a process keeps its metrics before adding them to the cache
+METRICS_FLUSH_INTERVAL = 10
+# Bearer token of the /metrics scraper (staff users can always read it)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# JSON lines file the sanitized request traces are appended to, for loadtest_replay (empty: not recorded)
+LOADTEST_RECORD_PATH = os.environ.get('LOADTEST_RECORD_PATH', '')
+# Referred users listed per page on the profile
+REFERRALS_PER_PAGE = 20
+
 # Stripe settings (use environment variables for keys)
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
@@ -161,3 +270,15 @@ STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
 # Use reCAPTCHA v2 "I'm not a robot" Checkbox
 RECAPTCHA_SITE_KEY = os.environ.get('RECAPTCHA_SITE_KEY', '6LfULycsAAAAACKLv-uCFX8_h1B0ImWDrOdJ15nv')
 RECAPTCHA_SECRET_KEY = os.environ.get('RECAPTCHA_SECRET_KEY', '6LfULycsAAAAANgleCLjLqwTuKPKc4ZZpetq6fD2')
+# siteverify endpoint (point it at `manage.py recaptcha_stub` for local tests and benchmarks)
+RECAPTCHA_VERIFY_URL = os.environ.get('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+# Seconds to wait for the verifier, and answers slower than this count against it
+RECAPTCHA_TIMEOUT = 3
+RECAPTCHA_SLOW_THRESHOLD = 1
+# Idle keep-alive connections kept to the verifier per process
+RECAPTCHA_POOL_SIZE = 4
+# Consecutive failures that switch checkout to the math captcha, and for how many seconds
+RECAPTCHA_BREAKER_FAILURES = 3
+RECAPTCHA_BREAKER_COOLDOWN = 30
+# Seconds a verified token is remembered for its session (Google accepts a token only once)
+RECAPTCHA_TOKEN_CACHE_TIMEOUT = 120
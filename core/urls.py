@@ -1,13 +1,20 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf.urls.i18n import i18n_patterns
 from django.conf import settings
 from django.conf.urls.static import static
 
+from shop.metrics import metrics_view
+from shop.staticfiles import serve as serve_static
+
 # Non-localized URLs
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('i18n/', include('django.conf.urls.i18n')),
+    # Collected static files, when no web server in front serves them
+    re_path(r'^static/(?P<path>.+)$', serve_static),
+    # Prometheus scrape endpoint (shop.metrics)
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Localized URLs - these will have language prefix like /en/, /fr/, /ar/
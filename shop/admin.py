@@ -3,17 +3,40 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Category, Product, Order, OrderItem, MonthlyLeaderboard
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.db import transaction
+from django.utils import timezone
+from .models import CustomUser, Category, Product, Order, OrderItem, MonthlyLeaderboard, LeaderboardSnapshot, PointsTransaction, ReferralStats
+from .exports import export_response
+from .forms import CustomUserChangeForm
+from .pagination import EstimatedCountPaginator
+from .points import award
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'points', 'referral_code', 'referred_by', 'created_at')
     list_filter = ('referred_by', 'created_at')
+    form = CustomUserChangeForm
+    # The balance is never written from the form: the form's copy is stale as soon as award() runs elsewhere
+    readonly_fields = ('points',)
     fieldsets = UserAdmin.fieldsets + (
         ('Points System', {
-            'fields': ('points', 'referral_code', 'referred_by')
+            'fields': ('points', 'points_adjustment', 'referral_code', 'referred_by')
         }),
     )
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # Only the edited fields are written, so points awarded while the form was open survive;
+        # an adjustment goes through the ledger and award()'s F() update
+        columns = {field.name for field in obj._meta.concrete_fields}
+        with transaction.atomic():
+            obj.save(update_fields=[name for name in form.changed_data if name in columns])
+            adjustment = form.cleaned_data.get('points_adjustment')
+            if adjustment:
+                award(obj, adjustment, PointsTransaction.ADJUSTMENT)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -57,6 +80,29 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('product', 'quantity', 'price')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+def status_action(status):
+    """Admin action moving the selected orders to status, in one UPDATE"""
+    label = dict(Order.STATUS_CHOICES)[status]
+    sources = Order.STATUS_TRANSITIONS[status]
+
+    @admin.action(permissions=['change'], description=f'Passer les commandes sélectionnées à « {label} »')
+    def action(modeladmin, request, queryset):
+        # Orders in any other status are left as they are
+        moved = queryset.filter(status__in=sources).update(status=status, updated_at=timezone.now())
+        message = f'{moved} commande(s) passée(s) à « {label} ».'
+        if request.POST.get('select_across') != '1':
+            skipped = len(request.POST.getlist(ACTION_CHECKBOX_NAME)) - moved
+            if skipped > 0:
+                message += f' {skipped} ignorée(s) : statut incompatible.'
+        modeladmin.message_user(request, message)
+
+    action.__name__ = f'mark_{status}'
+    return action
+
 
 # Re-register Order with inline items
 admin.site.unregister(Order)
@@ -64,13 +110,19 @@ admin.site.unregister(Order)
 
 @admin.register(Order)
 class OrderAdminWithItems(admin.ModelAdmin):
-    list_display = ('order_number', 'full_name', 'phone', 'wilaya', 'total_price', 'status', 'created_at')
+    list_display = ('order_number', 'user', 'full_name', 'phone', 'wilaya', 'total_price', 'status', 'created_at')
     list_filter = ('status', 'wilaya', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('order_number', 'full_name', 'phone', 'address', 'commune')
     list_editable = ('status',)
     readonly_fields = ('order_number', 'created_at', 'updated_at', 'user')
     ordering = ('-created_at',)
+    date_hierarchy = 'created_at'
     inlines = [OrderItemInline]
+    actions = [status_action(status) for status in Order.STATUS_TRANSITIONS] + ['export_csv', 'export_jsonl']
+    # No COUNT over the whole table on every page
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Order Info', {
@@ -87,13 +139,48 @@ class OrderAdminWithItems(admin.ModelAdmin):
         }),
     )
 
+    # Streamed as they are read: with "select all", a day's worth of orders in constant memory
+    @admin.action(permissions=['view'], description='Exporter les commandes sélectionnées (CSV)')
+    def export_csv(self, request, queryset):
+        return export_response(queryset, 'csv')
+
+    @admin.action(permissions=['view'], description='Exporter les commandes sélectionnées (JSON lines)')
+    def export_jsonl(self, request, queryset):
+        return export_response(queryset, 'jsonl')
+
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('order', 'product', 'quantity', 'price')
     list_filter = ('order__status',)
+    list_select_related = ('order', 'product')
+    raw_id_fields = ('order', 'product')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(MonthlyLeaderboard)
 class MonthlyLeaderboardAdmin(admin.ModelAdmin):
     list_display = ('month', 'user', 'points', 'rank')
     list_filter = ('month',)
-    ordering = ('month', 'rank')
\ No newline at end of file
+    ordering = ('month', 'rank')
+
+@admin.register(LeaderboardSnapshot)
+class LeaderboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('month', 'status', 'ranked', 'keep', 'created_at', 'completed_at')
+    readonly_fields = ('month', 'status', 'keep', 'last_user_id', 'last_points', 'last_rank', 'ranked', 'completed_at')
+
+
+@admin.register(PointsTransaction)
+class PointsTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'delta', 'reason', 'order', 'created_at')
+    list_filter = ('reason', 'created_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user', 'order', 'referral')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(ReferralStats)
+class ReferralStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'direct_referrals', 'indirect_referrals', 'depth', 'downstream_points')
+    ordering = ('-direct_referrals',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'direct_referrals', 'indirect_referrals', 'depth', 'downstream_points')
@@ -0,0 +1,588 @@
+"""
+Offline build of the site stylesheet.
+
+The templates are styled with Tailwind utility classes, which used to be
+compiled in every visitor's browser by the Tailwind CDN runtime, with icons
+from the full Font Awesome stylesheet and webfonts. build_css() does the
+compilation once, offline: like Tailwind it scans the templates and scripts
+for every token that could be a class name and writes CSS for the ones it
+knows, so the stylesheet only holds what the site uses. Icons become
+Unicode glyphs (the product types already are emoji), so no font has to be
+downloaded and the site renders without any network access.
+
+The build_assets command writes the result to static/css/site.css; the
+hand-written rules live in static_src/css/, the scripts in static/js/.
+collectstatic then hashes and precompresses everything (shop.staticfiles).
+"""
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+# Tailwind v3 palette, for the colour families the templates use
+PALETTE = {
+    'gray': ['f9fafb', 'f3f4f6', 'e5e7eb', 'd1d5db', '9ca3af', '6b7280', '4b5563', '374151', '1f2937', '111827'],
+    'blue': ['eff6ff', 'dbeafe', 'bfdbfe', '93c5fd', '60a5fa', '3b82f6', '2563eb', '1d4ed8', '1e40af', '1e3a8a'],
+    'green': ['f0fdf4', 'dcfce7', 'bbf7d0', '86efac', '4ade80', '22c55e', '16a34a', '15803d', '166534', '14532d'],
+    'emerald': ['ecfdf5', 'd1fae5', 'a7f3d0', '6ee7b7', '34d399', '10b981', '059669', '047857', '065f46', '064e3b'],
+    'red': ['fef2f2', 'fee2e2', 'fecaca', 'fca5a5', 'f87171', 'ef4444', 'dc2626', 'b91c1c', '991b1b', '7f1d1d'],
+    'orange': ['fff7ed', 'ffedd5', 'fed7aa', 'fdba74', 'fb923c', 'f97316', 'ea580c', 'c2410c', '9a3412', '7c2d12'],
+    'yellow': ['fefce8', 'fef9c3', 'fef08a', 'fde047', 'facc15', 'eab308', 'ca8a04', 'a16207', '854d0e', '713f12'],
+    'purple': ['faf5ff', 'f3e8ff', 'e9d5ff', 'd8b4fe', 'c084fc', 'a855f7', '9333ea', '7e22ce', '6b21a8', '581c87'],
+}
+SHADES = ['50', '100', '200', '300', '400', '500', '600', '700', '800', '900']
+NAMED_COLORS = {'white': 'ffffff', 'black': '000000'}
+
+SCREENS = {'sm': 640, 'md': 768, 'lg': 1024, 'xl': 1280, '2xl': 1536}
+
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'), 'sm': ('0.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'), '5xl': ('3rem', '1'), '6xl': ('3.75rem', '1'),
+}
+FONT_WEIGHTS = {'normal': 400, 'medium': 500, 'semibold': 600, 'bold': 700, 'extrabold': 800}
+SANS = ('ui-sans-serif, system-ui, sans-serif, "Apple Color Emoji", "Segoe UI Emoji", '
+        '"Segoe UI Symbol", "Noto Color Emoji"')
+MONO = 'ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace'
+RADII = {'none': '0px', 'sm': '0.125rem', '': '0.25rem', 'md': '0.375rem', 'lg': '0.5rem', 'xl': '0.75rem',
+         '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px'}
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    '2xl': '0 25px 50px -12px rgb(0 0 0 / 0.25)',
+    'none': '0 0 #0000',
+}
+MAX_WIDTHS = {'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem', '2xl': '42rem',
+              '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem',
+              'full': '100%', 'none': 'none'}
+LEADING = {'none': '1', 'tight': '1.25', 'snug': '1.375', 'normal': '1.5', 'relaxed': '1.625', 'loose': '2'}
+TRACKING = {'tighter': '-0.05em', 'tight': '-0.025em', 'normal': '0em', 'wide': '0.025em',
+            'wider': '0.05em', 'widest': '0.1em'}
+
+TRANSFORM = ('transform: translate(var(--tw-translate-x), var(--tw-translate-y)) rotate(var(--tw-rotate)) '
+             'scaleX(var(--tw-scale-x)) scaleY(var(--tw-scale-y))')
+BOX_SHADOW = 'box-shadow: var(--tw-ring-offset-shadow), var(--tw-ring-shadow), var(--tw-shadow)'
+EASE = 'transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); transition-duration: 150ms'
+
+# Direct children but the first: the space-* and divide-* utilities
+BETWEEN = ' > :not([hidden]) ~ :not([hidden])'
+
+STATIC = {
+    'block': 'display: block', 'inline-block': 'display: inline-block', 'inline': 'display: inline',
+    'flex': 'display: flex', 'inline-flex': 'display: inline-flex', 'grid': 'display: grid',
+    'hidden': 'display: none', 'contents': 'display: contents',
+    'static': 'position: static', 'fixed': 'position: fixed', 'absolute': 'position: absolute',
+    'relative': 'position: relative', 'sticky': 'position: sticky',
+    'visible': 'visibility: visible', 'invisible': 'visibility: hidden',
+    'overflow-hidden': 'overflow: hidden', 'overflow-auto': 'overflow: auto',
+    'overflow-x-auto': 'overflow-x: auto', 'overflow-y-auto': 'overflow-y: auto',
+    'truncate': 'overflow: hidden; text-overflow: ellipsis; white-space: nowrap',
+    'whitespace-nowrap': 'white-space: nowrap', 'select-none': 'user-select: none',
+    'cursor-pointer': 'cursor: pointer', 'cursor-not-allowed': 'cursor: not-allowed', 'cursor-zoom-in': 'cursor: zoom-in',
+    'object-cover': 'object-fit: cover', 'object-contain': 'object-fit: contain',
+    'aspect-square': 'aspect-ratio: 1 / 1',
+    'flex-1': 'flex: 1 1 0%', 'flex-auto': 'flex: 1 1 auto', 'flex-none': 'flex: none',
+    'flex-row': 'flex-direction: row', 'flex-col': 'flex-direction: column', 'flex-wrap': 'flex-wrap: wrap',
+    'flex-shrink-0': 'flex-shrink: 0', 'shrink-0': 'flex-shrink: 0', 'flex-grow': 'flex-grow: 1',
+    'items-start': 'align-items: flex-start', 'items-end': 'align-items: flex-end',
+    'items-center': 'align-items: center', 'items-baseline': 'align-items: baseline',
+    'items-stretch': 'align-items: stretch',
+    'justify-start': 'justify-content: flex-start', 'justify-end': 'justify-content: flex-end',
+    'justify-center': 'justify-content: center', 'justify-between': 'justify-content: space-between',
+    'justify-around': 'justify-content: space-around',
+    'col-span-full': 'grid-column: 1 / -1',
+    'mx-auto': 'margin-left: auto; margin-right: auto', 'ml-auto': 'margin-left: auto', 'mr-auto': 'margin-right: auto',
+    'w-full': 'width: 100%', 'w-auto': 'width: auto', 'w-screen': 'width: 100vw', 'w-fit': 'width: fit-content',
+    'h-full': 'height: 100%', 'h-auto': 'height: auto', 'h-screen': 'height: 100vh', 'h-fit': 'height: fit-content',
+    'min-h-screen': 'min-height: 100vh', 'min-h-full': 'min-height: 100%',
+    'min-w-0': 'min-width: 0px', 'min-w-full': 'min-width: 100%',
+    'max-h-full': 'max-height: 100%', 'max-h-screen': 'max-height: 100vh',
+    'font-sans': f'font-family: {SANS}', 'font-mono': f'font-family: {MONO}',
+    'text-left': 'text-align: left', 'text-center': 'text-align: center', 'text-right': 'text-align: right',
+    'uppercase': 'text-transform: uppercase', 'lowercase': 'text-transform: lowercase',
+    'capitalize': 'text-transform: capitalize', 'italic': 'font-style: italic',
+    'underline': 'text-decoration-line: underline', 'line-through': 'text-decoration-line: line-through',
+    'no-underline': 'text-decoration-line: none',
+    'list-disc': 'list-style-type: disc', 'list-decimal': 'list-style-type: decimal',
+    'list-inside': 'list-style-position: inside',
+    'border': 'border-width: 1px', 'border-0': 'border-width: 0px', 'border-2': 'border-width: 2px',
+    'border-4': 'border-width: 4px',
+    'border-t': 'border-top-width: 1px', 'border-b': 'border-bottom-width: 1px',
+    'border-l': 'border-left-width: 1px', 'border-r': 'border-right-width: 1px',
+    'border-b-2': 'border-bottom-width: 2px', 'border-t-2': 'border-top-width: 2px',
+    'outline-none': 'outline: 2px solid transparent; outline-offset: 2px',
+    'transform': TRANSFORM, 'transform-none': 'transform: none',
+    'transition': ('transition-property: color, background-color, border-color, text-decoration-color, fill, '
+                   'stroke, opacity, box-shadow, transform, filter, backdrop-filter; ' + EASE),
+    'transition-all': 'transition-property: all; ' + EASE,
+    'transition-colors': ('transition-property: color, background-color, border-color, text-decoration-color, '
+                          'fill, stroke; ' + EASE),
+    'transition-transform': 'transition-property: transform; ' + EASE,
+    'transition-opacity': 'transition-property: opacity; ' + EASE,
+    'backdrop-blur-sm': 'backdrop-filter: blur(4px)', 'backdrop-blur': 'backdrop-filter: blur(8px)',
+    'bg-gradient-to-r': 'background-image: linear-gradient(to right, var(--tw-gradient-stops))',
+    'bg-gradient-to-l': 'background-image: linear-gradient(to left, var(--tw-gradient-stops))',
+    'bg-gradient-to-b': 'background-image: linear-gradient(to bottom, var(--tw-gradient-stops))',
+    'bg-gradient-to-br': 'background-image: linear-gradient(to bottom right, var(--tw-gradient-stops))',
+    'line-clamp-1': 'overflow: hidden; display: -webkit-box; -webkit-box-orient: vertical; -webkit-line-clamp: 1',
+    'line-clamp-2': 'overflow: hidden; display: -webkit-box; -webkit-box-orient: vertical; -webkit-line-clamp: 2',
+    'line-clamp-3': 'overflow: hidden; display: -webkit-box; -webkit-box-orient: vertical; -webkit-line-clamp: 3',
+    'animate-ping': 'animation: ping 1s cubic-bezier(0, 0, 0.2, 1) infinite',
+    'animate-spin': 'animation: spin 1s linear infinite',
+    'animate-pulse': 'animation: pulse 2s cubic-bezier(0.4, 0, 0.6, 1) infinite',
+    'prose': 'color: #374151; max-width: 65ch; line-height: 1.75',
+    'prose-gray': 'color: #374151',
+}
+KEYFRAMES = {
+    'animate-ping': '@keyframes ping { 75%, 100% { transform: scale(2); opacity: 0; } }',
+    'animate-spin': '@keyframes spin { to { transform: rotate(360deg); } }',
+    'animate-pulse': '@keyframes pulse { 50% { opacity: .5; } }',
+}
+
+SPACING_PROPERTIES = {
+    'p': ['padding'], 'px': ['padding-left', 'padding-right'], 'py': ['padding-top', 'padding-bottom'],
+    'pt': ['padding-top'], 'pr': ['padding-right'], 'pb': ['padding-bottom'], 'pl': ['padding-left'],
+    'm': ['margin'], 'mx': ['margin-left', 'margin-right'], 'my': ['margin-top', 'margin-bottom'],
+    'mt': ['margin-top'], 'mr': ['margin-right'], 'mb': ['margin-bottom'], 'ml': ['margin-left'],
+    'gap': ['gap'], 'gap-x': ['column-gap'], 'gap-y': ['row-gap'],
+    'w': ['width'], 'h': ['height'], 'max-h': ['max-height'], 'min-h': ['min-height'],
+    'top': ['top'], 'right': ['right'], 'bottom': ['bottom'], 'left': ['left'],
+    'inset': ['top', 'right', 'bottom', 'left'], 'inset-x': ['left', 'right'], 'inset-y': ['top', 'bottom'],
+}
+# Properties that may take a leading minus
+NEGATABLE = {'m', 'mx', 'my', 'mt', 'mr', 'mb', 'ml', 'top', 'right', 'bottom', 'left', 'inset', 'inset-x', 'inset-y'}
+
+# Font Awesome names used by the templates -> glyph; far (regular) variants where they differ
+ICONS = {
+    'arrow-left': '←', 'arrow-right': '→', 'award': '\U0001F3C5', 'bars': '☰', 'bolt': '⚡',
+    'box': '\U0001F4E6', 'cart-plus': '\U0001F6D2', 'chart-bar': '\U0001F4CA', 'check': '✓',
+    'check-circle': '✔', 'chevron-down': '▾', 'chevron-right': '›', 'clock': '\U0001F552',
+    'coins': '\U0001FA99', 'crown': '\U0001F451', 'envelope': '✉', 'exclamation': '!',
+    'exclamation-circle': '❗', 'exclamation-triangle': '⚠', 'eye': '\U0001F441', 'facebook': 'f',
+    'gift': '\U0001F381', 'globe': '\U0001F310', 'grid': '▦', 'heart': '♥', 'home': '\U0001F3E0',
+    'info-circle': 'ℹ', 'instagram': '\U0001F4F7', 'lock': '\U0001F512', 'map-marker-alt': '\U0001F4CD',
+    'minus': '−', 'palette': '\U0001F3A8', 'phone': '\U0001F4DE', 'plus': '+', 'receipt': '\U0001F9FE',
+    'redo': '↻', 'ruler': '\U0001F4CF', 'search': '\U0001F50D', 'search-plus': '\U0001F50D',
+    'shapes': '◆', 'share-alt': '\U0001F517', 'shield-alt': '\U0001F6E1', 'shipping-fast': '\U0001F69A',
+    'shoe-prints': '\U0001F45F', 'shopping-bag': '\U0001F6CD', 'shopping-cart': '\U0001F6D2',
+    'sign-in-alt': '\U0001F511', 'sign-out-alt': '\U0001F6AA', 'spinner': '◌', 'star': '★',
+    'sticky-note': '\U0001F5D2', 'store': '\U0001F3EC', 'tag': '\U0001F3F7', 'times': '✕',
+    'times-circle': '⊗', 'trash': '\U0001F5D1', 'trophy': '\U0001F3C6', 'truck': '\U0001F69A',
+    'twitter': '\U0001D54F', 'undo': '↺', 'user': '\U0001F464', 'user-circle': '\U0001F464',
+    'user-plus': '\U0001F464', 'users': '\U0001F465',
+}
+REGULAR_ICONS = {'heart': '♡', 'star': '☆'}
+
+CANDIDATE_RE = re.compile(r'[^<>"\'`\s{}()]*[^<>"\'`\s{}():,;.]')
+
+PREFLIGHT = """\
+*, ::before, ::after { box-sizing: border-box; border-width: 0; border-style: solid; border-color: #e5e7eb;
+  --tw-translate-x: 0; --tw-translate-y: 0; --tw-rotate: 0; --tw-scale-x: 1; --tw-scale-y: 1;
+  --tw-ring-inset: ; --tw-ring-offset-width: 0px; --tw-ring-offset-color: #fff; --tw-ring-color: rgb(59 130 246 / 0.5);
+  --tw-ring-offset-shadow: 0 0 #0000; --tw-ring-shadow: 0 0 #0000; --tw-shadow: 0 0 #0000; }
+html { line-height: 1.5; -webkit-text-size-adjust: 100%; tab-size: 4; font-family: {sans};
+  -webkit-tap-highlight-color: transparent; }
+body { margin: 0; line-height: inherit; }
+hr { height: 0; color: inherit; border-top-width: 1px; }
+h1, h2, h3, h4, h5, h6 { font-size: inherit; font-weight: inherit; }
+a { color: inherit; text-decoration: inherit; }
+b, strong { font-weight: bolder; }
+code, kbd, samp, pre { font-family: {mono}; font-size: 1em; }
+small { font-size: 80%; }
+table { text-indent: 0; border-color: inherit; border-collapse: collapse; }
+button, input, optgroup, select, textarea { font-family: inherit; font-size: 100%; font-weight: inherit;
+  line-height: inherit; letter-spacing: inherit; color: inherit; margin: 0; padding: 0; }
+button, select { text-transform: none; }
+button, input:where([type='button']), input:where([type='reset']), input:where([type='submit']) {
+  -webkit-appearance: button; background-color: transparent; background-image: none; }
+::-webkit-inner-spin-button, ::-webkit-outer-spin-button { height: auto; }
+[type='search'] { -webkit-appearance: textfield; outline-offset: -2px; }
+summary { display: list-item; }
+blockquote, dl, dd, h1, h2, h3, h4, h5, h6, hr, figure, p, pre { margin: 0; }
+fieldset { margin: 0; padding: 0; }
+legend { padding: 0; }
+ol, ul, menu { list-style: none; margin: 0; padding: 0; }
+textarea { resize: vertical; }
+input::placeholder, textarea::placeholder { opacity: 1; color: #9ca3af; }
+button, [role="button"] { cursor: pointer; }
+:disabled { cursor: default; }
+img, svg, video, canvas, audio, iframe, embed, object { display: block; vertical-align: middle; }
+img, video { max-width: 100%; height: auto; }
+[hidden] { display: none; }
+""".replace('{sans}', SANS).replace('{mono}', MONO)
+
+
+def escape(class_name):
+    """The class name as a CSS selector (hover:bg-white/20 -> .hover\\:bg-white\\/20)"""
+    return '.' + re.sub(r'([^A-Za-z0-9_-])', r'\\\1', class_name)
+
+
+def _length(value, fractions=True):
+    """Tailwind spacing scale: 4 -> 1rem, px, full, 1/2, [12px]"""
+    if value == '0':
+        return '0px'
+    if value == 'px':
+        return '1px'
+    if value == 'full':
+        return '100%'
+    if value == 'auto':
+        return 'auto'
+    if value.startswith('[') and value.endswith(']'):
+        return value[1:-1]
+    if fractions and re.fullmatch(r'\d+/\d+', value):
+        top, bottom = value.split('/')
+        return f'{int(top) / int(bottom) * 100:g}%'
+    if re.fullmatch(r'\d+(\.5)?', value):
+        return f'{float(value) / 4:g}rem'
+    return None
+
+
+def _color(name):
+    """(r, g, b) of a palette colour name like blue-600 or white"""
+    if name in NAMED_COLORS:
+        hex_value = NAMED_COLORS[name]
+    else:
+        family, _, shade = name.rpartition('-')
+        if family not in PALETTE or shade not in SHADES:
+            return None
+        hex_value = PALETTE[family][SHADES.index(shade)]
+    return tuple(int(hex_value[index:index + 2], 16) for index in (0, 2, 4))
+
+
+def _color_value(name, opacity_var=None):
+    """CSS colour for name[/opacity], with an opacity variable the *-opacity utilities can set"""
+    name, _, alpha = name.partition('/')
+    if name == 'transparent':
+        return 'transparent', None
+    if name == 'current':
+        return 'currentColor', None
+    rgb = _color(name)
+    if rgb is None or (alpha and not alpha.isdigit()):
+        return None, None
+    r, g, b = rgb
+    if alpha:
+        return f'rgb({r} {g} {b} / {int(alpha) / 100:g})', None
+    if opacity_var:
+        return f'rgb({r} {g} {b} / var({opacity_var}))', f'{opacity_var}: 1'
+    return f'rgb({r} {g} {b})', None
+
+
+COLOR_UTILITIES = {
+    # prefix: (property, opacity variable)
+    'bg': ('background-color', '--tw-bg-opacity'),
+    'text': ('color', '--tw-text-opacity'),
+    'border': ('border-color', '--tw-border-opacity'),
+    'divide': ('border-color', '--tw-divide-opacity'),
+    'ring': ('--tw-ring-color', None),
+    'ring-offset': ('--tw-ring-offset-color', None),
+}
+
+
+def _utility(name):
+    """(declarations, selector suffix, extra at-rule) for a utility without variants, None when unknown"""
+    negative = name.startswith('-')
+    base = name[1:] if negative else name
+
+    if not negative and base in STATIC:
+        return STATIC[base], '', KEYFRAMES.get(base)
+
+    # Spacing, sizing and insets
+    prefix, _, value = base.rpartition('-')
+    if prefix in SPACING_PROPERTIES and (not negative or prefix in NEGATABLE):
+        length = _length(value, fractions=prefix in ('w', 'h', 'top', 'right', 'bottom', 'left', 'inset'))
+        if length is not None:
+            if negative:
+                length = f'-{length}'
+            return '; '.join(f'{prop}: {length}' for prop in SPACING_PROPERTIES[prefix]), '', None
+    if negative:
+        if base.startswith('translate-'):
+            return _translate(base, negative=True)
+        return None
+
+    if base.startswith(('space-x-', 'space-y-')):
+        length = _length(base[8:], fractions=False)
+        if length is None:
+            return None
+        side = 'margin-left' if base.startswith('space-x-') else 'margin-top'
+        return f'{side}: {length}', BETWEEN, None
+    if base == 'divide-y':
+        return 'border-top-width: 1px; border-bottom-width: 0px', BETWEEN, None
+    if base == 'divide-x':
+        return 'border-left-width: 1px; border-right-width: 0px', BETWEEN, None
+
+    if base.startswith('grid-cols-') and base[10:].isdigit():
+        return f'grid-template-columns: repeat({base[10:]}, minmax(0, 1fr))', '', None
+    if base.startswith('col-span-') and base[9:].isdigit():
+        return f'grid-column: span {base[9:]} / span {base[9:]}', '', None
+    if base.startswith('z-'):
+        value = base[2:]
+        if value.isdigit() or (value.startswith('[') and value.endswith(']') and value[1:-1].isdigit()):
+            return f'z-index: {value.strip("[]")}', '', None
+        return None
+    if base.startswith('max-w-') and base[6:] in MAX_WIDTHS:
+        return f'max-width: {MAX_WIDTHS[base[6:]]}', '', None
+    if base.startswith('max-h-') or base.startswith('min-h-'):
+        return None
+
+    if base.startswith('text-') and base[5:] in FONT_SIZES:
+        size, line_height = FONT_SIZES[base[5:]]
+        return f'font-size: {size}; line-height: {line_height}', '', None
+    if base.startswith('font-') and base[5:] in FONT_WEIGHTS:
+        return f'font-weight: {FONT_WEIGHTS[base[5:]]}', '', None
+    if base.startswith('leading-'):
+        value = LEADING.get(base[8:]) or _length(base[8:], fractions=False)
+        return (f'line-height: {value}', '', None) if value else None
+    if base.startswith('tracking-') and base[9:] in TRACKING:
+        return f'letter-spacing: {TRACKING[base[9:]]}', '', None
+
+    if base == 'rounded' or base.startswith('rounded-'):
+        return _rounded(base)
+    if base == 'shadow' or base.startswith('shadow-'):
+        size = base[7:]
+        if size in SHADOWS:
+            return f'--tw-shadow: {SHADOWS[size]}; {BOX_SHADOW}', '', None
+        return None
+    if base.startswith('ring-offset-') and base[12:].isdigit():
+        return f'--tw-ring-offset-width: {base[12:]}px', '', None
+    if base == 'ring' or (base.startswith('ring-') and base[5:].isdigit()):
+        width = base[5:] or '3'
+        return (
+            '--tw-ring-offset-shadow: var(--tw-ring-inset) 0 0 0 var(--tw-ring-offset-width) var(--tw-ring-offset-color); '
+            f'--tw-ring-shadow: var(--tw-ring-inset) 0 0 0 calc({width}px + var(--tw-ring-offset-width)) var(--tw-ring-color); '
+            + BOX_SHADOW
+        ), '', None
+
+    if base.startswith('opacity-') and base[8:].isdigit():
+        return f'opacity: {int(base[8:]) / 100:g}', '', None
+    for opacity_prefix in ('bg', 'text', 'border', 'divide'):
+        if base.startswith(f'{opacity_prefix}-opacity-') and base.rsplit('-', 1)[1].isdigit():
+            return f'--tw-{opacity_prefix}-opacity: {int(base.rsplit("-", 1)[1]) / 100:g}', '', None
+
+    if base.startswith('duration-') and base[9:].isdigit():
+        return f'transition-duration: {base[9:]}ms', '', None
+    if base.startswith('scale-') and base[6:].isdigit():
+        scale = int(base[6:]) / 100
+        return f'--tw-scale-x: {scale:g}; --tw-scale-y: {scale:g}; {TRANSFORM}', '', None
+    if base.startswith('translate-'):
+        return _translate(base)
+
+    if base.startswith(('from-', 'to-', 'via-')):
+        return _gradient_stop(base)
+    for color_prefix in sorted(COLOR_UTILITIES, key=len, reverse=True):
+        if base.startswith(color_prefix + '-'):
+            prop, opacity_var = COLOR_UTILITIES[color_prefix]
+            value, opacity = _color_value(base[len(color_prefix) + 1:], opacity_var)
+            if value is None:
+                continue
+            declarations = f'{prop}: {value}' if opacity is None else f'{opacity}; {prop}: {value}'
+            return declarations, BETWEEN if color_prefix == 'divide' else '', None
+    return None
+
+
+def _translate(base, negative=False):
+    axis, _, value = base[len('translate-'):].partition('-')
+    length = _length(value)
+    if axis not in ('x', 'y') or length is None:
+        return None
+    if negative:
+        length = f'-{length}'
+    return f'--tw-translate-{axis}: {length}; {TRANSFORM}', '', None
+
+
+def _rounded(base):
+    parts = base.split('-')[1:]
+    corners = {
+        't': ('top-left', 'top-right'), 'r': ('top-right', 'bottom-right'),
+        'b': ('bottom-right', 'bottom-left'), 'l': ('top-left', 'bottom-left'),
+    }
+    if parts and parts[0] in corners:
+        size = '-'.join(parts[1:])
+        if size not in RADII:
+            return None
+        return '; '.join(f'border-{corner}-radius: {RADII[size]}' for corner in corners[parts[0]]), '', None
+    size = '-'.join(parts)
+    if size not in RADII:
+        return None
+    return f'border-radius: {RADII[size]}', '', None
+
+
+def _gradient_stop(base):
+    position, _, color = base.partition('-')
+    value, _ = _color_value(color)
+    if value is None:
+        return None
+    transparent = 'rgb(255 255 255 / 0)' if color.startswith('white') else 'rgb(0 0 0 / 0)'
+    if position == 'from':
+        return (
+            f'--tw-gradient-from: {value}; --tw-gradient-to: {transparent}; '
+            '--tw-gradient-stops: var(--tw-gradient-from), var(--tw-gradient-to)'
+        ), '', None
+    if position == 'via':
+        return (
+            f'--tw-gradient-stops: var(--tw-gradient-from), {value}, var(--tw-gradient-to)'
+        ), '', None
+    return f'--tw-gradient-to: {value}', '', None
+
+
+VARIANT_ORDER = ['', 'last', 'focus', 'hover', 'group-hover']
+
+# Cascade order of the utilities, as in Tailwind: a later one wins over an earlier
+# one of the same variant (border-0 then border-b-2, transition then duration-300,
+# bg-white then bg-opacity-50). The first pattern a utility matches is its rank.
+UTILITY_ORDER = [re.compile(pattern) for pattern in [
+    r'prose', r'container$', r'(visible|invisible)$', r'(static|fixed|absolute|relative|sticky)$',
+    r'-?inset-(?![xy]-)', r'-?inset-[xy]-', r'-?(top|right|bottom|left)-', r'z-', r'col-span-',
+    r'-?m-', r'-?m[xy]-', r'-?m[trbl]-', r'line-clamp-',
+    r'(block|inline-block|inline|flex|inline-flex|grid|hidden|contents)$', r'aspect-',
+    r'h-', r'max-h-', r'min-h-', r'w-', r'min-w-', r'max-w-',
+    r'flex-(1|auto|none)$', r'(flex-)?shrink', r'flex-grow', r'-?translate-', r'scale-', r'transform',
+    r'animate-', r'cursor-', r'select-', r'list-(inside|outside)$', r'list-',
+    r'grid-cols-', r'flex-(row|col)', r'flex-wrap', r'items-', r'justify-', r'gap-', r'space-',
+    r'divide-[xy]$', r'divide-(?!opacity)', r'divide-opacity-', r'overflow-', r'truncate$', r'whitespace-',
+    r'rounded(-(none|sm|md|lg|xl|2xl|3xl|full))?$', r'rounded-',
+    r'border(-\d+)?$', r'border-[xy](-\d+)?$', r'border-[trbl](-\d+)?$', r'border-(?!opacity)', r'border-opacity-',
+    r'bg-(?!opacity|gradient)', r'bg-opacity-', r'bg-gradient-', r'from-', r'via-', r'to-', r'object-',
+    r'p-', r'p[xy]-', r'p[trbl]-', r'text-(left|center|right|justify)$', r'font-(sans|serif|mono)$',
+    r'text-(xs|sm|base|lg|\d?xl)$', r'font-', r'(uppercase|lowercase|capitalize)$', r'italic$',
+    r'leading-', r'tracking-', r'text-(?!opacity)', r'text-opacity-', r'(underline|line-through|no-underline)$',
+    r'opacity-', r'shadow', r'outline-', r'ring(-\d+)?$', r'ring-offset-\d+$', r'ring-offset-', r'ring-',
+    r'backdrop-', r'transition', r'duration-',
+]]
+
+
+def _rank(utility):
+    return next((index for index, pattern in enumerate(UTILITY_ORDER) if pattern.match(utility)), len(UTILITY_ORDER))
+
+
+def compile_class(class_name):
+    """(screen, variant order, utility order, rule, at-rule) for one class, None when it is not a utility"""
+    *variants, utility = _split_variants(class_name)
+    screen = None
+    selector = escape(class_name)
+    state = ''
+    for variant in variants:
+        if variant in SCREENS and screen is None:
+            screen = variant
+        elif variant in ('hover', 'focus', 'last') and not state:
+            state = variant
+            selector += {'hover': ':hover', 'focus': ':focus', 'last': ':last-child'}[variant]
+        elif variant.startswith('group-hover') and not state:
+            state = 'group-hover'
+            group = escape('group' + variant[len('group-hover'):])
+            selector = f'{group}:hover {selector}'
+        else:
+            return None
+    compiled = _utility(utility)
+    if compiled is None:
+        return None
+    declarations, suffix, at_rule = compiled
+    rule = f'{selector}{suffix} {{ {declarations}; }}'
+    return screen, VARIANT_ORDER.index(state), _rank(utility), rule, at_rule
+
+
+def _split_variants(class_name):
+    """hover:bg-white/20 -> ['hover', 'bg-white/20'], leaving brackets alone"""
+    parts, depth, current = [], 0, ''
+    for char in class_name:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == ':' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def _icons(candidates):
+    rules = []
+    for name in sorted(ICONS):
+        if f'fa-{name}' in candidates:
+            rules.append(f'.fa-{name}::before {{ content: "{ICONS[name]}"; }}')
+            if name in REGULAR_ICONS:
+                rules.append(f'.far.fa-{name}::before {{ content: "{REGULAR_ICONS[name]}"; }}')
+    if not rules:
+        return ''
+    return '\n'.join([
+        '.fa, .fas, .far, .fab { display: inline-block; font-style: normal; font-variant: normal; '
+        'line-height: 1; text-rendering: auto; }',
+        '.fa-spin { animation: spin 1s linear infinite; }',
+        '@keyframes spin { to { transform: rotate(360deg); } }',
+        *rules,
+    ])
+
+
+def _container():
+    rules = ['.container { width: 100%; }']
+    for screen, width in SCREENS.items():
+        rules.append(f'@media (min-width: {width}px) {{ .container {{ max-width: {width}px; }} }}')
+    return '\n'.join(rules)
+
+
+def sources():
+    """The files whose class names end up in the stylesheet"""
+    base = Path(settings.BASE_DIR)
+    return sorted([
+        *base.glob('templates/**/*.html'),
+        *base.glob('*/templates/**/*.html'),
+        *base.glob('static/js/*.js'),
+        # Form widgets carry classes too
+        base / 'shop' / 'forms.py',
+    ])
+
+
+def stylesheet_path():
+    return Path(settings.BASE_DIR) / 'static' / 'css' / 'site.css'
+
+
+def hand_written_css():
+    """static_src/css/*.css, the rules that aren't utilities"""
+    folder = Path(settings.BASE_DIR) / 'static_src' / 'css'
+    return '\n'.join(path.read_text(encoding='utf-8') for path in sorted(folder.glob('*.css')))
+
+
+def build():
+    """The site stylesheet as it should be for the current templates"""
+    return build_css(sources(), hand_written_css())
+
+
+def candidates_in(paths):
+    """Every token of the files that could be a class name, like Tailwind's content scan"""
+    found = set()
+    for path in paths:
+        found.update(CANDIDATE_RE.findall(Path(path).read_text(encoding='utf-8')))
+    return found
+
+
+def build_css(sources, extra_css=''):
+    """The stylesheet for the classes found in the source files"""
+    candidates = candidates_in(sources)
+    screens = [None, *SCREENS]
+    compiled = sorted(
+        filter(None, (compile_class(name) for name in candidates)),
+        key=lambda rule: (screens.index(rule[0]), *rule[1:4]),
+    )
+    at_rules = sorted({at_rule for *_, at_rule in compiled if at_rule})
+    sections = ['/* Generated by `manage.py build_assets`, do not edit */', PREFLIGHT.rstrip()]
+    if 'container' in candidates:
+        sections.append(_container())
+    sections.append(_icons(candidates))
+    sections.append(extra_css.rstrip())
+    sections.extend(at_rules)
+
+    for screen in screens:
+        rules = [rule for rule_screen, _, _, rule, _ in compiled if rule_screen == screen]
+        if not rules:
+            continue
+        if screen is None:
+            sections.append('\n'.join(rules))
+        else:
+            body = '\n'.join(f'  {rule}' for rule in rules)
+            sections.append(f'@media (min-width: {SCREENS[screen]}px) {{\n{body}\n}}')
+    return '\n'.join(section for section in sections if section) + '\n'
@@ -0,0 +1,158 @@
+"""Helpers shared by the benchmark management commands"""
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+BRANDS = ['Nike', 'Adidas', 'Puma', 'Reebok', 'New Balance', 'Asics', 'Vans', 'Converse', 'Zara', 'Guess']
+WORDS = [
+    'air', 'max', 'force', 'runner', 'classic', 'retro', 'high', 'low', 'street', 'urban',
+    'cuir', 'daim', 'sport', 'confort', 'premium', 'edition', 'limited', 'noir', 'blanc', 'rouge',
+    'collier', 'bague', 'bracelet', 'argent', 'or', 'sac', 'main', 'dos', 'voyage', 'soirée',
+]
+# Long tail of rarer words so descriptions are not all alike
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'tu', 'sen', 'vo', 'di', 'ne', 'bar', 'zo', 'fi', 'gu', 'pel', 'cha', 'ro']
+RARE_WORDS = [first + second for first in SYLLABLES for second in SYLLABLES]
+COLORS = ['Noir', 'Blanc', 'Rouge', 'Bleu', 'Vert', 'Gris', 'Beige']
+PRODUCT_TYPES = ['shoe', 'bijoux', 'sac', 'other']
+SIZES = ['38', '40', '42', '44', 'small', 'medium', 'large', 'one_size']
+
+
+@contextmanager
+def benchmark_database(alias='default', verbosity=0):
+    """Run the block against a throwaway copy of the schema, never the real database"""
+    connection = connections[alias]
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings):
+    """Latency summary in milliseconds"""
+    timings = [t * 1000 for t in timings]
+    return {
+        'runs': len(timings),
+        'mean': statistics.fmean(timings) if timings else 0.0,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'max': max(timings) if timings else 0.0,
+    }
+
+
+def measure(func, repeat=20, warmup=2):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def format_summary(label, stats):
+    return (
+        f"{label:<40} p50={stats['p50']:8.2f}ms p95={stats['p95']:8.2f}ms "
+        f"p99={stats['p99']:8.2f}ms mean={stats['mean']:8.2f}ms"
+    )
+
+
+def seed_catalog(count, categories=8, batch_size=5000, seed=42):
+    """Bulk insert count synthetic products spread over a few categories"""
+    from shop.models import Category, Product
+
+    rng = random.Random(seed)
+    category_ids = [
+        Category.objects.create(name=f'Catégorie {index}').pk
+        for index in range(categories)
+    ]
+    created = 0
+    while created < count:
+        batch = []
+        for index in range(created, min(count, created + batch_size)):
+            words = rng.sample(WORDS, 3)
+            brand = rng.choice(BRANDS)
+            batch.append(Product(
+                name=f'{brand} {" ".join(words).title()} {index}',
+                description=' '.join(rng.choices(WORDS, k=4) + rng.choices(RARE_WORDS, k=12)),
+                price=rng.randint(1000, 30000),
+                category_id=rng.choice(category_ids),
+                product_type=rng.choice(PRODUCT_TYPES),
+                size=rng.choice(SIZES),
+                brand=brand,
+                color=rng.choice(COLORS),
+                stock=rng.randint(0, 20),
+            ))
+        Product.objects.bulk_create(batch)
+        created += len(batch)
+    return category_ids
+
+
+def seed_users(count, batch_size=10_000, seed=42):
+    """Bulk insert count users with a long-tailed points distribution (most have a few, some many)"""
+    from shop.models import CustomUser
+
+    rng = random.Random(seed)
+    created = 0
+    while created < count:
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'user{index}',
+                password='!',
+                referral_code=f'BENCH{index}',
+                points=int(rng.paretovariate(1.2)) - 1,
+            )
+            for index in range(created, min(count, created + batch_size))
+        ])
+        created = min(count, created + batch_size)
+
+
+def login_session(user):
+    """Key of a new logged-in session of user, for the HTTP benchmarks"""
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.sessions.backends.db import SessionStore
+
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baselines(path, baselines):
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(results, baselines, tolerance):
+    """(name, measured ms, baseline ms) of the results slower than their baseline by more than tolerance"""
+    return [
+        (name, measured, baselines[name])
+        for name, measured in results.items()
+        if name in baselines and measured > baselines[name] * (1 + tolerance)
+    ]
@@ -0,0 +1,91 @@
+"""
+Product card fragment cache.
+
+The listing, home, related-products and cart templates render the same
+cards over and over. render_cards() renders each (product, template) once
+per language and serves it from the cache afterwards, fetching a whole page
+of cards with one get_many().
+
+A card's key carries a version token per product, dropped (and so minted
+afresh) whenever the product is saved or deleted (shop.signals, which
+covers the admin's list_editable price/stock edits), and a generation for
+all cards, dropped when a category is renamed or removed. Versions are
+random tokens rather than counters so a version evicted from the cache can
+never bring an older card back. Reservations and checkouts change stock and reserved
+with UPDATE queries, without a save: the card's available units are part
+of its key instead.
+
+Cards hold {% csrf_token %} forms; they are rendered with a placeholder
+that is swapped for the request's own token on the way out.
+
+A card rendered from a replica snapshot older than its version is not
+stored (shop.replicas.may_cache()).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from .replicas import get_versions, may_cache
+
+CARD_TEMPLATE = 'partials/product_card.html'
+GENERATION_KEY = 'cards:generation'
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-4c1d5e0a'
+
+
+def _version_key(pk):
+    return f'cards:version:{pk}'
+
+
+def _card_key(template_name, product, generation, version, language):
+    return f'cards:{generation}:{version}:{language}:{template_name}:{product.pk}:{product.available}'
+
+
+def _versions(product_ids):
+    """{version key: token} for the products and the generation, minting the missing ones"""
+    return get_versions([GENERATION_KEY] + [_version_key(pk) for pk in product_ids])
+
+
+def render_cards(products, template_name=CARD_TEMPLATE, request=None):
+    """Rendered card of each product, in order, as safe strings"""
+    products = list(products)
+    if not products:
+        return []
+    versions = _versions({product.pk for product in products})
+    language = translation.get_language()
+    keys = [
+        _card_key(template_name, product, versions[GENERATION_KEY], versions[_version_key(product.pk)], language)
+        for product in products
+    ]
+    cards = cache.get_many(keys)
+
+    rendered, storable = {}, {}
+    for key, product in zip(keys, products):
+        if key not in cards and key not in rendered:
+            rendered[key] = render_to_string(template_name, {'product': product, 'csrf_token': CSRF_PLACEHOLDER})
+            if may_cache([versions[GENERATION_KEY], versions[_version_key(product.pk)]]):
+                storable[key] = rendered[key]
+    if storable:
+        cache.set_many(storable, settings.CARD_CACHE_TIMEOUT)
+    cards.update(rendered)
+
+    token = get_token(request) if request is not None else ''
+    return [mark_safe(cards[key].replace(CSRF_PLACEHOLDER, token)) for key in keys]
+
+
+def _forget(keys):
+    cache.delete_many(keys)
+
+
+def invalidate_cards(product_ids):
+    """Retire the cached cards of these products once the transaction commits"""
+    keys = [_version_key(pk) for pk in product_ids]
+    if keys:
+        transaction.on_commit(lambda: _forget(keys))
+
+
+def invalidate_all_cards():
+    transaction.on_commit(lambda: _forget([GENERATION_KEY]))
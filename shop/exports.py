@@ -0,0 +1,121 @@
+"""
+Courier manifests and accounting exports of orders.
+
+Orders are read with iterator(chunk_size), their items prefetched one
+chunk at a time, and written out line by line, so an export holds one
+chunk in memory however many orders it covers. export_response() streams
+the lines as they are produced: the download starts with the first chunk.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import OrderItem
+
+CHUNK_SIZE = 2000
+
+# Column -> the order's value (the Yalidine-style shipping fields first)
+COLUMNS = {
+    'order_number': lambda order: order.order_number,
+    'created_at': lambda order: timezone.localtime(order.created_at).isoformat(timespec='seconds'),
+    'status': lambda order: order.status,
+    'full_name': lambda order: order.full_name,
+    'phone': lambda order: order.phone,
+    'phone2': lambda order: order.phone2 or '',
+    'wilaya': lambda order: order.wilaya,
+    'wilaya_name': lambda order: order.get_wilaya_display_full(),
+    'commune': lambda order: order.commune,
+    'address': lambda order: order.address,
+    'postal_code': lambda order: order.postal_code,
+    'notes': lambda order: order.notes or '',
+    'total_price': lambda order: str(order.total_price),
+}
+# Free text typed by customers
+TEXT_COLUMNS = {'full_name', 'commune', 'address', 'notes'}
+
+
+def filter_orders(queryset, status=None, wilaya=None, since=None, until=None):
+    """queryset narrowed to the statuses, wilayas and days (both included) given"""
+    if status:
+        queryset = queryset.filter(status__in=status)
+    if wilaya:
+        queryset = queryset.filter(wilaya__in=wilaya)
+    # Day bounds as datetimes, so the range reads the created_at index
+    if since:
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    if until:
+        queryset = queryset.filter(
+            created_at__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min)),
+        )
+    return queryset
+
+
+def manifest_rows(queryset, chunk_size=CHUNK_SIZE):
+    """(row of COLUMNS, [item]) of each order; one query for the orders, one for the items of each chunk"""
+    items = OrderItem.objects.select_related('product').only(
+        'order_id', 'quantity', 'price', 'product__name', 'product__brand', 'product__size',
+    ).order_by('pk')
+    orders = queryset.order_by('created_at', 'pk').prefetch_related(Prefetch('items', queryset=items))
+    for order in orders.iterator(chunk_size=chunk_size):
+        row = {column: value(order) for column, value in COLUMNS.items()}
+        yield row, [
+            {
+                'product_id': item.product_id,
+                'name': item.product.name,
+                'brand': item.product.brand,
+                'size': item.product.size,
+                'quantity': item.quantity,
+                'price': str(item.price),
+            }
+            for item in order.items.all()
+        ]
+
+
+class _Echo:
+    """File-like sink handing csv.writer's lines back instead of storing them"""
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    # Opening with a formula character, it would be run by spreadsheets; quoted, it stays text
+    if value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows):
+    """One line per order, its items as 'quantity x name (size)' in an items column"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow([*COLUMNS, 'items'])
+    for row, items in rows:
+        summary = ' | '.join(f"{item['quantity']} x {item['name']} ({item['size']})" for item in items)
+        cells = [_text(value) if column in TEXT_COLUMNS else value for column, value in row.items()]
+        yield writer.writerow([*cells, _text(summary)])
+
+
+def jsonl_lines(rows):
+    """One JSON object per order, its items as a list"""
+    for row, items in rows:
+        yield json.dumps({**row, 'items': items}, ensure_ascii=False) + '\n'
+
+
+# format -> (lines, content type)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson; charset=utf-8'),
+}
+
+
+def export_response(queryset, export_format, chunk_size=CHUNK_SIZE):
+    """The orders of queryset as a streamed CSV or JSON lines download"""
+    lines, content_type = FORMATS[export_format]
+    response = StreamingHttpResponse(lines(manifest_rows(queryset, chunk_size)), content_type=content_type)
+    filename = f"commandes-{timezone.localtime():%Y%m%d-%H%M}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,180 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Min, Sum
+from django.utils import translation
+
+from .models import Category, Product
+from .replicas import primary_reads
+from .search import search_products
+
+GENERATION_KEY = 'facets:generation'
+
+# Facet dimensions: request parameter -> Product field
+DIMENSIONS = {
+    'category': 'category_id',
+    'brand': 'brand',
+    'type': 'product_type',
+    'size': 'size',
+}
+
+SIZE_LABELS = dict(Product.SHOE_SIZES + Product.BIJOUX_SIZES + Product.SAC_SIZES)
+TYPE_LABELS = dict(Product.PRODUCT_TYPES)
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+class CatalogFilters:
+    """The catalog filter set of a request: search, price range and facet selections"""
+
+    def __init__(self, search='', price_min=None, price_max=None, **selected):
+        self.search = search
+        self.price_min = price_min
+        self.price_max = price_max
+        self.selected = {name: value for name, value in selected.items() if value}
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.GET
+        selected = {name: params.get(name, '').strip() for name in DIMENSIONS}
+        if not selected['category'].isdigit():
+            selected['category'] = ''
+        return cls(
+            search=params.get('search', '').strip(),
+            price_min=_parse_price(params.get('price_min')),
+            price_max=_parse_price(params.get('price_max')),
+            **selected,
+        )
+
+    @property
+    def category_id(self):
+        category = self.selected.get('category')
+        return int(category) if category else None
+
+    def base_queryset(self):
+        """Available products matching the search and price range, before facet selections"""
+        queryset = Product.objects.filter(stock__gt=F('reserved'))
+        if self.price_min is not None:
+            queryset = queryset.filter(price__gte=self.price_min)
+        if self.price_max is not None:
+            queryset = queryset.filter(price__lte=self.price_max)
+        if self.search:
+            queryset = search_products(queryset, self.search)
+        return queryset
+
+    def apply(self, queryset):
+        for name, value in self.selected.items():
+            queryset = queryset.filter(**{DIMENSIONS[name]: value})
+        return queryset
+
+    def queryset(self):
+        return self.apply(self.base_queryset())
+
+    def cache_key(self):
+        state = [
+            self.search,
+            str(self.price_min),
+            str(self.price_max),
+            sorted(self.selected.items()),
+            translation.get_language(),
+        ]
+        digest = hashlib.sha1(json.dumps(state).encode()).hexdigest()
+        return f'facets:{get_generation()}:{digest}'
+
+
+def get_generation():
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def invalidate_facets():
+    """Drop every cached facet result (called when Product or Category rows change)"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _matches(row, filters, skip=None):
+    return all(
+        str(row[DIMENSIONS[name]]) == value
+        for name, value in filters.selected.items()
+        if name != skip
+    )
+
+
+def compute_facets(filters):
+    """
+    Totals and per-dimension counts for the filter set from one GROUP BY query.
+
+    The query groups the base queryset (search + price range) by every facet
+    dimension, so each dimension can be counted with all the other selections
+    applied but not its own, the usual "other brands you could pick" behaviour.
+    """
+    rows = list(
+        filters.base_queryset()
+        .order_by()
+        .values(*DIMENSIONS.values())
+        .annotate(products=Count('id'), stock=Sum(F('stock') - F('reserved')), min_price=Min('price'), max_price=Max('price'))
+    )
+
+    selected_rows = [row for row in rows if _matches(row, filters)]
+    counts = {}
+    for name, field in DIMENSIONS.items():
+        dimension = {}
+        for row in rows:
+            if _matches(row, filters, skip=name):
+                dimension[row[field]] = dimension.get(row[field], 0) + row['products']
+        counts[name] = dimension
+
+    priced_rows = selected_rows or rows
+    categories = list(Category.objects.values_list('id', 'name'))
+
+    return {
+        'total_products': sum(row['products'] for row in selected_rows),
+        'total_stock': sum(row['stock'] for row in selected_rows),
+        'total_categories': len(categories),
+        'price_min': min((row['min_price'] for row in priced_rows), default=None),
+        'price_max': max((row['max_price'] for row in priced_rows), default=None),
+        'categories': [
+            {'id': pk, 'name': name, 'count': counts['category'].get(pk, 0)}
+            for pk, name in categories
+        ],
+        'brands': _facet_list(counts['brand'], filters, 'brand'),
+        'types': _facet_list(counts['type'], filters, 'type', TYPE_LABELS),
+        'sizes': _facet_list(counts['size'], filters, 'size', SIZE_LABELS),
+    }
+
+
+def _facet_list(dimension, filters, name, labels=None):
+    selected = filters.selected.get(name)
+    return [
+        {
+            'value': value,
+            'label': labels.get(value, value) if labels else value,
+            'count': count,
+            'selected': value == selected,
+        }
+        for value, count in sorted(dimension.items(), key=lambda item: (-item[1], item[0]))
+        if value
+    ]
+
+
+def get_facets(filters):
+    """Cached compute_facets() per (filter set, language)"""
+    key = filters.cache_key()
+    facets = cache.get(key)
+    if facets is None:
+        # Cached under the current generation: never from a replica that predates it
+        with primary_reads():
+            facets = compute_facets(filters)
+        cache.set(key, facets, settings.FACET_CACHE_TIMEOUT)
+    return facets
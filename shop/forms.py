@@ -1,7 +1,9 @@
 from django import forms
-from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.contrib.auth.forms import UserChangeForm, UserCreationForm, AuthenticationForm
 from django.core.exceptions import ValidationError
-from .models import CustomUser
+from django.db import transaction
+from .models import CustomUser, PointsTransaction
+from .points import award
 
 class CustomUserCreationForm(UserCreationForm):
     email = forms.EmailField(
@@ -89,19 +91,18 @@ class CustomUserCreationForm(UserCreationForm):
             except CustomUser.DoesNotExist:
                 pass  # This shouldn't happen due to validation, but just in case
         
-        if commit:
-            user.save()
-        
-        # After saving the user, if there is a referrer, add points to both users
-        if user.referred_by:
-            referrer = user.referred_by
-            # Add 1 point to the referrer
-            referrer.points += 1
-            referrer.save(update_fields=['points'])
+        with transaction.atomic():
+            if commit:
+                user.save()
             
-            # Add 1 point to the new user as welcome bonus
-            user.points += 1
-            user.save(update_fields=['points'])
+            # After saving the user, if there is a referrer, add points to both users
+            if user.referred_by and user.pk:
+                referrer = user.referred_by
+                # Add 1 point to the referrer
+                award(referrer, 1, PointsTransaction.REFERRAL, referral=user)
+                
+                # Add 1 point to the new user as welcome bonus
+                award(user, 1, PointsTransaction.WELCOME, referral=referrer)
         
         return user
 
@@ -122,4 +123,13 @@ class CustomLoginForm(AuthenticationForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['username'].label = "Nom d'utilisateur"
-        self.fields['password'].label = "Mot de passe"
\ No newline at end of file
+        self.fields['password'].label = "Mot de passe"
+
+
+class CustomUserChangeForm(UserChangeForm):
+    """Admin change form: the balance is read-only, points move through an adjustment"""
+    points_adjustment = forms.IntegerField(
+        required=False,
+        label="Ajuster les points de",
+        help_text="Ajouté au solde actuel (négatif pour en retirer), enregistré comme ajustement",
+    )
@@ -0,0 +1,204 @@
+"""
+Resized derivatives of the Product and Category images.
+
+Uploads are shown at card or thumbnail size but were served as the
+original files. Each image gets WebP and JPEG renditions at the widths of
+RENDITIONS, at 1x and 2x density, written next to the media under
+derivatives/. generate() does the work and records what it wrote in the
+instance's image_renditions (with the source file it was made from, so a
+new upload is never shown with the old image's renditions).
+
+Saving an instance with a new image schedules generate() on a small thread
+pool (IMAGE_WORKERS threads, Pillow releases the GIL while resizing and
+encoding) once the transaction commits; with IMAGE_WORKERS = 0 it runs
+inline. Until the renditions exist, srcset() and the {% responsive_image %}
+tag fall back to the original upload. The generate_image_derivatives
+command backfills existing media in parallel.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cards import invalidate_all_cards, invalidate_cards
+from .page_cache import CATALOG_TAG, category_tag, invalidate_tags, product_tag
+
+logger = logging.getLogger(__name__)
+
+# Rendition name: CSS width in pixels (the 2x files are twice as wide)
+RENDITIONS = {
+    'thumb': 160,
+    'card': 400,
+    'detail': 800,
+}
+DENSITIES = (1, 2)
+FORMATS = {
+    # format: (Pillow format, file extension)
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+DERIVATIVES_DIR = 'derivatives'
+
+
+def is_current(instance):
+    """Whether the instance's renditions were made from its current image"""
+    renditions = instance.image_renditions or {}
+    return bool(instance.image) and renditions.get('source') == instance.image.name
+
+
+def _derivative_name(source, rendition, density, extension):
+    stem, _ = os.path.splitext(source)
+    return f'{DERIVATIVES_DIR}/{stem}/{rendition}-{density}x.{extension}'
+
+
+def _encode(image, format_name):
+    pillow_format, _ = FORMATS[format_name]
+    if format_name == 'jpeg' and image.mode != 'RGB':
+        # No alpha in JPEG: flatten onto white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = BytesIO()
+    if format_name == 'jpeg':
+        image.save(buffer, pillow_format, quality=settings.IMAGE_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, pillow_format, quality=settings.IMAGE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def render_renditions(field):
+    """{rendition: {format: {density: (name, bytes)}}} for the image in field, nothing written yet"""
+    with field.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info or 'A' in original.getbands() else 'RGB')
+
+    out = {}
+    for rendition, width in RENDITIONS.items():
+        for density in DENSITIES:
+            # Never upscale: a 2x no wider than the 1x adds nothing
+            target = min(width * density, original.width)
+            if density > 1 and target <= width:
+                continue
+            height = max(1, round(original.height * target / original.width))
+            resized = original if target == original.width else original.resize((target, height), Image.LANCZOS)
+            for format_name, (_, extension) in FORMATS.items():
+                out.setdefault(rendition, {}).setdefault(format_name, {})[density] = (
+                    _derivative_name(field.name, rendition, density, extension),
+                    _encode(resized, format_name),
+                )
+    return out
+
+
+def _delete(storage, renditions):
+    for formats in renditions.get('files', {}).values():
+        for densities in formats.values():
+            for name in densities.values():
+                storage.delete(name)
+
+
+def generate(model_label, pk, force=False):
+    """
+    Write the renditions of one instance's image and record them.
+
+    Returns the number of bytes written, 0 when there was nothing to do
+    (force: make them again even when they are current).
+    """
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).only('image', 'image_renditions').first()
+    if instance is None or not instance.image or (is_current(instance) and not force):
+        return 0
+    field = instance.image
+    storage = field.storage
+    try:
+        rendered = render_renditions(field)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Recorded so the original keeps being served instead of retrying on every save
+        logger.warning('Could not make renditions of %s: %s', field.name, e)
+        model.objects.filter(pk=pk, image=field.name).update(image_renditions={'source': field.name, 'files': {}})
+        return 0
+
+    files, written = {}, 0
+    for rendition, formats in rendered.items():
+        for format_name, densities in formats.items():
+            for density, (name, data) in densities.items():
+                if storage.exists(name):
+                    storage.delete(name)
+                files.setdefault(rendition, {}).setdefault(format_name, {})[str(density)] = storage.save(
+                    name, ContentFile(data),
+                )
+                written += len(data)
+
+    previous = instance.image_renditions or {}
+    # Only if the image wasn't replaced in the meantime
+    if model.objects.filter(pk=pk, image=field.name).update(image_renditions={'source': field.name, 'files': files}):
+        if previous.get('source') not in (None, field.name):
+            _delete(storage, previous)
+        _renditions_changed(model, pk)
+    return written
+
+
+def _renditions_changed(model, pk):
+    # Rendered cards and cached pages still point at the original
+    if model._meta.model_name == 'product':
+        invalidate_cards([pk])
+        invalidate_tags(product_tag(pk))
+    else:
+        invalidate_all_cards()
+        invalidate_tags(CATALOG_TAG, category_tag(pk))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.IMAGE_WORKERS, thread_name_prefix='image-renditions')
+        return _executor
+
+
+def _run_in_worker(model_label, pk):
+    try:
+        generate(model_label, pk)
+    except Exception:
+        logger.exception('Renditions of %s %s failed', model_label, pk)
+    finally:
+        # The worker thread's own connection
+        close_old_connections()
+
+
+def schedule(instance):
+    """Make the instance's renditions in the background once the transaction commits"""
+    if not instance.image or is_current(instance):
+        return
+    model_label = instance._meta.label
+    pk = instance.pk
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, model_label, pk))
+    else:
+        transaction.on_commit(lambda: generate(model_label, pk))
+
+
+def srcset(instance, rendition='card', format_name='jpeg'):
+    """(src, srcset) of one rendition, the original upload for both while it is pending"""
+    if not instance.image:
+        return None, ''
+    files = (instance.image_renditions or {}).get('files', {}) if is_current(instance) else {}
+    densities = files.get(rendition, {}).get(format_name)
+    if not densities:
+        url = instance.image.url
+        return url, ''
+    storage = instance.image.storage
+    urls = {density: storage.url(name) for density, name in densities.items()}
+    return urls['1'], ', '.join(f'{url} {density}x' for density, url in sorted(urls.items()))
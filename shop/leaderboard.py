@@ -0,0 +1,187 @@
+"""
+Monthly leaderboard snapshots into MonthlyLeaderboard.
+
+A snapshot goes through three resumable passes, each made of short
+transactions that commit their cursor with the rows they wrote:
+
+1. copy: the points each user earned in the month, summed from the ledger
+   in user id order, bulk_create'd as (user, points)
+2. rank: the copied rows in (points DESC, user) order, ranked with a RANK()
+   window over each chunk plus the number of rows ranked before it
+3. reset (optional): users lose the snapshotted points, or the part of them
+   that does not carry over with --decay; points earned outside the month
+   are kept; each deduction is a monthly_reset entry of the points ledger
+
+The ledger and the users table are only ever read or updated one id range
+at a time, and a month whose snapshot is done is left alone, so running the
+job twice is safe.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value, Window
+from django.db.models.functions import Cast, Rank
+from django.utils import timezone
+
+from .models import CustomUser, LeaderboardSnapshot, MonthlyLeaderboard, PointsTransaction
+from .points import earned, month_window
+from .ranking import invalidate_ranking
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def previous_month(today=None):
+    today = today or timezone.localdate()
+    return month_start(month_start(today) - timedelta(days=1))
+
+
+def parse_month(value):
+    """'2025-03' -> date(2025, 3, 1), None when it is not a month"""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return date(year, month, 1)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def snapshot_month(month, keep=None, chunk_size=5000):
+    """Snapshot (or resume the snapshot of) month; keep is the share of points users keep afterwards"""
+    month = month_start(month)
+    snapshot, created = LeaderboardSnapshot.objects.get_or_create(month=month, defaults={'keep': keep})
+    if not created and snapshot.keep != keep:
+        raise SnapshotError(
+            f'The {month:%Y-%m} snapshot was started with keep={snapshot.keep}, not {keep}'
+        )
+    if snapshot.status == LeaderboardSnapshot.COPYING:
+        _copy(snapshot, chunk_size)
+    if snapshot.status == LeaderboardSnapshot.RANKING:
+        _rank(snapshot, chunk_size)
+    if snapshot.status == LeaderboardSnapshot.RESETTING:
+        _reset(snapshot, chunk_size)
+    return snapshot
+
+
+def _next_pass(snapshot, status):
+    snapshot.status = status
+    snapshot.last_user_id = 0
+    if status == LeaderboardSnapshot.DONE:
+        snapshot.completed_at = timezone.now()
+    snapshot.save()
+
+
+def _copy(snapshot, chunk_size):
+    # What was earned within the month, not the balance: a late run leaves the next month's points out
+    since, until = month_window(timezone.make_aware(datetime.combine(snapshot.month, time.min)))
+    while True:
+        with transaction.atomic():
+            chunk = list(
+                earned(since, until).filter(user_id__gt=snapshot.last_user_id)
+                .values('user_id').annotate(total=Sum('delta')).filter(total__gt=0)
+                .order_by('user_id').values_list('user_id', 'total')[:chunk_size]
+            )
+            if not chunk:
+                _next_pass(snapshot, LeaderboardSnapshot.RANKING)
+                return
+            MonthlyLeaderboard.objects.bulk_create(
+                [MonthlyLeaderboard(month=snapshot.month, user_id=pk, points=points, rank=0) for pk, points in chunk],
+                ignore_conflicts=True,
+            )
+            snapshot.last_user_id = chunk[-1][0]
+            snapshot.save(update_fields=['last_user_id'])
+
+
+def _next_rank_chunk(rows, snapshot, chunk_size):
+    """pks of the next chunk_size rows in (points DESC, user) order, as index range reads"""
+    if snapshot.last_points is None:
+        return list(rows.order_by('-points', 'user_id').values_list('pk', flat=True)[:chunk_size])
+    chunk = list(
+        rows.filter(points=snapshot.last_points, user_id__gt=snapshot.last_user_id)
+        .order_by('user_id').values_list('pk', flat=True)[:chunk_size]
+    )
+    if len(chunk) < chunk_size:
+        chunk += rows.filter(points__lt=snapshot.last_points).order_by('-points', 'user_id').values_list(
+            'pk', flat=True,
+        )[:chunk_size - len(chunk)]
+    return chunk
+
+
+def _rank(snapshot, chunk_size):
+    rows = MonthlyLeaderboard.objects.filter(month=snapshot.month)
+    while True:
+        with transaction.atomic():
+            chunk = _next_rank_chunk(rows, snapshot, chunk_size)
+            if not chunk:
+                _next_pass(snapshot, (
+                    LeaderboardSnapshot.DONE if snapshot.keep is None else LeaderboardSnapshot.RESETTING
+                ))
+                return
+            entries = list(
+                MonthlyLeaderboard.objects.filter(pk__in=chunk)
+                .annotate(position=Window(Rank(), order_by=F('points').desc()))
+                .order_by('-points', 'user_id')
+            )
+            for entry in entries:
+                if entry.points == snapshot.last_points:
+                    # Tied with the end of the previous chunk
+                    entry.rank = snapshot.last_rank
+                else:
+                    entry.rank = snapshot.ranked + entry.position
+            MonthlyLeaderboard.objects.bulk_update(entries, ['rank'], batch_size=500)
+
+            last = entries[-1]
+            snapshot.ranked += len(entries)
+            snapshot.last_points = last.points
+            snapshot.last_user_id = last.user_id
+            snapshot.last_rank = last.rank
+            snapshot.save(update_fields=['ranked', 'last_points', 'last_user_id', 'last_rank'])
+
+
+def _reset(snapshot, chunk_size):
+    entries = MonthlyLeaderboard.objects.filter(month=snapshot.month).order_by('user_id')
+    reset_at = timezone.now()
+    while True:
+        with transaction.atomic():
+            chunk = list(entries.filter(user_id__gt=snapshot.last_user_id).values_list('user_id', 'points')[:chunk_size])
+            if not chunk:
+                _next_pass(snapshot, LeaderboardSnapshot.DONE)
+                transaction.on_commit(invalidate_ranking)
+                return
+            # What each user gives back: the snapshotted points minus the share that carries over
+            given_back = {user_id: points - int(points * snapshot.keep) for user_id, points in chunk}
+            PointsTransaction.objects.bulk_create([
+                PointsTransaction(
+                    user_id=user_id, delta=-points, reason=PointsTransaction.MONTHLY_RESET, created_at=reset_at,
+                )
+                for user_id, points in given_back.items() if points
+            ])
+            CustomUser.objects.filter(pk__in=given_back).update(
+                points=F('points') - Subquery(
+                    MonthlyLeaderboard.objects.filter(month=snapshot.month, user=OuterRef('pk')).values(
+                        given_back=F('points') - Cast(F('points') * Value(snapshot.keep), IntegerField()),
+                    )
+                ),
+            )
+            snapshot.last_user_id = chunk[-1][0]
+            snapshot.save(update_fields=['last_user_id'])
+
+
+def snapshot_months():
+    """Months with a finished snapshot, newest first"""
+    return list(
+        LeaderboardSnapshot.objects.filter(status=LeaderboardSnapshot.DONE).values_list('month', flat=True)
+    )
+
+
+def month_top(month, limit=10):
+    """Top of a snapshotted month, as rows with username, points and rank"""
+    return list(
+        MonthlyLeaderboard.objects.filter(month=month, rank__gt=0)
+        .annotate(username=F('user__username'))
+        .order_by('rank', 'user_id')[:limit]
+    )
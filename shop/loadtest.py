@@ -0,0 +1,334 @@
+"""
+Load testing from recorded or generated traffic.
+
+TraceRecorderMiddleware appends one JSON line per request to
+LOADTEST_RECORD_PATH (off when empty). A trace names the view and its URL
+arguments rather than the path, and keeps nothing that identifies a
+visitor or could log them in:
+
+- no cookies, headers or addresses; the visitor is an HMAC of the user or
+  session, so that a visitor's requests can be replayed in order as one
+  session,
+- query strings are kept (catalog filters, sorts, searches); form values
+  only for KEPT_FIELDS (quantities, sizes, the wilaya), other fields are
+  recorded as REDACTED, and SECRET_FIELDS (passwords, tokens, captchas)
+  are dropped from both,
+- URL arguments other than product ids (an order number, a cart item) are
+  recorded as REDACTED and such requests are not replayed.
+
+generate_scenarios() writes traces of the same shape from seeded visitor
+journeys (browse, search, add to cart, checkout, leaderboard) for when no
+recording exists. The loadtest_replay command replays either against a
+local server on a seeded throwaway database, with the reCAPTCHA stub as
+the verifier, so it runs offline, and reports throughput and latency per
+URL name.
+"""
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import reverse
+from django.utils import translation
+from django.utils.crypto import salted_hmac
+
+from .bench import WORDS, percentile
+
+REDACTED = '<redacted>'
+# Form fields recorded with their value
+KEPT_FIELDS = {'action', 'quantity', 'size', 'wilaya', 'language', 'next'}
+# Form and query fields not recorded at all (the replay supplies its own)
+SECRET_FIELDS = {
+    'csrfmiddlewaretoken', 'password', 'password1', 'password2', 'old_password', 'new_password1', 'new_password2',
+    'captcha', 'g-recaptcha-response',
+}
+# URL arguments that can be mapped onto the replay database
+REMAPPED_KWARGS = {'product_id'}
+# Views that would end the replayed session
+SKIPPED_VIEWS = {'logout'}
+# Stand-ins for the redacted fields of the forms the replay submits
+REPLAY_FORM = {
+    'full_name': 'Client Test',
+    'phone': '0555000000',
+    'commune': 'Alger Centre',
+    'address': '1 rue des Tests',
+    'postal_code': '16000',
+}
+
+
+def _sanitize(data):
+    return {
+        name: values if name in KEPT_FIELDS else [REDACTED]
+        for name, values in data.lists() if name not in SECRET_FIELDS
+    }
+
+
+def trace(request, response, elapsed):
+    """The sanitized trace of a request, None for those not worth replaying"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.url_name or match.namespace:
+        # Unresolved, static files, the admin
+        return None
+    user = getattr(request, 'user', None)
+    authenticated = bool(user is not None and user.is_authenticated)
+    if authenticated:
+        identity = f'user:{user.pk}'
+    else:
+        identity = f"session:{request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')}:{request.META.get('REMOTE_ADDR')}"
+    return {
+        'at': round(time.time(), 3),
+        'visitor': salted_hmac('shop.loadtest.visitor', identity).hexdigest()[:16],
+        'authenticated': authenticated,
+        'method': request.method,
+        'view': match.url_name,
+        'kwargs': {
+            name: value if name in REMAPPED_KWARGS or name == 'lang_code' else REDACTED
+            for name, value in match.kwargs.items()
+        },
+        'language': getattr(request, 'LANGUAGE_CODE', settings.LANGUAGE_CODE),
+        'query': {name: values for name, values in request.GET.lists() if name not in SECRET_FIELDS},
+        'form': _sanitize(request.POST) if request.method == 'POST' else {},
+        'ajax': request.headers.get('X-Requested-With') == 'XMLHttpRequest',
+        'status': response.status_code,
+        'ms': round(elapsed * 1000, 2),
+    }
+
+
+class TraceRecorderMiddleware:
+    """Append the trace of every request to LOADTEST_RECORD_PATH"""
+
+    def __init__(self, get_response):
+        if not settings.LOADTEST_RECORD_PATH:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.path = settings.LOADTEST_RECORD_PATH
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        entry = trace(request, response, time.perf_counter() - start)
+        if entry is not None:
+            line = (json.dumps(entry, ensure_ascii=False) + '\n').encode()
+            # One write on an O_APPEND descriptor: lines of concurrent workers don't interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        return response
+
+
+def read_traces(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_traces(path, traces):
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in traces:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def _step(visitor, at, view, method='GET', authenticated=False, kwargs=None, query=None, form=None, ajax=False):
+    return {
+        'at': round(at, 3), 'visitor': visitor, 'authenticated': authenticated, 'method': method, 'view': view,
+        'kwargs': kwargs or {}, 'language': 'fr', 'query': query or {}, 'form': form or {}, 'ajax': ajax,
+        'status': None, 'ms': None,
+    }
+
+
+def _browse(rng, step):
+    step('home')
+    step('products', query={'sort': [rng.choice(['newest', 'price_asc', 'price_desc'])]})
+    for _ in range(rng.randint(1, 4)):
+        step('product_detail', kwargs={'product_id': rng.randrange(10 ** 6)})
+
+
+def _search(rng, step):
+    step('products', query={'search': [rng.choice(WORDS)]})
+    step('product_detail', kwargs={'product_id': rng.randrange(10 ** 6)})
+
+
+def _add_to_cart(rng, step):
+    for _ in range(rng.randint(1, 3)):
+        product_id = rng.randrange(10 ** 6)
+        step('product_detail', kwargs={'product_id': product_id})
+        step('add_to_cart', 'POST', kwargs={'product_id': product_id}, ajax=True)
+        step('cart_count')
+    step('cart')
+
+
+def _checkout(rng, step):
+    _add_to_cart(rng, step)
+    step('checkout')
+    step('confirm_order', 'POST', form={
+        **{name: [REDACTED] for name in REPLAY_FORM},
+        'wilaya': [f'{rng.randint(1, 58):02d}'],
+    })
+
+
+def _leaderboard(rng, step):
+    step('home')
+    step('leaderboard')
+
+
+# name -> (journey, share of visitors, logged in)
+SCENARIOS = {
+    'browse': (_browse, 0.4, False),
+    'search': (_search, 0.2, False),
+    'add_to_cart': (_add_to_cart, 0.2, True),
+    'checkout': (_checkout, 0.1, True),
+    'leaderboard': (_leaderboard, 0.1, False),
+}
+
+
+def generate_scenarios(visitors, seed=42, think_time=2.0):
+    """Traces of visitors journeys picked by SCENARIOS share, a few seconds apart"""
+    rng = random.Random(seed)
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][1] for name in names]
+    traces = []
+    for index in range(visitors):
+        journey, _, authenticated = SCENARIOS[rng.choices(names, weights)[0]]
+        visitor = f'visitor{index}'
+        clock = [rng.uniform(0, think_time * 10)]
+
+        def step(view, method='GET', **kwargs):
+            traces.append(_step(visitor, clock[0], view, method, authenticated, **kwargs))
+            clock[0] += rng.expovariate(1 / think_time)
+
+        journey(rng, step)
+    traces.sort(key=lambda entry: entry['at'])
+    return traces
+
+
+def build_sessions(traces, product_ids):
+    """
+    {visitor: [(view, method, path, form, ajax, authenticated, delay)]} of
+    the replayable traces, and the number skipped. Recorded product ids map
+    onto product_ids; delay is the pause since the visitor's previous request.
+    """
+    sessions = defaultdict(list)
+    previous = {}
+    skipped = 0
+    tokens = iter(range(10 ** 9))
+    for entry in sorted(traces, key=lambda entry: entry['at']):
+        kwargs = dict(entry['kwargs'])
+        if entry['view'] in SKIPPED_VIEWS or REDACTED in kwargs.values():
+            skipped += 1
+            continue
+        if 'product_id' in kwargs:
+            kwargs['product_id'] = product_ids[int(kwargs['product_id']) % len(product_ids)]
+        with translation.override(entry['language']):
+            path = reverse(entry['view'], kwargs=kwargs)
+        if entry['query']:
+            path += '?' + urlencode(entry['query'], doseq=True)
+        form = {}
+        if entry['method'] == 'POST':
+            form = {
+                name: REPLAY_FORM.get(name, '') if values == [REDACTED] else values
+                for name, values in entry['form'].items()
+            }
+            form['g-recaptcha-response'] = f'loadtest-{next(tokens)}'
+        visitor = entry['visitor']
+        delay = entry['at'] - previous.get(visitor, entry['at'])
+        previous[visitor] = entry['at']
+        sessions[visitor].append(
+            (entry['view'], entry['method'], path, form, entry['ajax'], entry['authenticated'], delay)
+        )
+    return dict(sessions), skipped
+
+
+def _replay_visitor(port, steps, cookies, speed, timings, errors):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        for view, method, path, form, ajax, authenticated, delay in steps:
+            if speed and delay > 0:
+                time.sleep(delay / speed)
+            headers = {'Cookie': cookies['authenticated' if authenticated else 'anonymous']}
+            body = None
+            if method == 'POST':
+                body = urlencode({**form, 'csrfmiddlewaretoken': cookies['csrf']}, doseq=True)
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            if ajax:
+                headers['X-Requested-With'] = 'XMLHttpRequest'
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                errors.append((view, type(e).__name__))
+                connection.close()
+                continue
+            timings.append((view, time.perf_counter() - start))
+            if response.status >= 400:
+                errors.append((view, response.status))
+    finally:
+        connection.close()
+
+
+def replay_worker(port, sessions, threads, speed):
+    """Replay the (steps, cookies) sessions, threads at a time; ([(view, seconds)], [(view, error)])"""
+    timings, errors = [], []
+    pending = list(reversed(sessions))
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                steps, cookies = pending.pop()
+            _replay_visitor(port, steps, cookies, speed, timings, errors)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return timings, errors
+
+
+def replay(port, sessions, processes, threads, speed=0.0):
+    """Spread the sessions over client processes of threads each; (timings, errors, seconds)"""
+    shares = [sessions[index::processes] for index in range(processes)]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(
+            replay_worker, [port] * processes, shares, [threads] * processes, [speed] * processes,
+        ))
+    elapsed = time.perf_counter() - started
+    timings = [timing for result, _ in results for timing in result]
+    errors = [error for _, result in results for error in result]
+    return timings, errors, elapsed
+
+
+def summarize_replay(timings, errors, elapsed):
+    """{view: {requests, per_second, p50, p95, p99 (ms), errors}} with '*' for every request"""
+    by_view = defaultdict(list)
+    for view, seconds in timings:
+        by_view[view].append(seconds * 1000)
+        by_view['*'].append(seconds * 1000)
+    failed = defaultdict(int)
+    for view, _ in errors:
+        failed[view] += 1
+        failed['*'] += 1
+    return {
+        view: {
+            'requests': len(values),
+            'per_second': len(values) / elapsed if elapsed else 0.0,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'errors': failed[view],
+        }
+        for view, values in sorted(by_view.items())
+    }
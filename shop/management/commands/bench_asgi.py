@@ -0,0 +1,195 @@
+import argparse
+import http.client
+import importlib.util
+import logging
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shop.bench import benchmark_database, login_session, percentile, seed_catalog, seed_users
+from shop.models import CustomUser, Product
+
+HOST = '127.0.0.1'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(interval)
+    raise CommandError(f'Server on port {port} did not come up')
+
+
+def serve_wsgi(port, application):
+    """Threaded WSGI server, one thread per connection, until the process is killed"""
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        # Like production servers (and uvicorn): headers and body are separate
+        # writes, Nagle would hold the body back until the client's delayed ACK
+        disable_nagle_algorithm = True
+
+    server = ThreadedWSGIServer((HOST, port), RequestHandler)
+    server.daemon_threads = True
+    server.set_app(application)
+    server.serve_forever()
+
+
+def run_load(port, endpoints, headers, concurrency, duration):
+    """Hammer the endpoints from concurrency keep-alive clients for duration seconds"""
+    timings = {label: [] for label, _ in endpoints}
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(index)
+        connection = http.client.HTTPConnection(HOST, port, timeout=30)
+        while time.perf_counter() < deadline:
+            label, path = rng.choice(endpoints)
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path(rng), headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                connection.close()
+                continue
+            timings[label].append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests/sec and latency of the catalog and cart endpoints under concurrent load: '
+        'WSGI (threaded server, one thread per connection) vs ASGI (uvicorn, needs `pip install uvicorn`), '
+        'each in its own process on a seeded throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+        parser.add_argument('--duration', type=float, default=5.0, metavar='SECONDS')
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=10000)
+        # Internal: the server side of a run
+        parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options['serve'], options['port'], options['database_name'])
+        if 'asgi' in options['servers'] and importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('The ASGI run needs uvicorn: pip install uvicorn (or pass --servers wsgi)')
+
+        with benchmark_database() as connection:
+            self.stdout.write(f"Seeding {options['products']} products and {options['users']} users...")
+            seed_catalog(options['products'])
+            seed_users(options['users'])
+            product_ids = list(Product.objects.values_list('pk', flat=True))
+            headers = {'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.session_key()}'}
+            endpoints = [
+                ('home', lambda rng: '/fr/'),
+                ('products', lambda rng: '/fr/products/'),
+                ('product_detail', lambda rng: f'/fr/product/{rng.choice(product_ids)}/'),
+                ('cart_count', lambda rng: '/fr/cart/count/'),
+            ]
+            database_name = connection.settings_dict['NAME']
+            # The servers open their own connections
+            connection.close()
+
+            for server in options['servers']:
+                self.stdout.write(self.style.MIGRATE_HEADING(server.upper()))
+                with self.server(server, database_name) as port:
+                    # Warm up templates, caches and the ranking tree
+                    run_load(port, endpoints, headers, 2, 1.0)
+                    for concurrency in options['concurrency']:
+                        timings, errors, elapsed = run_load(
+                            port, endpoints, headers, concurrency, options['duration'],
+                        )
+                        self.report(concurrency, timings, errors, elapsed, options['verbosity'])
+
+    def session_key(self):
+        """A logged-in session for the cart endpoints"""
+        return login_session(CustomUser.objects.order_by('pk').first())
+
+    @contextmanager
+    def server(self, kind, database_name):
+        port = free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi',
+                '--serve', kind, '--port', str(port), '--database-name', database_name,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(port)
+            yield port
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    def serve(self, kind, port, database_name):
+        connections['default'].settings_dict['NAME'] = database_name
+        # Production-like: no query log, no per-request access log
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        logging.getLogger('django.server').setLevel(logging.WARNING)
+        if kind == 'wsgi':
+            from django.core.wsgi import get_wsgi_application
+
+            serve_wsgi(port, get_wsgi_application())
+        else:
+            import uvicorn
+            from django.core.asgi import get_asgi_application
+
+            # As core.asgi does, before the URLconf is loaded
+            settings.ASYNC_VIEWS = True
+
+            uvicorn.run(
+                get_asgi_application(), host=HOST, port=port,
+                lifespan='off', log_level='warning', access_log=False,
+            )
+
+    def report(self, concurrency, timings, errors, elapsed, verbosity):
+        every = [value * 1000 for values in timings.values() for value in values]
+        self.stdout.write(
+            f'  c={concurrency:<4} {len(every) / elapsed:8.1f} req/s  '
+            f'p50={percentile(every, 50):7.2f}ms p99={percentile(every, 99):8.2f}ms  errors={len(errors)}'
+        )
+        if verbosity > 1:
+            for label, values in timings.items():
+                values = [value * 1000 for value in values]
+                self.stdout.write(
+                    f'      {label:<16} p50={percentile(values, 50):7.2f}ms p99={percentile(values, 99):8.2f}ms'
+                )
@@ -0,0 +1,113 @@
+import argparse
+import http.client
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connections
+
+from shop.bench import benchmark_database, seed_catalog
+
+from .bench_asgi import HOST, free_port, serve_wsgi, wait_for
+
+
+def get(port, path):
+    """Seconds until the whole response of one GET on a new connection"""
+    connection = http.client.HTTPConnection(HOST, port, timeout=60)
+    start = time.perf_counter()
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise CommandError(f'GET {path} answered {response.status}')
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        'Time to first response per language of freshly started WSGI server processes, without and with '
+        'the startup warm-up (WARMUP_ON_STARTUP), on a seeded throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Server processes started per mode')
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--path', default='/', help='Page requested under each language prefix')
+        # Internal: the server side of a run
+        parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options['port'], options['database_name'], options['warm'])
+
+        languages = [code for code, _ in settings.LANGUAGES]
+        with benchmark_database() as connection:
+            self.stdout.write(f"Seeding {options['products']} products...")
+            seed_catalog(options['products'])
+            database_name = connection.settings_dict['NAME']
+            # The servers open their own connections
+            connection.close()
+
+            for warm in (False, True):
+                runs = [
+                    self.run(database_name, warm, languages, options['path'])
+                    for _ in range(options['runs'])
+                ]
+                self.report(warm, runs, languages)
+
+    def run(self, database_name, warm, languages, path):
+        """(seconds until the port accepts, {language: first response}, {language: a later response})"""
+        port = free_port()
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_cold_start',
+            '--serve', '--port', str(port), '--database-name', database_name,
+        ]
+        if warm:
+            command.append('--warm')
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port, interval=0.01)
+            ready = time.perf_counter() - started
+            first = {code: get(port, f'/{code}{path}') for code in languages}
+            # Another query string: rendered again, not served by the page cache
+            later = {code: get(port, f'/{code}{path}?again=1') for code in languages}
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+        return ready, first, later
+
+    def serve(self, port, database_name, warm):
+        connections['default'].settings_dict['NAME'] = database_name
+        # Production-like: no query log, no per-request access log
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        settings.WARMUP_ON_STARTUP = warm
+        logging.getLogger('django.server').setLevel(logging.WARNING)
+        # The deployed entry point (core.wsgi), which runs the warm-up
+        serve_wsgi(port, get_internal_wsgi_application())
+
+    def report(self, warm, runs, languages):
+        def median_ms(values):
+            return statistics.median(values) * 1000
+
+        label = 'WARM-UP ON START' if warm else 'COLD'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label} (median of {len(runs)} process start(s))'))
+        self.stdout.write(f'  accepting connections after {median_ms([ready for ready, _, _ in runs]):8.1f}ms')
+        for code in languages:
+            first = median_ms([first[code] for _, first, _ in runs])
+            later = median_ms([later[code] for _, _, later in runs])
+            self.stdout.write(f'  /{code}/  first response {first:8.1f}ms   later {later:7.1f}ms')
+        total = median_ms([ready + sum(first.values()) for ready, first, _ in runs])
+        self.stdout.write(f'  start to every language served {total:8.1f}ms')
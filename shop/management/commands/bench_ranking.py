@@ -0,0 +1,74 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.bench import benchmark_database, format_summary, measure, seed_users
+from shop.models import CustomUser
+from shop.ranking import RankIndex
+
+
+def legacy_rank(points):
+    # What shop.views.profile did before the ranking index
+    return CustomUser.objects.filter(points__gt=points).count() + 1
+
+
+def legacy_top(limit=10):
+    return list(CustomUser.objects.order_by('-points')[:limit])
+
+
+class Command(BaseCommand):
+    help = 'Compare leaderboard queries: COUNT / ORDER BY over the user table vs the ranking index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1_000_000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        rank_index = [index for index in CustomUser._meta.indexes if index.name == 'user_points_rank_idx'][0]
+        for size in options['sizes']:
+            with benchmark_database():
+                self.stdout.write(f'Seeding {size} users...')
+                seed_users(size)
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{size} users'))
+
+                points = sorted(CustomUser.objects.values_list('points', flat=True))
+                # A leader, a user in the top 1% and a median user
+                probes = {'top': points[-1], 'p99': points[int(size * 0.99)], 'median': points[size // 2]}
+
+                with connection.schema_editor() as editor:
+                    editor.remove_index(CustomUser, rank_index)
+                for label, value in probes.items():
+                    stats = measure(lambda: legacy_rank(value), repeat)
+                    self.stdout.write(format_summary(f'  no index  rank ({label})', stats))
+                self.stdout.write(format_summary('  no index  top 10', measure(legacy_top, repeat)))
+                with connection.schema_editor() as editor:
+                    editor.add_index(CustomUser, rank_index)
+
+                for label, value in probes.items():
+                    stats = measure(lambda: legacy_rank(value), repeat)
+                    self.stdout.write(format_summary(f'  indexed   COUNT rank ({label})', stats))
+                self.stdout.write(format_summary('  indexed   top 10', measure(legacy_top, repeat)))
+
+                ranking = RankIndex()
+                start = time.perf_counter()
+                ranking.rebuild()
+                self.stdout.write(f'  ranking tree build: {(time.perf_counter() - start) * 1000:.1f}ms')
+                for label, value in probes.items():
+                    stats = measure(lambda: ranking.rank(value), repeat * 50)
+                    self.stdout.write(format_summary(f'  ranking   rank ({label})', stats))
+                self.stdout.write(format_summary('  ranking   top 10', measure(ranking.top, repeat)))
+                median_user = CustomUser.objects.filter(points=probes['median']).first()
+                self.stdout.write(format_summary(
+                    '  ranking   around me (median)', measure(lambda: ranking.around(median_user), repeat),
+                ))
+
+                rng = random.Random(1)
+
+                def change():
+                    old = rng.choice(points)
+                    ranking._apply([(old, -1), (old + 1, 1)])
+
+                self.stdout.write(format_summary('  ranking   incremental update', measure(change, repeat * 50)))
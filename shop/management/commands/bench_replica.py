@@ -0,0 +1,176 @@
+import argparse
+import http.client
+import logging
+import os
+import random
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connections
+
+from shop.bench import benchmark_database, login_session, percentile, seed_catalog, seed_users
+from shop.models import CustomUser, Product
+from shop.replicas import refresh_sqlite_replica
+
+from .bench_asgi import HOST, free_port, serve_wsgi, wait_for
+
+MODES = {
+    'primary': 'every query on the primary',
+    'replica': 'catalog reads on the SQLite replica',
+}
+
+
+def replica_name(database_name):
+    return f'{database_name}.replica'
+
+
+def run_mixed_load(port, readers, writers, read_paths, write_paths, duration):
+    """Readers GET catalog pages while writers add to their carts; timings per role"""
+    timings = {'read': [], 'write': []}
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client(role, index, headers):
+        rng = random.Random(f'{role}{index}')
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        while time.perf_counter() < deadline:
+            method, path = ('GET', rng.choice(read_paths)(rng)) if role == 'read' else ('POST', write_paths(rng))
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                connection.close()
+                continue
+            timings[role].append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=('read', index, headers)) for index, headers in enumerate(readers)]
+    threads += [threading.Thread(target=client, args=('write', index, headers)) for index, headers in enumerate(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Throughput of catalog reads and cart writes under a mixed load, with every query on the primary '
+        'vs catalog reads on the SQLite replica (refreshed by the server every REPLICA_REFRESH_INTERVAL '
+        'seconds), each on a seeded throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--readers', type=int, default=8, help='Concurrent clients browsing the catalog')
+        parser.add_argument('--writers', type=int, default=4, help='Concurrent clients adding to their carts')
+        parser.add_argument('--duration', type=float, default=10.0, metavar='SECONDS')
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=1000)
+        # Internal: the server side of a run
+        parser.add_argument('--serve', choices=list(MODES), help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options['serve'], options['port'], options['database_name'])
+
+        with benchmark_database() as connection:
+            self.stdout.write(f"Seeding {options['products']} products and {options['users']} users...")
+            seed_catalog(options['products'])
+            seed_users(options['users'])
+            product_ids = list(Product.objects.values_list('pk', flat=True))
+            users = list(CustomUser.objects.order_by('pk')[:options['readers'] + options['writers']])
+            # Logged in: the anonymous page cache would answer the reads without a query
+            headers = []
+            for user in users:
+                csrf_token = secrets.token_hex(16)
+                headers.append({
+                    'Cookie': f'{settings.SESSION_COOKIE_NAME}={login_session(user)}; '
+                              f'{settings.CSRF_COOKIE_NAME}={csrf_token}',
+                    'X-CSRFToken': csrf_token,
+                    'X-Requested-With': 'XMLHttpRequest',
+                })
+            read_paths = [
+                lambda rng: '/fr/',
+                lambda rng: '/fr/products/',
+                lambda rng: f'/fr/product/{rng.choice(product_ids)}/',
+                lambda rng: '/fr/leaderboard/',
+            ]
+            database_name = connection.settings_dict['NAME']
+            # The servers open their own connections
+            connection.close()
+
+            for mode in options['modes']:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{mode.upper()}: {MODES[mode]}'))
+                with self.server(mode, database_name) as port:
+                    # Warm up templates, caches and the ranking tree
+                    run_mixed_load(port, headers[:2], [], read_paths, None, 1.0)
+                    timings, errors, elapsed = run_mixed_load(
+                        port, headers[:options['readers']], headers[options['readers']:],
+                        read_paths, lambda rng: f'/fr/cart/add/{rng.choice(product_ids)}/', options['duration'],
+                    )
+                self.report(timings, errors, elapsed)
+
+    @contextmanager
+    def server(self, mode, database_name):
+        port = free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_replica',
+                '--serve', mode, '--port', str(port), '--database-name', database_name,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(port)
+            yield port
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            for name in (replica_name(database_name), f'{replica_name(database_name)}.tmp'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def serve(self, mode, port, database_name):
+        connections['default'].settings_dict['NAME'] = database_name
+        # Production-like: no query log, no per-request access log
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        logging.getLogger('django.server').setLevel(logging.WARNING)
+        if mode == 'replica':
+            connections[settings.REPLICA_DATABASE].settings_dict['NAME'] = replica_name(database_name)
+            refresh_sqlite_replica()
+            threading.Thread(target=self.refresh_forever, daemon=True).start()
+        else:
+            settings.REPLICA_DATABASE = None
+        serve_wsgi(port, get_internal_wsgi_application())
+
+    def refresh_forever(self):
+        while True:
+            time.sleep(settings.REPLICA_REFRESH_INTERVAL)
+            refresh_sqlite_replica()
+
+    def report(self, timings, errors, elapsed):
+        for role, label in (('read', 'catalog reads'), ('write', 'cart writes')):
+            values = [value * 1000 for value in timings[role]]
+            self.stdout.write(
+                f'  {label:<14} {len(values) / elapsed:8.1f} req/s  '
+                f'p50={percentile(values, 50):7.2f}ms p99={percentile(values, 99):8.2f}ms'
+            )
+        self.stdout.write(f'  errors={len(errors)} {sorted(set(map(str, errors)))[:5] if errors else ""}')
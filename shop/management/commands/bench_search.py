@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Sum
+
+from shop.bench import benchmark_database, format_summary, measure, seed_catalog
+from shop.models import Product
+from shop.search import SqliteFTSBackend
+
+QUERIES = ['nike', 'runner', 'air max', 'kalo', 'pelcha', 'bar']
+
+
+def legacy_search(queryset, query):
+    # The Q filter shop.views.products used before the search index
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(brand__icontains=query)
+    )
+
+
+def run_listing(queryset):
+    # What the products view evaluates: the count, the stock sum and the first page
+    queryset.count()
+    queryset.aggregate(total_stock=Sum('stock'))
+    list(queryset[:24])
+
+
+class Command(BaseCommand):
+    help = 'Compare catalog search latency: icontains Q filter vs the FTS5 index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        fts = SqliteFTSBackend()
+        for size in options['sizes']:
+            with benchmark_database():
+                self.stdout.write(f'Seeding {size} products...')
+                seed_catalog(size)
+                fts.rebuild()
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{size} products'))
+                base = Product.objects.filter(stock__gt=0)
+                for query in QUERIES:
+                    legacy = measure(lambda: run_listing(legacy_search(base, query)), options['repeat'])
+                    ranked = measure(lambda: run_listing(fts.search(base, query)), options['repeat'])
+                    self.stdout.write(format_summary(f'  icontains "{query}"', legacy))
+                    self.stdout.write(format_summary(f'  fts5      "{query}"', ranked))
+                    speedup = legacy['p50'] / ranked['p50'] if ranked['p50'] else 0
+                    self.stdout.write(f'  -> {speedup:.1f}x at p50')
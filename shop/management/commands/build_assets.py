@@ -0,0 +1,23 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+
+from shop.assets import build, sources, stylesheet_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile static/css/site.css from the Tailwind classes the templates and scripts use '
+        '(run after changing classes in a template, then collectstatic)'
+    )
+
+    def handle(self, *args, **options):
+        css = build()
+        path = stylesheet_path()
+        path.write_text(css, encoding='utf-8')
+        size = len(css.encode())
+        compressed = len(gzip.compress(css.encode(), 9))
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.relative_to(path.parents[2])} from {len(sources())} file(s): '
+            f'{size / 1024:.1f} KB, {compressed / 1024:.1f} KB gzipped'
+        ))
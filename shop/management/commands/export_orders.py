@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shop.exports import CHUNK_SIZE, FORMATS, filter_orders, manifest_rows
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the orders, with their items, as a CSV or JSON lines manifest for the courier or accounting, '
+        'filtered by status, wilaya and day range; streamed, so the size of the export does not matter'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument(
+            '--status', action='append', choices=[status for status, _ in Order.STATUS_CHOICES],
+            help='Repeat for several statuses',
+        )
+        parser.add_argument('--wilaya', action='append', help='Wilaya code (16); repeat for several wilayas')
+        parser.add_argument('--since', help='YYYY-MM-DD, first day included')
+        parser.add_argument('--until', help='YYYY-MM-DD, last day included')
+        parser.add_argument('--output', help='File to write, standard output when omitted')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        days = {}
+        for bound in ('since', 'until'):
+            if options[bound]:
+                try:
+                    days[bound] = parse_date(options[bound])
+                except ValueError:
+                    days[bound] = None
+                if days[bound] is None:
+                    raise CommandError(f'Invalid date {options[bound]!r}, expected YYYY-MM-DD')
+
+        orders = filter_orders(Order.objects.all(), options['status'], options['wilaya'], **days)
+        lines, _ = FORMATS[options['format']]
+        written = 0
+
+        def counted(rows):
+            nonlocal written
+            for row in rows:
+                written += 1
+                yield row
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(lines(counted(manifest_rows(orders, options['chunk_size']))))
+            self.stdout.write(self.style.SUCCESS(f"{written} order(s) written to {options['output']}"))
+        else:
+            for line in lines(counted(manifest_rows(orders, options['chunk_size']))):
+                self.stdout.write(line, ending='')
+            # The manifest is on the standard output
+            self.stderr.write(self.style.SUCCESS(f'{written} order(s) written'))
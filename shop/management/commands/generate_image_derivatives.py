@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop.images import generate, is_current
+from shop.models import Category, Product
+
+
+def _generate(model_label, pk, force):
+    try:
+        return generate(model_label, pk, force=force)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Make the resized WebP/JPEG renditions of the product and category images that have none '
+        '(existing media, or uploads whose background job was lost), several images at a time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.IMAGE_WORKERS, 1))
+        parser.add_argument('--force', action='store_true', help='Make them again even when they are current')
+
+    def handle(self, *args, **options):
+        jobs = [
+            (model._meta.label, instance.pk)
+            for model in (Product, Category)
+            for instance in model.objects.exclude(image='').exclude(image=None).only('image', 'image_renditions')
+            if options['force'] or not is_current(instance)
+        ]
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                written = sum(pool.map(lambda job: _generate(*job, options['force']), jobs))
+        else:
+            written = sum(generate(*job, force=options['force']) for job in jobs)
+        self.stdout.write(self.style.SUCCESS(f'{len(jobs)} image(s), {written / 1024:.0f} KB of renditions written'))
+        self.report_card_weight()
+
+    def report_card_weight(self):
+        """What a listing downloads per product card: the original upload vs the card renditions"""
+        totals = {'original': 0, 'webp 1x': 0, 'webp 2x': 0, 'jpeg 1x': 0}
+        counted = 0
+        for product in Product.objects.exclude(image='').exclude(image=None).only('image', 'image_renditions'):
+            if not is_current(product) or not product.image_renditions['files']:
+                continue
+            storage = product.image.storage
+            card = product.image_renditions['files']['card']
+            counted += 1
+            totals['original'] += product.image.size
+            totals['webp 1x'] += storage.size(card['webp']['1'])
+            # Small originals have no 2x
+            totals['webp 2x'] += storage.size(card['webp'].get('2', card['webp']['1']))
+            totals['jpeg 1x'] += storage.size(card['jpeg']['1'])
+        if not counted:
+            return
+        original = totals.pop('original')
+        self.stdout.write(f'Card images of {counted} product(s): originals {original / 1024:.0f} KB')
+        for label, size in totals.items():
+            self.stdout.write(f'  {label:<8} {size / 1024:6.0f} KB ({1 - size / original:.0%} less)')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shop.loadtest import SCENARIOS, generate_scenarios, write_traces
+
+
+class Command(BaseCommand):
+    help = (
+        'Write seeded visitor journeys (' + ', '.join(SCENARIOS) + ') as a trace file for loadtest_replay, '
+        'for when no traffic was recorded'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Trace file (JSON lines) to write')
+        parser.add_argument('--visitors', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--think-time', type=float, default=2.0, metavar='SECONDS', help='Mean pause between requests')
+
+    def handle(self, *args, **options):
+        traces = generate_scenarios(options['visitors'], options['seed'], options['think_time'])
+        write_traces(options['output'], traces)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(traces)} request(s) of {options['visitors']} visitor(s) to {options['output']}"
+        ))
@@ -0,0 +1,167 @@
+import argparse
+import http.client
+import json
+import logging
+import secrets
+import subprocess
+import sys
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connections
+
+from cart.captcha_stub import StubVerifier
+from shop.bench import benchmark_database, login_session, seed_catalog, seed_users
+from shop.loadtest import build_sessions, generate_scenarios, read_traces, replay, summarize_replay
+from shop.models import CustomUser, Product
+
+from .bench_asgi import HOST, free_port, serve_wsgi, wait_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay recorded (TraceRecorderMiddleware) or generated traffic against a local WSGI server on a seeded '
+        'throwaway database, from several client processes, and report throughput and p50/p95/p99 per URL name; '
+        'fails when a view is slower or fails more often than the given budgets'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('traces', nargs='?', help='Trace file (JSON lines); generated journeys when omitted')
+        parser.add_argument('--visitors', type=int, default=200, help='Visitors generated without a trace file')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--processes', type=int, default=2, help='Client processes')
+        parser.add_argument('--threads', type=int, default=4, help='Visitors replayed at once per client process')
+        parser.add_argument(
+            '--speed', type=float, default=0.0,
+            help='Replay the recorded pauses sped up this many times (0: no pauses, as fast as the server answers)',
+        )
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--report', help='Write the per-view results to this JSON file')
+        parser.add_argument('--max-p95', type=float, metavar='MS', help='Fail when a view p95 is above this')
+        parser.add_argument('--max-error-rate', type=float, metavar='RATIO', help='Fail above this share of errors')
+        # Internal: the server side of a run
+        parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options['port'], options['database_name'])
+
+        if options['traces']:
+            traces = read_traces(options['traces'])
+        else:
+            traces = generate_scenarios(options['visitors'], options['seed'])
+        if not traces:
+            raise CommandError('No traces to replay')
+
+        with benchmark_database() as connection:
+            self.stdout.write(f"Seeding {options['products']} products and {options['users']} users...")
+            seed_catalog(options['products'])
+            seed_users(options['users'])
+            product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+            sessions, skipped = build_sessions(traces, product_ids)
+            users = list(CustomUser.objects.order_by('pk')[:len(sessions)])
+            replayed = [
+                (steps, self.cookies(users[index % len(users)], any(step[5] for step in steps)))
+                for index, steps in enumerate(sessions.values())
+            ]
+            self.stdout.write(
+                f'Replaying {sum(len(steps) for steps in sessions.values())} request(s) of {len(sessions)} '
+                f'visitor(s), {skipped} skipped, from {options["processes"]} process(es) '
+                f'x {options["threads"]} thread(s)'
+            )
+            database_name = connection.settings_dict['NAME']
+            # The server opens its own connections
+            connection.close()
+
+            with self.server(database_name) as port:
+                self.warm_up(port)
+                timings, errors, elapsed = replay(
+                    port, replayed, options['processes'], options['threads'], options['speed'],
+                )
+
+        summary = summarize_replay(timings, errors, elapsed)
+        self.report(summary, errors)
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump({'elapsed': elapsed, 'skipped': skipped, 'views': summary}, f, indent=2)
+        self.check_budgets(summary, options['max_p95'], options['max_error_rate'])
+
+    def cookies(self, user, authenticated):
+        csrf_token = secrets.token_hex(16)
+        anonymous = f'{settings.CSRF_COOKIE_NAME}={csrf_token}'
+        return {
+            'csrf': csrf_token,
+            'anonymous': anonymous,
+            'authenticated': (
+                f'{anonymous}; {settings.SESSION_COOKIE_NAME}={login_session(user)}' if authenticated else anonymous
+            ),
+        }
+
+    @contextmanager
+    def server(self, database_name):
+        port = free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'loadtest_replay',
+                '--serve', '--port', str(port), '--database-name', database_name,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(port)
+            yield port
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    def warm_up(self, port):
+        # Caches, the ranking tree and the replica copy; not counted
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        try:
+            for path in ('/fr/', '/fr/products/', '/fr/leaderboard/'):
+                connection.request('GET', path)
+                connection.getresponse().read()
+        finally:
+            connection.close()
+
+    def serve(self, port, database_name):
+        connections['default'].settings_dict['NAME'] = database_name
+        # Production-like: no query log, no per-request access log, and no recording of the replay itself
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [HOST]
+        settings.LOADTEST_RECORD_PATH = ''
+        settings.REPLICA_DATABASE = None
+        logging.getLogger('django.server').setLevel(logging.WARNING)
+        # Checkout's captcha, verified offline
+        verifier = StubVerifier().start()
+        settings.RECAPTCHA_VERIFY_URL = verifier.url
+        serve_wsgi(port, get_internal_wsgi_application())
+
+    def report(self, summary, errors):
+        self.stdout.write(f"{'view':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for view, row in summary.items():
+            line = (
+                f"{view:<20} {row['requests']:>9} {row['per_second']:>8.1f} {row['p50']:>8.1f} "
+                f"{row['p95']:>8.1f} {row['p99']:>8.1f} {row['errors']:>7}"
+            )
+            self.stdout.write(self.style.MIGRATE_HEADING(line) if view == '*' else line)
+        if errors:
+            kinds = sorted({f'{view}:{error}' for view, error in errors})
+            self.stdout.write(f'  errors: {", ".join(kinds[:10])}')
+
+    def check_budgets(self, summary, max_p95, max_error_rate):
+        failures = []
+        for view, row in summary.items():
+            if max_p95 is not None and row['p95'] > max_p95:
+                failures.append(f"{view} p95 {row['p95']:.1f}ms > {max_p95:g}ms")
+            if max_error_rate is not None and row['requests'] and row['errors'] / row['requests'] > max_error_rate:
+                failures.append(f"{view} errors {row['errors'] / row['requests']:.1%} > {max_error_rate:.1%}")
+        if failures:
+            raise CommandError('Over budget: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Within budget'))
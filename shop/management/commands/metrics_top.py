@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from shop.metrics import HISTOGRAMS, quantile, reset, snapshot
+
+
+def mean(histogram):
+    return histogram['sum'] / histogram['count'] if histogram['count'] else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Views that cost the most per request (queries, database, render or total time) since the last reset '
+        '(counts live in the shared cache, so a local-memory cache only shows this process)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=list(HISTOGRAMS), default='duration', help='Mean to rank the views by')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--reset', action='store_true', help='Zero the counts after printing them')
+
+    def handle(self, *args, **options):
+        data = snapshot()
+        by = options['by']
+        views = sorted(
+            (view for view in data if data[view][by]['count']),
+            key=lambda view: mean(data[view][by]),
+            reverse=True,
+        )[:options['limit']]
+        self.stdout.write(
+            f"{'view':<36} {'requests':>9} {'mean ms':>9} {'p95 ms':>9} {'queries':>8} {'db ms':>8} {'render ms':>10}"
+        )
+        for view in views:
+            metrics = data[view]
+            p95 = quantile(metrics['duration'], 0.95, 'duration')
+            self.stdout.write(
+                f"{view[:36]:<36} {metrics['requests']:>9} {mean(metrics['duration']) * 1000:>9.1f} "
+                f"{'≤' + format(p95 * 1000, '.0f'):>9} {mean(metrics['queries']):>8.1f} "
+                f"{mean(metrics['db']) * 1000:>8.1f} {mean(metrics['render']) * 1000:>10.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(data)} view(s) recorded, ranked by mean {by}'))
+        if options['reset']:
+            reset()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shop.page_cache import BYPASS, HIT, MISS, reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Hit ratio and mean latency of the anonymous page cache since the last reset '
+        '(counters live in the shared cache, so a local-memory cache only shows this process)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        current = stats()
+        for outcome in (HIT, MISS, BYPASS):
+            self.stdout.write(
+                f"{outcome:<7} {current[outcome]['requests']:>9} request(s)  {current[outcome]['mean_ms']:8.2f}ms mean"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Hit ratio: {current['hit_ratio']:.1%}"))
+        if options['reset']:
+            reset_stats()
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import ReferralStats
+from shop.referrals import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the referral closure table and every referrer\'s stats from referred_by '
+        'and the points ledger (after imports or raw SQL edits of referred_by)'
+    )
+
+    def handle(self, *args, **options):
+        paths = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'{paths} referral path(s), {ReferralStats.objects.count()} referrer(s)'
+        ))
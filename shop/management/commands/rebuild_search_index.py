@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog full-text search index from the Product table'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic():
+            indexed = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'{backend.__class__.__name__}: {indexed} product(s) indexed'
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import CustomUser
+from shop.points import drifted_users, ledger_balance
+from shop.ranking import invalidate_ranking
+
+
+class Command(BaseCommand):
+    help = 'Recompute CustomUser.points from the points ledger where the stored balance drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted balances')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        checked = repaired = 0
+        while True:
+            chunk = list(
+                CustomUser.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            checked += len(chunk)
+
+            with transaction.atomic():
+                drifted = list(drifted_users(CustomUser.objects.filter(pk__in=chunk)).values_list('pk', flat=True))
+                if drifted and not options['dry_run']:
+                    CustomUser.objects.filter(pk__in=drifted).update(points=ledger_balance())
+            repaired += len(drifted)
+            if drifted and options['verbosity'] > 1:
+                self.stdout.write(f'Drifted users: {drifted}')
+
+        if repaired and not options['dry_run']:
+            invalidate_ranking()
+        action = 'would be repaired' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{checked} user(s) checked, {repaired} {action}'))
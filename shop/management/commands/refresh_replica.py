@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shop.replicas import refresh_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary to the read replica with the online backup API, once or every '
+        '--interval seconds (other backends replicate on their own)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, metavar='SECONDS', nargs='?', const=settings.REPLICA_REFRESH_INTERVAL,
+            help=f'Keep refreshing (default every {settings.REPLICA_REFRESH_INTERVAL}s)',
+        )
+
+    def handle(self, *args, **options):
+        alias = settings.REPLICA_DATABASE
+        if alias not in settings.DATABASES:
+            raise CommandError(f'No {alias!r} database configured')
+        if connections[alias].vendor != 'sqlite':
+            raise CommandError(f'The {alias!r} database is not SQLite: the database server keeps it up to date')
+
+        while True:
+            elapsed = refresh_sqlite_replica()
+            self.stdout.write(self.style.SUCCESS(f'Replica refreshed in {elapsed * 1000:.1f}ms'))
+            if options['interval'] is None:
+                return
+            time.sleep(max(0.0, options['interval'] - elapsed))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.leaderboard import SnapshotError, parse_month, previous_month, snapshot_month
+
+
+class Command(BaseCommand):
+    help = (
+        'Snapshot the monthly leaderboard into MonthlyLeaderboard (default: last month), '
+        'optionally resetting or decaying points. Safe to re-run: an interrupted run resumes, '
+        'a finished month is left alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM, defaults to the previous month')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        reset = parser.add_mutually_exclusive_group()
+        reset.add_argument('--reset', action='store_true', help='Take the snapshotted points away from users')
+        reset.add_argument(
+            '--decay', type=float, metavar='KEEP',
+            help='Let users keep this share (0-1) of their snapshotted points',
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            month = parse_month(options['month'])
+            if month is None:
+                raise CommandError(f"Invalid month {options['month']!r}, expected YYYY-MM")
+        else:
+            month = previous_month()
+
+        keep = 0.0 if options['reset'] else options['decay']
+        if keep is not None and not 0 <= keep <= 1:
+            raise CommandError('--decay must be between 0 and 1')
+
+        try:
+            snapshot = snapshot_month(month, keep=keep, chunk_size=options['chunk_size'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'{month:%Y-%m}: {snapshot.ranked} user(s) ranked ({snapshot.get_status_display()})'
+        ))
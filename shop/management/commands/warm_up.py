@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the translation catalogs, URL resolvers and compiled templates a worker warms up '
+        'before taking traffic (WARMUP_ON_STARTUP), and report what each step costs'
+    )
+
+    def handle(self, *args, **options):
+        report = warm_up()
+        for name, (count, elapsed) in report.items():
+            self.stdout.write(f'  {name:<14} {count:4} item(s) {elapsed * 1000:8.1f}ms')
+        total = sum(elapsed for _, elapsed in report.values())
+        self.stdout.write(self.style.SUCCESS(f'Warmed up in {total * 1000:.1f}ms'))
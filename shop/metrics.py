@@ -0,0 +1,295 @@
+"""
+Per-view request metrics.
+
+MetricsMiddleware files every request under the name of the URL it
+resolved to (home, products, cart, confirm_order, ...; admin pages under
+admin:..., unresolved paths under UNRESOLVED). For a sampled share of them
+(METRICS_SAMPLE_RATE) it also records, into histograms:
+
+- the total latency, from the first middleware to the last,
+- the number of queries and the time spent in them, counted by a
+  connection.execute_wrapper() on the request's connection and on those of
+  the gather_reads() worker threads,
+- the time spent rendering templates (context processors included), timed
+  by the DjangoTemplates backend below: Django's template_rendered signal
+  is only sent under the test runner.
+
+A request only costs a few perf_counter() calls and a dict update under a
+lock; each process adds its counts to the shared cache every
+METRICS_FLUSH_INTERVAL seconds, where /metrics (Prometheus text format,
+for staff or a METRICS_TOKEN bearer) and the metrics_top command read the
+totals of every worker. A local-memory cache only shows one process.
+"""
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from django.utils.crypto import constant_time_compare
+from django.utils.deprecation import MiddlewareMixin
+
+UNRESOLVED = '<unresolved>'
+VIEWS_KEY = 'metrics:views'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# name -> (Prometheus name, help, bucket upper bounds, unit of the stored integer sum)
+HISTOGRAMS = {
+    'duration': ('shop_request_duration_seconds', 'Time from the first middleware to the last', SECONDS_BUCKETS, 1e-6),
+    'queries': ('shop_request_queries', 'Database queries run by the request', QUERY_BUCKETS, 1),
+    'db': ('shop_request_db_seconds', 'Time spent in database queries', SECONDS_BUCKETS, 1e-6),
+    'render': ('shop_request_render_seconds', 'Time spent rendering templates', SECONDS_BUCKETS, 1e-6),
+}
+REQUESTS_METRIC = 'shop_requests_total'
+
+# The RequestMetrics of the sampled request being served, None otherwise
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def _key(view, name, field):
+    return f'metrics:{view}:{name}:{field}'
+
+
+class RequestMetrics:
+    """What one request spent; also the execute wrapper that times its queries"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Seconds of each query (list.append is safe from the worker threads)
+        self.queries = []
+        self.render = 0.0
+        self._rendering = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(time.perf_counter() - start)
+
+    @contextmanager
+    def rendering(self):
+        # Templates rendered from within a template are part of the outer one's time
+        self._rendering += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._rendering -= 1
+            if not self._rendering:
+                self.render += time.perf_counter() - start
+
+    def values(self):
+        return {
+            'duration': time.perf_counter() - self.started,
+            'queries': len(self.queries),
+            'db': sum(self.queries),
+            'render': self.render,
+        }
+
+
+def collect_queries():
+    """Count the queries of this thread's connection into the current request's metrics"""
+    metrics = _current.get()
+    return connection.execute_wrapper(metrics) if metrics is not None else nullcontext()
+
+
+def add_to_counter(key, amount):
+    """Add amount to a counter of the shared cache, creating it (without expiry) when missing"""
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # Created by another process in between: add() fails, incr() then works
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+class Registry:
+    """Counts of this process not yet added to the cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._views = set()
+        self._flushed = time.monotonic()
+
+    def observe(self, view, values=None):
+        with self._lock:
+            self._views.add(view)
+            self._pending[_key(view, 'requests', 'count')] += 1
+            for name, value in (values or {}).items():
+                _, _, buckets, unit = HISTOGRAMS[name]
+                # Index of the first bucket holding value, len(buckets) for +Inf
+                index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+                self._pending[_key(view, name, index)] += 1
+                self._pending[_key(view, name, 'count')] += 1
+                self._pending[_key(view, name, 'sum')] += round(value / unit)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._views.clear()
+
+    def due(self):
+        return time.monotonic() - self._flushed >= settings.METRICS_FLUSH_INTERVAL
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            views = set(self._views)
+            self._flushed = time.monotonic()
+        for key, amount in pending.items():
+            add_to_counter(key, amount)
+        # Checked on every flush: a name lost to a concurrent update comes back at the next one
+        known = cache.get(VIEWS_KEY, [])
+        if not views <= set(known):
+            cache.set(VIEWS_KEY, sorted(views | set(known)), None)
+
+
+registry = Registry()
+
+
+def _keys(views):
+    keys = []
+    for view in views:
+        keys.append(_key(view, 'requests', 'count'))
+        for name, (_, _, buckets, _) in HISTOGRAMS.items():
+            keys += [_key(view, name, field) for field in [*range(len(buckets) + 1), 'count', 'sum']]
+    return keys
+
+
+def snapshot():
+    """Totals of every worker: {view: {'requests': n, metric: {'buckets', 'count', 'sum'}}}, after a flush of this one"""
+    registry.flush()
+    views = cache.get(VIEWS_KEY, [])
+    values = cache.get_many(_keys(views))
+
+    result = {}
+    for view in views:
+        result[view] = {'requests': values.get(_key(view, 'requests', 'count'), 0)}
+        for name, (_, _, buckets, unit) in HISTOGRAMS.items():
+            result[view][name] = {
+                'buckets': [values.get(_key(view, name, index), 0) for index in range(len(buckets) + 1)],
+                'count': values.get(_key(view, name, 'count'), 0),
+                'sum': values.get(_key(view, name, 'sum'), 0) * unit,
+            }
+    return result
+
+
+def reset():
+    """Zero the counts of every worker (others still add what they had not flushed)"""
+    registry.clear()
+    cache.delete_many(_keys(cache.get(VIEWS_KEY, [])) + [VIEWS_KEY])
+
+
+def quantile(histogram, q, name):
+    """Upper bound of the bucket holding the q quantile (inf past the last bucket), None without data"""
+    if not histogram['count']:
+        return None
+    buckets = HISTOGRAMS[name][2]
+    rank = q * histogram['count']
+    seen = 0
+    for index, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= rank:
+            return buckets[index] if index < len(buckets) else math.inf
+    return math.inf
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def exposition(data):
+    """The snapshot in the Prometheus text format"""
+    lines = [
+        f'# HELP {REQUESTS_METRIC} Requests served, sampled or not',
+        f'# TYPE {REQUESTS_METRIC} counter',
+    ]
+    lines += [f'{REQUESTS_METRIC}{{view="{_label(view)}"}} {metrics["requests"]}' for view, metrics in data.items()]
+    for name, (metric, description, buckets, _) in HISTOGRAMS.items():
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+        for view, metrics in data.items():
+            histogram = metrics[name]
+            label = f'view="{_label(view)}"'
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], histogram['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label}}} {_number(histogram["sum"])}')
+            lines.append(f'{metric}_count{{{label}}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff users or the METRICS_TOKEN bearer"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(authorization, f'Bearer {token}')) and not request.user.is_staff:
+        return HttpResponseForbidden()
+    response = HttpResponse(exposition(snapshot()), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Goes first, so that the latency covers every other middleware"""
+
+    def process_request(self, request):
+        # Threads of a WSGI server keep their context from one request to the next
+        _current.set(None)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            request._metrics = None
+            return None
+        request._metrics = RequestMetrics()
+        _current.set(request._metrics)
+        request._metrics_queries = ExitStack()
+        request._metrics_queries.enter_context(connection.execute_wrapper(request._metrics))
+        return None
+
+    def process_response(self, request, response):
+        metrics = getattr(request, '_metrics', None)
+        if metrics is not None:
+            request._metrics_queries.close()
+            _current.set(None)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else UNRESOLVED
+        registry.observe(view, metrics.values() if metrics is not None else None)
+        if registry.due():
+            registry.flush()
+        return response
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        with metrics.rendering():
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Django's template backend, timing renders into the current request's metrics"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
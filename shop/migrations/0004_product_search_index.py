@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only, other databases use the icontains backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+        "name, brand, description, category, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO shop_product_fts (rowid, name, brand, description, category) "
+        "SELECT p.id, p.name, p.brand, p.description, c.name "
+        "FROM shop_product p INNER JOIN shop_category c ON c.id = p.category_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0003_order_address_order_commune_order_full_name_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('shop', '0006_product_reserved'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['-points', 'id'], name='user_points_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_customuser_points_rank_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('status', models.CharField(choices=[('copying', 'Copie des points'), ('ranking', 'Calcul des rangs'), ('resetting', 'Remise à zéro des points'), ('done', 'Terminé')], default='copying', max_length=20)),
+                ('keep', models.FloatField(blank=True, null=True)),
+                ('last_user_id', models.IntegerField(default=0)),
+                ('last_points', models.IntegerField(blank=True, null=True)),
+                ('last_rank', models.IntegerField(default=0)),
+                ('ranked', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='monthlyleaderboard',
+            index=models.Index(fields=['month', 'rank'], name='leaderboard_month_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlyleaderboard',
+            index=models.Index(fields=['month', '-points', 'user'], name='leaderboard_month_points_idx'),
+        ),
+    ]
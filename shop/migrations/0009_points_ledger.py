@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    # Existing balances become the first ledger entry, so the ledger sums to them
+    CustomUser = apps.get_model('shop', 'CustomUser')
+    PointsTransaction = apps.get_model('shop', 'PointsTransaction')
+    users = CustomUser.objects.exclude(points=0).order_by('pk').values_list('pk', 'points')
+    last_pk = 0
+    while True:
+        chunk = list(users.filter(pk__gt=last_pk)[:5000])
+        if not chunk:
+            return
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(user_id=pk, delta=points, reason='opening') for pk, points in chunk
+        ])
+        last_pk = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_leaderboard_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('purchase', 'Achat'), ('referral', 'Parrainage'), ('welcome', 'Bonus de bienvenue'), ('monthly_reset', 'Remise à zéro mensuelle'), ('adjustment', 'Ajustement'), ('opening', "Solde d'ouverture")], max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.order')),
+                ('referral', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='points_user_created_idx'), models.Index(fields=['created_at', 'user'], name='points_created_user_idx')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
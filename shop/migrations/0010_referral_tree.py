@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def build_tree(apps, schema_editor):
+    # Closure rows for the existing referred_by links, then every referrer's counters
+    CustomUser = apps.get_model('shop', 'CustomUser')
+    ReferralPath = apps.get_model('shop', 'ReferralPath')
+    ReferralStats = apps.get_model('shop', 'ReferralStats')
+    quote = schema_editor.connection.ops.quote_name
+    users, paths = quote(CustomUser._meta.db_table), quote(ReferralPath._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {paths} (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+                SELECT referred_by_id, id, 1 FROM {users} WHERE referred_by_id IS NOT NULL
+                UNION ALL
+                SELECT u.referred_by_id, tree.descendant_id, tree.depth + 1
+                FROM tree JOIN {users} u ON u.id = tree.ancestor_id
+                WHERE u.referred_by_id IS NOT NULL AND tree.depth < 100
+            )
+            SELECT ancestor_id, descendant_id, depth FROM tree
+            '''
+        )
+
+    earning = ['purchase', 'referral', 'welcome']
+    downstream = dict(
+        ReferralPath.objects.filter(descendant__points_transactions__reason__in=earning)
+        .values_list('ancestor_id')
+        .annotate(total=Sum('descendant__points_transactions__delta'))
+    )
+    counts = ReferralPath.objects.values_list('ancestor_id').annotate(
+        direct=Count('pk', filter=Q(depth=1)),
+        indirect=Count('pk', filter=Q(depth__gt=1)),
+        deepest=Max('depth'),
+    )
+    ReferralStats.objects.bulk_create(
+        (
+            ReferralStats(
+                user_id=pk, direct_referrals=direct, indirect_referrals=indirect, depth=deepest,
+                downstream_points=downstream.get(pk, 0),
+            )
+            for pk, direct, indirect, deepest in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('shop', '0009_points_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReferralStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='referral_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('direct_referrals', models.PositiveIntegerField(default=0)),
+                ('indirect_referrals', models.PositiveIntegerField(default=0)),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('downstream_points', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Referral stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['referred_by', '-created_at', '-id'], name='user_referrals_keyset_idx'),
+        ),
+        migrations.AddField(
+            model_name='referralpath',
+            name='ancestor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_paths', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='referralpath',
+            name='descendant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_paths', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='referralpath',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_path_unique'),
+        ),
+        migrations.RunPython(build_tree, migrations.RunPython.noop),
+    ]
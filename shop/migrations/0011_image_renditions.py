@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_referral_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,7 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 import uuid
+
+from .images import srcset
+
+
 class CustomUser(AbstractUser):
     points = models.IntegerField(default=0)
     referral_code = models.CharField(max_length=20, unique=True, blank=True)
@@ -32,6 +38,33 @@ class CustomUser(AbstractUser):
         related_query_name="user",
     )
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Leaderboard order, top-N and "around me" reads (see shop.ranking)
+            models.Index(fields=['-points', 'id'], name='user_points_rank_idx'),
+            # A referrer's referrals, newest first, as keyset pages
+            models.Index(fields=['referred_by', '-created_at', '-id'], name='user_referrals_keyset_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored points, so a later save can report the change to the ranking
+        instance._stored_points = instance.__dict__.get('points')
+        # Stored referrer, so a later save can move the user in the referral tree
+        instance._stored_referred_by = instance.__dict__.get('referred_by_id')
+        return instance
+    
+    def clean(self):
+        super().clean()
+        if self.pk and self.referred_by_id and (
+            self.referred_by_id == self.pk
+            or self.descendant_paths.filter(descendant_id=self.referred_by_id).exists()
+        ):
+            raise ValidationError({
+                'referred_by': "Un utilisateur ne peut pas être parrainé par lui-même ou par un de ses filleuls.",
+            })
+    
     def save(self, *args, **kwargs):
         if not self.referral_code:
             # Generate a unique referral code
@@ -51,6 +84,8 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    # Resized copies of image (shop.images), filled in the background after an upload
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -95,6 +130,13 @@ class Product(models.Model):
         ('extra_large', 'Très Grand'),
     ]
     
+    # Size labels per product type, built once for get_size_display()
+    SIZE_LABELS = {
+        'shoe': dict(SHOE_SIZES),
+        'bijoux': dict(BIJOUX_SIZES),
+        'sac': dict(SAC_SIZES),
+    }
+    
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -104,21 +146,54 @@ class Product(models.Model):
     brand = models.CharField(max_length=100)
     color = models.CharField(max_length=50)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of image (shop.images), filled in the background after an upload
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.IntegerField(default=0)
+    # Units held by carts (cart.reservations), only ever moved with F() updates
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog (see shop.pagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_keyset_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_keyset_idx'),
+            # Available products only (the home page, a category's listing newest first)
+            models.Index(
+                fields=['category', 'created_at', 'id'],
+                condition=models.Q(stock__gt=models.F('reserved')),
+                name='product_available_idx',
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.name} - {self.brand}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored category, so a save that moves the product drops the old category's pages too
+        instance._stored_category_id = instance.__dict__.get('category_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Never write back a stale copy of the reservation counter or of the renditions
+        # (both are written with update() queries)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('reserved', 'image_renditions')
+            ]
+        super().save(*args, **kwargs)
+    
+    @property
+    def available(self):
+        """Stock that is not held by a cart"""
+        return max(0, self.stock - self.reserved)
+    
     def get_size_display(self):
         """Get the appropriate size choices based on product type"""
-        if self.product_type == 'shoe':
-            return dict(self.SHOE_SIZES).get(self.size, self.size)
-        elif self.product_type == 'bijoux':
-            return dict(self.BIJOUX_SIZES).get(self.size, self.size)
-        elif self.product_type == 'sac':
-            return dict(self.SAC_SIZES).get(self.size, self.size)
-        return self.size
+        return self.SIZE_LABELS.get(self.product_type, {}).get(self.size, self.size)
     
     def get_product_type_icon(self):
         """Get appropriate icon for product type"""
@@ -130,9 +205,10 @@ class Product(models.Model):
         }
         return icons.get(self.product_type, '🛍️')
     
-    def get_image_url(self):
+    def get_image_url(self, rendition='card'):
+        """URL of the image at rendition size, the original upload until it has been resized"""
         if self.image and hasattr(self.image, 'url'):
-            return self.image.url
+            return srcset(self, rendition)[0]
         return '/static/images/default-product.jpg'
 
 class Order(models.Model):
@@ -144,6 +220,14 @@ class Order(models.Model):
         ('delivered', 'Livrée'),
         ('cancelled', 'Annulée'),
     ]
+    # status -> the statuses an order can be moved to it from
+    STATUS_TRANSITIONS = {
+        'confirmed': ('pending',),
+        'preparation': ('confirmed',),
+        'shipped': ('confirmed', 'preparation'),
+        'delivered': ('shipped',),
+        'cancelled': ('pending', 'confirmed', 'preparation'),
+    }
     
     WILAYA_CHOICES = [
         ('01', '01 - Adrar'),
@@ -225,6 +309,15 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # A customer's latest orders (profile page)
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Admin changelist: latest first, date hierarchy, status filter
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ]
+    
     def save(self, *args, **kwargs):
         if not self.order_number:
             # Generate unique order number
@@ -256,6 +349,112 @@ class MonthlyLeaderboard(models.Model):
     class Meta:
         unique_together = ['month', 'user']
         ordering = ['month', 'rank']
+        indexes = [
+            # Serving a past month, and the snapshot's ranking pass (shop.leaderboard)
+            models.Index(fields=['month', 'rank'], name='leaderboard_month_rank_idx'),
+            models.Index(fields=['month', '-points', 'user'], name='leaderboard_month_points_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.month.strftime('%B %Y')} - {self.user.username} (Rank {self.rank})"
+
+class LeaderboardSnapshot(models.Model):
+    """Progress of the snapshot of one month into MonthlyLeaderboard, so a run can resume"""
+    COPYING = 'copying'
+    RANKING = 'ranking'
+    RESETTING = 'resetting'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (COPYING, 'Copie des points'),
+        (RANKING, 'Calcul des rangs'),
+        (RESETTING, 'Remise à zéro des points'),
+        (DONE, 'Terminé'),
+    ]
+    
+    month = models.DateField(unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=COPYING)
+    # Share of the snapshotted points users keep afterwards: None leaves points alone, 0 resets them
+    keep = models.FloatField(null=True, blank=True)
+    # Resume cursors: user id for the copy and reset passes, (points, user id) for the ranking pass
+    last_user_id = models.IntegerField(default=0)
+    last_points = models.IntegerField(null=True, blank=True)
+    last_rank = models.IntegerField(default=0)
+    ranked = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-month']
+    
+    def __str__(self):
+        return f"{self.month.strftime('%B %Y')} ({self.get_status_display()})"
+
+class PointsTransaction(models.Model):
+    """One change of a user's points; CustomUser.points is the running sum (see shop.points)"""
+    PURCHASE = 'purchase'
+    REFERRAL = 'referral'
+    WELCOME = 'welcome'
+    MONTHLY_RESET = 'monthly_reset'
+    ADJUSTMENT = 'adjustment'
+    OPENING = 'opening'
+    REASON_CHOICES = [
+        (PURCHASE, 'Achat'),
+        (REFERRAL, 'Parrainage'),
+        (WELCOME, 'Bonus de bienvenue'),
+        (MONTHLY_RESET, 'Remise à zéro mensuelle'),
+        (ADJUSTMENT, 'Ajustement'),
+        (OPENING, "Solde d'ouverture"),
+    ]
+    # Reasons that count as points earned (leaderboard windows, profile)
+    EARNING_REASONS = [PURCHASE, REFERRAL, WELCOME]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='points_transactions')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    referral = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # A user's history and earnings over a period
+            models.Index(fields=['user', 'created_at'], name='points_user_created_idx'),
+            # Earnings of everybody over a period
+            models.Index(fields=['created_at', 'user'], name='points_created_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} {self.delta:+d} ({self.reason})"
+
+
+class ReferralPath(models.Model):
+    """One (ancestor, descendant) pair of the referral tree, depth levels apart (see shop.referrals)"""
+    ancestor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='descendant_paths')
+    descendant = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='ancestor_paths')
+    depth = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='referral_path_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+
+class ReferralStats(models.Model):
+    """Counters of a referrer's tree, kept up to date by shop.referrals"""
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='referral_stats')
+    direct_referrals = models.PositiveIntegerField(default=0)
+    indirect_referrals = models.PositiveIntegerField(default=0)
+    # Levels below the user: 1 when only direct referrals, 0 without any
+    depth = models.PositiveIntegerField(default=0)
+    # Points earned (see PointsTransaction.EARNING_REASONS) by everybody below the user
+    downstream_points = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Referral stats"
     
     def __str__(self):
-        return f"{self.month.strftime('%B %Y')} - {self.user.username} (Rank {self.rank})"
\ No newline at end of file
+        return f"{self.user_id}: {self.direct_referrals} + {self.indirect_referrals} referrals"
@@ -0,0 +1,244 @@
+"""
+Full-page cache for anonymous catalog traffic.
+
+Anonymous visitors of the home, catalog and product pages all get the same
+HTML for a given language prefix and query string, so
+AnonymousPageCacheMiddleware keeps the whole response in the cache and
+serves it without running the view or its queries.
+
+Pages opt in by declaring what they depend on with cache_tags() (a product,
+a category, the catalog as a whole, the leaderboard). Each tag has a
+version token in the cache, and a page stores the versions it was built
+with: invalidate_tags() drops tag versions (after the commit), which makes
+every page built with them a miss. shop.signals drops them on catalog
+changes, the stock updates of cart.reservations and cart.checkout drop the
+tags of the products they touch, and points.award() the leaderboard's.
+Tag versions live in the default cache, so an invalidation only reaches
+the other worker processes when that cache is shared between them
+(REDIS_URL); with the per-process LocMemCache they keep serving their
+copies until PAGE_CACHE_TIMEOUT. Facet totals on a catalog page may lag for
+PAGE_CACHE_TIMEOUT seconds when the stock of a product that isn't on the
+page moves.
+
+Pages are only served to and stored from anonymous GETs without pending
+messages. Logged-in users always get a fresh page (their points, their own
+forms). A page is not stored when its view wrote the session or set a
+cookie, varies on something other than the language or the cookies, or
+isn't a plain 200, or when it was read from a replica snapshot older than
+one of its tags' versions (shop.replicas). The CSRF token in cached forms
+is stored as a placeholder and replaced with the visitor's own token on
+the way out; views that encode a fragment themselves put the placeholder
+in first with csrf_placeholders().
+
+Hits, misses, bypasses and the time spent on each are counted in the cache
+(stats(), the page_cache_stats command); every response of an opted-in
+page carries X-Page-Cache and a Server-Timing entry.
+"""
+import hashlib
+import re
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import cc_delim_re, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import add_to_counter
+from .replicas import get_versions, may_cache
+
+CATALOG_TAG = 'catalog'
+LEADERBOARD_TAG = 'leaderboard'
+
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-7f3b2a91'
+
+# Vary headers the cache key already covers: the language, and cookies (anonymous only)
+KEYED_VARY_HEADERS = {'accept-language', 'cookie'}
+# Headers left to the outer middleware on a hit
+SKIPPED_HEADERS = {'set-cookie', 'content-length', 'x-page-cache', 'server-timing'}
+
+HIT, MISS, BYPASS = 'hit', 'miss', 'bypass'
+STATS_KEY = 'pagecache:stats:{}'
+
+
+def product_tag(pk):
+    return f'product:{pk}'
+
+
+def category_tag(pk):
+    return f'category:{pk}'
+
+
+def cache_tags(request, *tags):
+    """Make the page cacheable for anonymous visitors, dropped whenever one of the tags is"""
+    declared = getattr(request, 'page_cache_tags', None)
+    if declared is None:
+        return
+    declared.update(tags)
+    if request.page_cache == MISS:
+        # Versions as of now, before the page is built: a change while it renders makes it stale at once
+        request._page_cache_versions.update(_tag_versions(tags))
+
+
+acache_tags = sync_to_async(cache_tags)
+
+
+def csrf_placeholders(request, html):
+    """
+    html with its CSRF tokens swapped for the placeholder each visitor's token replaces on the way out.
+
+    For fragments the view encodes itself (JSON): once escaped, their tokens
+    no longer match CSRF_INPUT_RE when the page is stored.
+    """
+    if getattr(request, 'page_cache_tags', None) is None:
+        # No middleware to put the tokens back
+        return html
+    return _placeholder(html)
+
+
+def _placeholder(html):
+    return CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', html)
+
+
+def _tag_key(tag):
+    return f'pagecache:tag:{tag}'
+
+
+def _forget(keys):
+    cache.delete_many(keys)
+
+
+def invalidate_tags(*tags):
+    """Retire every cached page that depends on one of the tags, once the transaction commits"""
+    keys = [_tag_key(tag) for tag in tags]
+    if keys:
+        transaction.on_commit(lambda: _forget(keys))
+
+
+def _tag_versions(tags):
+    """{tag key: version} of the tags, minting the missing ones"""
+    return get_versions([_tag_key(tag) for tag in tags])
+
+
+def _page_key(request):
+    query = urlencode(sorted((name, value) for name, values in request.GET.lists() for value in values))
+    url = f'{request.LANGUAGE_CODE}:{request.get_host()}{request.path}?{query}'
+    return 'pagecache:page:' + hashlib.sha256(url.encode()).hexdigest()
+
+
+def _count(outcome, elapsed):
+    for name, amount in ((outcome, 1), (f'{outcome}_us', int(elapsed * 1_000_000))):
+        add_to_counter(STATS_KEY.format(name), amount)
+
+
+def stats():
+    """Counters since the last reset_stats(): requests, hit ratio and mean milliseconds per outcome"""
+    names = [HIT, MISS, BYPASS]
+    values = cache.get_many([STATS_KEY.format(name) for name in names + [f'{name}_us' for name in names]])
+    result = {}
+    for name in names:
+        count = values.get(STATS_KEY.format(name), 0)
+        total_us = values.get(STATS_KEY.format(f'{name}_us'), 0)
+        result[name] = {'requests': count, 'mean_ms': total_us / count / 1000 if count else 0.0}
+    served = result[HIT]['requests'] + result[MISS]['requests']
+    result['hit_ratio'] = result[HIT]['requests'] / served if served else 0.0
+    return result
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format(name) for outcome in (HIT, MISS, BYPASS) for name in (outcome, f'{outcome}_us')])
+
+
+class AnonymousPageCacheMiddleware(MiddlewareMixin):
+    """
+    Serve and store the pages of anonymous GETs.
+
+    Goes after AuthenticationMiddleware (it needs the user) and before
+    MessageMiddleware (whose cookie it must see on the way out).
+    """
+
+    def _bypassed(self, request):
+        if request.method != 'GET' or CookieStorage.cookie_name in request.COOKIES:
+            return True
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            # No session at all: nobody is logged in
+            return False
+        # The session says whether someone logged in: loading the user here would load it
+        # a second time in async views, which go through request.auser()
+        return SESSION_KEY in request.session or '_messages' in request.session
+
+    def process_request(self, request):
+        request._page_cache_started = time.perf_counter()
+        request.page_cache_tags = set()
+        request._page_cache_versions = {}
+        if self._bypassed(request):
+            request.page_cache = BYPASS
+            return None
+
+        request.page_cache = MISS
+        request._page_cache_key = _page_key(request)
+        entry = cache.get(request._page_cache_key)
+        if entry is None or cache.get_many(list(entry['tags'])) != entry['tags']:
+            return None
+
+        request.page_cache = HIT
+        response = HttpResponse(
+            entry['content'].replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode()),
+            status=entry['status'],
+        )
+        for header, value in entry['headers']:
+            response.headers[header] = value
+        # Only ever stored for anonymous visitors
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def _storable(self, request, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return False
+        if getattr(request, 'session', None) is not None and request.session.modified:
+            return False
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'private' in cache_control or 'no-store' in cache_control:
+            return False
+        vary = {header.strip().lower() for header in cc_delim_re.split(response.headers.get('Vary', '')) if header}
+        # Not if read from a replica snapshot that predates one of the tags' versions
+        return vary <= KEYED_VARY_HEADERS and may_cache(request._page_cache_versions.values())
+
+    def process_response(self, request, response):
+        outcome = getattr(request, 'page_cache', None)
+        tags = getattr(request, 'page_cache_tags', None)
+        if outcome is None or (outcome != HIT and not tags):
+            # Not an opted-in page
+            return response
+
+        if outcome == MISS and self._storable(request, response):
+            cache.set(
+                request._page_cache_key,
+                {
+                    'content': _placeholder(response.content.decode()).encode(),
+                    'status': response.status_code,
+                    'headers': [
+                        (header, value) for header, value in response.headers.items()
+                        if header.lower() not in SKIPPED_HEADERS
+                    ],
+                    'tags': request._page_cache_versions,
+                },
+                settings.PAGE_CACHE_TIMEOUT,
+            )
+
+        if outcome != HIT and CSRF_PLACEHOLDER.encode() in response.content:
+            # Placeholders of csrf_placeholders(), stored as they are
+            response.content = response.content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+
+        elapsed = time.perf_counter() - request._page_cache_started
+        _count(outcome, elapsed)
+        response.headers['X-Page-Cache'] = outcome
+        response.headers['Server-Timing'] = f'pagecache;desc="{outcome}";dur={elapsed * 1000:.2f}'
+        return response
@@ -0,0 +1,156 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'shop.pagination.cursor'
+
+# sort name -> (ordering field, descending)
+SORTS = {
+    'newest': ('created_at', True),
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+}
+DEFAULT_SORT = 'newest'
+RELEVANCE = 'relevance'
+
+
+def encode_cursor(sort, row_key):
+    return signing.dumps([sort, *row_key], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, sort):
+    """Return the (value, pk) the cursor points after, or None if it is not usable"""
+    if not cursor:
+        return None
+    try:
+        cursor_sort, value, pk = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if cursor_sort != sort or not isinstance(pk, int):
+        return None
+
+    try:
+        if sort == 'newest':
+            value = parse_datetime(value)
+        elif sort in ('price_asc', 'price_desc'):
+            value = Decimal(value)
+        elif sort == RELEVANCE:
+            value = float(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    if value is None:
+        return None
+    return value, pk
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, sort):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.sort = sort
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate_keyset(queryset, sort, after=None, per_page=24, search_backend=None):
+    """
+    Fetch one page of queryset after the given cursor.
+
+    Pages are addressed by the last row's (sort value, id) instead of an
+    OFFSET, so every page is a bounded index range read costing the same as
+    page 1. Relevance sort needs a ranked search_backend.
+    """
+    position = decode_cursor(after, sort)
+
+    if sort == RELEVANCE:
+        if position:
+            queryset = search_backend.rank_after(queryset, *position)
+        # already ordered by (search_rank, id) by the backend
+    else:
+        field, descending = SORTS[sort]
+        if position:
+            value, pk = position
+            if descending:
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+            else:
+                queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}pk')
+
+    # One extra row tells us whether there is a next page without a COUNT
+    rows = list(queryset[:per_page + 1])
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        if sort == RELEVANCE:
+            key = (last.search_rank, last.pk)
+        elif sort == 'newest':
+            key = (last.created_at.isoformat(), last.pk)
+        else:
+            key = (str(last.price), last.pk)
+        next_cursor = encode_cursor(sort, key)
+    return KeysetPage(items, next_cursor, sort)
+
+
+def estimated_row_count(model, using='default'):
+    """Rows of model's table from the database statistics, None when there are none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # -1 until the table is first vacuumed or analyzed
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(table)])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # Written by ANALYZE (or PRAGMA optimize); the first number of each stat is the rows it covers
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            rows = [int(stat.split()[0]) for (stat,) in cursor.fetchall()]
+            return max(rows) if rows else None
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for the admin changelists of the big tables.
+
+    An unfiltered list takes its count from the database statistics instead
+    of a COUNT over the whole table once the estimate passes EXACT_BELOW;
+    filtered lists and small tables are counted exactly. The estimate lags
+    the table until the next ANALYZE, so the last pages may be off by a few.
+    """
+    EXACT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.EXACT_BELOW:
+                return estimate
+        return super().count
@@ -0,0 +1,48 @@
+"""
+Helpers for the async views.
+
+Django's async ORM runs every query through sync_to_async on the request's
+one sync thread, so awaiting several of them with asyncio.gather() still
+runs them one after the other. gather_reads() gives each independent
+read-only block its own worker thread, and so its own database connection,
+so that they really overlap. Inside a transaction (ATOMIC_REQUESTS, tests)
+the reads must see its uncommitted writes: they then run in turn on its
+connection.
+
+Rendering touches the lazy request.user, the session and the context
+processors, which are sync and database backed, so arender() renders on the
+request's sync thread.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+from django.shortcuts import render
+
+from .metrics import collect_queries
+
+
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+def _on_worker(func):
+    def run():
+        try:
+            # The request's metrics count the queries of the worker's connection too
+            with collect_queries():
+                return func()
+        finally:
+            # Worker threads follow the request rules for their connections (CONN_MAX_AGE)
+            close_old_connections()
+    return run
+
+
+async def gather_reads(*funcs):
+    """Results of the read-only callables, run concurrently; each must evaluate its querysets"""
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(sync_to_async(_on_worker(func), thread_sensitive=False)() for func in funcs))
+
+
+arender = sync_to_async(render)
@@ -0,0 +1,83 @@
+"""
+Points ledger.
+
+Every change of a user's points is a PointsTransaction row, and
+CustomUser.points is the materialized balance: award() inserts the row and
+moves the balance with an F() update in the same transaction, so concurrent
+awards never lose an update. reconcile_points recomputes balances from the
+ledger when they drift (raw SQL, restores).
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CustomUser, PointsTransaction
+from .page_cache import LEADERBOARD_TAG, invalidate_tags
+from .ranking import ranking
+from .referrals import points_earned
+
+
+@transaction.atomic
+def award(user, delta, reason, order=None, referral=None):
+    """Add delta points (negative to take some away) to user and record why"""
+    PointsTransaction.objects.create(user=user, delta=delta, reason=reason, order=order, referral=referral)
+    CustomUser.objects.filter(pk=user.pk).update(points=F('points') + delta)
+    user.refresh_from_db(fields=['points'])
+    ranking.points_changed(user.points - delta, user.points)
+    user._stored_points = user.points
+    if reason in PointsTransaction.EARNING_REASONS:
+        points_earned(user, delta)
+    invalidate_tags(LEADERBOARD_TAG)
+
+
+def earned(since, until=None):
+    """PointsTransaction rows that count as points earned between since and until"""
+    rows = PointsTransaction.objects.filter(
+        created_at__gte=since, reason__in=PointsTransaction.EARNING_REASONS,
+    )
+    if until is not None:
+        rows = rows.filter(created_at__lt=until)
+    return rows
+
+
+def earned_by(user, since, until=None):
+    return earned(since, until).filter(user=user).aggregate(total=Sum('delta'))['total'] or 0
+
+
+def top_earners(since, until=None, limit=10):
+    """Users who earned the most points between since and until, as rows with username, points and rank"""
+    totals = (
+        earned(since, until).values('user', 'user__username').annotate(total=Sum('delta'))
+        .filter(total__gt=0).order_by('-total', 'user')[:limit]
+    )
+    rows = []
+    for position, row in enumerate(totals, 1):
+        # Competition ranks, as everywhere else: ties share the rank of the first of them
+        rank = rows[-1]['rank'] if rows and rows[-1]['points'] == row['total'] else position
+        rows.append({'username': row['user__username'], 'points': row['total'], 'rank': rank})
+    return rows
+
+
+def month_window(now=None):
+    """(start, end) datetimes of the month now falls in, the current one by default"""
+    now = now or timezone.localtime()
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def ledger_balance():
+    """Balance expression for a CustomUser queryset, summed from the ledger"""
+    totals = (
+        PointsTransaction.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        .annotate(total=Sum('delta')).values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=IntegerField()), 0)
+
+
+def drifted_users(users):
+    """Users of the queryset whose stored balance differs from their ledger"""
+    return users.annotate(ledger_points=ledger_balance()).exclude(points=F('ledger_points'))
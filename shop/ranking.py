@@ -0,0 +1,220 @@
+"""
+Points ranking: top-N, rank of a user and the users around them.
+
+Ranks are competition ranks (1 + number of users with strictly more points),
+the same definition the profile page always used. Counting "users above"
+with SQL is a range scan that grows with the rank, so the count comes from a
+per-process Fenwick tree over point values instead: rank lookups and point
+changes are O(log P), P being the spread of point values, and the tree is
+built from one GROUP BY points query. Ordered lists (top-N, neighbours) are
+keyset reads on the (points DESC, id) index, O(log n + N).
+
+Point changes made by this process are applied to the tree as they commit
+and bump the shared generation; so does invalidate_ranking() (bulk changes:
+imports, monthly resets). A process whose tree is behind the generation
+rebuilds it, at most once every RANKING_REFRESH seconds and one thread at a
+time, the other threads reading the previous tree meanwhile. A tree nobody
+invalidated is never rebuilt. The generation is a key of the default cache:
+other processes only see it move when they share that cache (REDIS_URL).
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import CustomUser
+from .page_cache import LEADERBOARD_TAG, invalidate_tags
+from .replicas import primary_reads
+
+GENERATION_KEY = 'ranking:generation'
+
+
+class PointsHistogram:
+    """
+    Number of users per point value, with O(log P) counts of the users above a value.
+
+    Values are counted in a Fenwick tree over a dense range starting at the
+    lowest value seen at build time, with headroom above the highest. The
+    rare values past MAX_SPAN (a runaway outlier) go to a sorted overflow list
+    so one huge score can't blow up the tree.
+    """
+    MAX_SPAN = 1 << 20
+
+    def __init__(self, counts=None):
+        counts = counts or {}
+        self.low = min(counts, default=0)
+        span = max(counts, default=0) - self.low + 1
+        self.size = max(1024, min(self.MAX_SPAN, 1 << (span * 2 - 1).bit_length()))
+        self.tree = array('q', bytes(8 * (self.size + 1)))
+        self.overflow = []
+        self.users = 0
+        self.points = 0
+        for points, users in counts.items():
+            self.add(points, users)
+
+    def fits(self, points):
+        return points >= self.low
+
+    def add(self, points, users=1):
+        self.users += users
+        self.points += points * users
+        index = points - self.low + 1
+        if index > self.size:
+            for _ in range(users):
+                insort(self.overflow, points)
+            for _ in range(-users):
+                index = bisect_left(self.overflow, points)
+                if index < len(self.overflow) and self.overflow[index] == points:
+                    del self.overflow[index]
+            return
+        while index <= self.size:
+            self.tree[index] += users
+            index += index & -index
+
+    def count_above(self, points):
+        index = min(max(points - self.low + 1, 0), self.size)
+        upto = 0
+        while index > 0:
+            upto += self.tree[index]
+            index -= index & -index
+        above_overflow = len(self.overflow) - bisect_right(self.overflow, points)
+        return self.users - len(self.overflow) - upto + above_overflow
+
+
+class RankIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held by the one thread rebuilding the tree
+        self._rebuild_lock = threading.Lock()
+        self._histogram = None
+        self._built_at = 0.0
+        self._generation = None
+
+    def _fresh(self, generation):
+        return self._histogram is not None and self._generation == generation
+
+    def _current(self):
+        generation = _generation()
+        with self._lock:
+            histogram = self._histogram
+            if self._fresh(generation):
+                return histogram
+            recent = time.monotonic() - self._built_at < settings.RANKING_REFRESH
+        if histogram is not None and recent:
+            # Behind by a few changes for at most RANKING_REFRESH seconds: don't rebuild on every change
+            return histogram
+        if not self._rebuild_lock.acquire(blocking=histogram is None):
+            # Another thread is rebuilding: the previous tree in the meantime
+            return histogram
+        try:
+            with self._lock:
+                if self._fresh(generation):
+                    # Rebuilt while this thread waited
+                    return self._histogram
+            return self.rebuild(generation)
+        finally:
+            self._rebuild_lock.release()
+
+    def rebuild(self, generation=None):
+        if generation is None:
+            generation = _generation()
+        # Stamped with the current generation: never from a replica that predates it
+        with primary_reads():
+            counts = dict(
+                CustomUser.objects.order_by().values_list('points').annotate(users=Count('id'))
+            )
+        histogram = PointsHistogram(counts)
+        with self._lock:
+            self._histogram = histogram
+            self._built_at = time.monotonic()
+            self._generation = generation
+        return histogram
+
+    def clear(self):
+        with self._lock:
+            self._histogram = None
+
+    def _apply(self, changes):
+        # Other processes rebuild to pick the change up
+        generation = _next_generation()
+        with self._lock:
+            histogram = self._histogram
+            if histogram is None:
+                return
+            if not all(histogram.fits(points) for points, _ in changes):
+                # Below the tree's range: rebuild on the next read
+                self._histogram = None
+                return
+            for points, users in changes:
+                histogram.add(points, users)
+            if self._generation == generation - 1:
+                # No other change in between: the tree is still current
+                self._generation = generation
+
+    def points_changed(self, old, new):
+        """Record a user going from old to new points, once the transaction commits"""
+        if old != new:
+            transaction.on_commit(lambda: self._apply([(old, -1), (new, 1)]))
+
+    def user_added(self, points):
+        transaction.on_commit(lambda: self._apply([(points, 1)]))
+
+    def user_removed(self, points):
+        transaction.on_commit(lambda: self._apply([(points, -1)]))
+
+    def rank(self, points):
+        return self._current().count_above(points) + 1
+
+    def rank_of(self, user):
+        return self.rank(user.points)
+
+    def totals(self):
+        """(number of users, sum of their points)"""
+        histogram = self._current()
+        return histogram.users, histogram.points
+
+    def top(self, limit=10):
+        return list(CustomUser.objects.order_by('-points', 'id')[:limit])
+
+    def around(self, user, span=2):
+        """(rank, user) for the span users ranked above and below user, user included"""
+        users = CustomUser.objects.all()
+        # Ties first, then the next point values: each read is a plain range of the index
+        # (an OR of both conditions would make SQLite scan)
+        above = list(users.filter(points=user.points, id__lt=user.pk).order_by('-id')[:span])
+        if len(above) < span:
+            above += users.filter(points__gt=user.points).order_by('points', '-id')[:span - len(above)]
+        below = list(users.filter(points=user.points, id__gt=user.pk).order_by('id')[:span])
+        if len(below) < span:
+            below += users.filter(points__lt=user.points).order_by('-points', 'id')[:span - len(below)]
+        histogram = self._current()
+        return [
+            (histogram.count_above(neighbour.points) + 1, neighbour)
+            for neighbour in above[::-1] + [user] + below
+        ]
+
+
+ranking = RankIndex()
+
+
+def _generation():
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def _next_generation():
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+        return 1
+
+
+def invalidate_ranking():
+    """Make every process rebuild its ranking tree"""
+    _next_generation()
+    invalidate_tags(LEADERBOARD_TAG)
@@ -0,0 +1,167 @@
+"""
+Referral tree statistics.
+
+CustomUser.referred_by only links a user to their direct referrer, so a
+whole tree could only be walked one level per query. ReferralPath is its
+closure table: one row per (ancestor, descendant) pair with the number of
+levels between them, which makes a subtree or a chain of ancestors a single
+indexed read. ReferralStats keeps each referrer's counters (direct and
+indirect referrals, depth of their tree, points earned below them) so the
+profile reads them as one row.
+
+Both are maintained as users come and go: attach() adds a new user under
+their referrer (O(depth) rows), move() re-hangs a subtree when a referrer is
+changed or a user deleted, points_earned() follows the points ledger.
+rebuild() recomputes everything with a recursive CTE
+(the rebuild_referral_tree command).
+"""
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import CustomUser, PointsTransaction, ReferralPath, ReferralStats
+
+# Guards the recursive rebuild against a referred_by cycle written behind the app's back
+MAX_DEPTH = 100
+
+
+class ReferralCycle(Exception):
+    pass
+
+
+def per_user(values):
+    """CASE user_id WHEN ... THEN value expression for a {user_id: value} mapping"""
+    return Case(
+        *[When(user_id=pk, then=Value(value)) for pk, value in values.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _chain(referrer_id):
+    """[(ancestor_id, depth)] a user placed under referrer_id would have, nearest first"""
+    if referrer_id is None:
+        return []
+    above = ReferralPath.objects.filter(descendant_id=referrer_id).order_by('depth').values_list('ancestor_id', 'depth')
+    return [(referrer_id, 1)] + [(pk, depth + 1) for pk, depth in above]
+
+
+@transaction.atomic
+def attach(user):
+    """Add a newly registered user, who has no referrals yet, under their referrer"""
+    chain = _chain(user.referred_by_id)
+    if not chain:
+        return
+    ReferralPath.objects.bulk_create([
+        ReferralPath(ancestor_id=pk, descendant=user, depth=depth) for pk, depth in chain
+    ])
+    ReferralStats.objects.bulk_create([ReferralStats(user_id=pk) for pk, _ in chain], ignore_conflicts=True)
+    ReferralStats.objects.filter(user_id__in=[pk for pk, _ in chain]).update(
+        direct_referrals=F('direct_referrals') + per_user({user.referred_by_id: 1}),
+        indirect_referrals=F('indirect_referrals') + per_user({pk: 1 for pk, depth in chain if depth > 1}),
+        depth=Greatest(F('depth'), per_user(dict(chain))),
+    )
+
+
+@transaction.atomic
+def move(user, referrer_id):
+    """Hang user and everybody below them under referrer_id (None: make user a root)"""
+    subtree = [(user.pk, 0)] + list(
+        ReferralPath.objects.filter(ancestor=user).values_list('descendant_id', 'depth')
+    )
+    if referrer_id is not None and any(pk == referrer_id for pk, _ in subtree):
+        raise ReferralCycle(f'User {referrer_id} is below user {user.pk} in the referral tree')
+
+    old = list(ReferralPath.objects.filter(descendant=user).values_list('ancestor_id', flat=True))
+    new = _chain(referrer_id)
+    if old:
+        ReferralPath.objects.filter(ancestor_id__in=old).filter(
+            Q(descendant=user) | Q(descendant__in=ReferralPath.objects.filter(ancestor=user).values('descendant'))
+        ).delete()
+    ReferralPath.objects.bulk_create(
+        (
+            ReferralPath(ancestor_id=pk, descendant_id=below, depth=depth + levels)
+            for pk, depth in new for below, levels in subtree
+        ),
+        batch_size=1000,
+    )
+    refresh_stats(set(old) | {pk for pk, _ in new})
+
+
+def points_earned(user, delta):
+    """Credit delta points earned by user to everybody above them"""
+    ReferralStats.objects.filter(
+        user_id__in=ReferralPath.objects.filter(descendant=user).values('ancestor_id'),
+    ).update(
+        downstream_points=F('downstream_points') + delta,
+    )
+
+
+def refresh_stats(user_ids=None):
+    """Recompute the stats of the given users (everybody when None) from the closure table and the ledger"""
+    stats = ReferralStats.objects.all()
+    paths = ReferralPath.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        stats = stats.filter(user_id__in=user_ids)
+        paths = paths.filter(ancestor_id__in=user_ids)
+    stats.delete()
+
+    downstream = dict(
+        paths.filter(descendant__points_transactions__reason__in=PointsTransaction.EARNING_REASONS)
+        .values_list('ancestor_id')
+        .annotate(total=Sum('descendant__points_transactions__delta'))
+    )
+    counts = paths.values_list('ancestor_id').annotate(
+        direct=Count('pk', filter=Q(depth=1)),
+        indirect=Count('pk', filter=Q(depth__gt=1)),
+        deepest=Max('depth'),
+    )
+    ReferralStats.objects.bulk_create(
+        (
+            ReferralStats(
+                user_id=pk, direct_referrals=direct, indirect_referrals=indirect, depth=deepest,
+                downstream_points=downstream.get(pk, 0),
+            )
+            for pk, direct, indirect, deepest in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+def _insert_paths():
+    """Fill the closure table from referred_by with one recursive query, returns the rows written"""
+    users = connection.ops.quote_name(CustomUser._meta.db_table)
+    paths = connection.ops.quote_name(ReferralPath._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {paths} (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+                SELECT referred_by_id, id, 1 FROM {users} WHERE referred_by_id IS NOT NULL
+                UNION ALL
+                SELECT u.referred_by_id, tree.descendant_id, tree.depth + 1
+                FROM tree JOIN {users} u ON u.id = tree.ancestor_id
+                WHERE u.referred_by_id IS NOT NULL AND tree.depth < %s
+            )
+            SELECT ancestor_id, descendant_id, depth FROM tree
+            ''',
+            [MAX_DEPTH],
+        )
+        return cursor.rowcount
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute the closure table and every user's stats from scratch, returns the number of paths"""
+    ReferralPath.objects.all().delete()
+    written = _insert_paths()
+    refresh_stats()
+    return written
+
+
+def stats_for(user):
+    """The user's ReferralStats, an unsaved all-zero one when they never referred anybody"""
+    return ReferralStats.objects.filter(user=user).first() or ReferralStats(user=user)
@@ -0,0 +1,199 @@
+"""
+Read replica routing.
+
+Catalog and leaderboard pages only read, and there are many more of them
+than checkouts and cart edits, so they are served from a replica
+(settings.REPLICA_DATABASE) and leave the primary to the writers.
+
+Views opt in with @replica_reads. ReplicaMiddleware routes the reads of a
+GET to such a view to the replica, through a context variable that
+ReplicaRouter reads, and so follows the request into the gather_reads()
+worker threads. Everything else, and every write, uses the primary.
+
+A replica lags behind its primary. A request that wrote (a POST, or a
+session change) pins its visitor to the primary for REPLICA_MAX_LAG
+seconds with a cookie, so the cart, checkout and profile flows read their
+own writes. The page and product card caches don't store what was read
+from a snapshot older than their version tokens (may_cache()): a stale
+render right after an invalidation would otherwise stay cached under the
+new version. Facet results and the ranking tree are kept under a
+generation counter, which doesn't say when it moved: they are always
+computed on the primary, inside primary_reads().
+
+On other backends the replica alias is a real replica that the database
+server keeps up to date, assumed to be at most REPLICA_MAX_LAG seconds
+behind. With SQLite it is a copy of the primary file, made with SQLite's
+online backup API by refresh_sqlite_replica() (the refresh_replica
+command, run every REPLICA_REFRESH_INTERVAL seconds). A copy older than
+REPLICA_MAX_LAG, or one that doesn't exist yet, is not used: reads fall
+back to the primary. So is a test mirror (TEST['MIRROR']), which is the
+primary itself.
+"""
+import contextlib
+import contextvars
+import os
+import sqlite3
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# (alias, snapshot time) the current request reads from, None for the primary
+_reads = contextvars.ContextVar('replica_reads', default=None)
+
+
+def replica_reads(view):
+    """Mark a view whose GETs only read: their queries may go to the replica"""
+    view.replica_reads = True
+    return view
+
+
+def replica_snapshot():
+    """Time of the data the replica holds, None when it must not be used"""
+    alias = settings.REPLICA_DATABASE
+    if alias not in settings.DATABASES:
+        return None
+    replica = connections[alias].settings_dict
+    now = time.time()
+    if replica['NAME'] == connections[DEFAULT_DB_ALIAS].settings_dict['NAME']:
+        # A test mirror: the primary itself, better read on the primary's connection
+        return None
+    if replica['ENGINE'] != 'django.db.backends.sqlite3':
+        return now - settings.REPLICA_MAX_LAG
+    try:
+        # refresh_sqlite_replica() dates the file to the start of the backup
+        snapshot = os.stat(replica['NAME']).st_mtime
+    except OSError:
+        return None
+    return snapshot if now - snapshot <= settings.REPLICA_MAX_LAG else None
+
+
+def read_snapshot():
+    """Time of the data this request reads, None when it reads the primary"""
+    reads = _reads.get()
+    return reads[1] if reads else None
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Send the block's reads to the primary, whatever the request reads from"""
+    token = _reads.set(None)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+def mint_version():
+    """Cache version token that remembers when it was minted"""
+    return f'{uuid.uuid4().hex}:{time.time():.3f}'
+
+
+def get_versions(keys):
+    """{key: version token} of the cache keys, minting (and storing) the missing ones"""
+    found = cache.get_many(keys)
+    missing = {key: mint_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return found
+
+
+def _minted_at(version):
+    try:
+        return float(str(version).rpartition(':')[2])
+    except ValueError:
+        return 0.0
+
+
+def may_cache(versions):
+    """Whether what this request read may be cached under the versions: not when it is older than one of them"""
+    snapshot = read_snapshot()
+    return snapshot is None or all(_minted_at(version) <= snapshot for version in versions)
+
+
+class ReplicaRouter:
+    """Reads go where ReplicaMiddleware decided, writes and migrations to the primary"""
+
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        return reads[0] if reads else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both sides
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        # Threads of a WSGI server keep their context from one request to the next
+        _reads.set(None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method not in SAFE_METHODS
+            or not getattr(view_func, 'replica_reads', False)
+            or PIN_COOKIE in request.COOKIES
+        ):
+            return None
+        snapshot = replica_snapshot()
+        if snapshot is not None:
+            _reads.set((settings.REPLICA_DATABASE, snapshot))
+        return None
+
+    def process_response(self, request, response):
+        _reads.set(None)
+        session = getattr(request, 'session', None)
+        wrote = request.method not in SAFE_METHODS or (session is not None and session.modified)
+        if wrote and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_MAX_LAG, httponly=True, samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
+
+
+def refresh_sqlite_replica():
+    """
+    Copy the SQLite primary over the replica; returns the seconds it took.
+
+    The online backup copies a consistent snapshot while the primary stays
+    in use, into a temporary file that then replaces the replica at once:
+    readers see the old copy or the new one, never half of it. Connections
+    already open keep the old copy until they close (the end of their
+    request).
+    """
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict
+    replica = connections[settings.REPLICA_DATABASE].settings_dict
+    started = time.time()
+    temporary = f"{replica['NAME']}.tmp"
+    source = sqlite3.connect(primary['NAME'], timeout=primary.get('OPTIONS', {}).get('timeout', 5))
+    try:
+        target = sqlite3.connect(temporary)
+        try:
+            # In one step: holds a read lock on the primary for the duration of the copy
+            source.backup(target)
+        finally:
+            target.close()
+    except sqlite3.Error:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    finally:
+        source.close()
+    # Dated to the start of the copy: no write after that time is in it
+    os.utime(temporary, (started, started))
+    os.replace(temporary, replica['NAME'])
+    return time.time() - started
@@ -0,0 +1,154 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'shop_product_fts'
+
+# Column weights for bm25(): name, brand, description, category
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 2.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lowercase word tokens"""
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend:
+    """Interface every catalog search backend implements"""
+
+    # Whether search() annotates search_rank and supports rank_after()
+    ranked = False
+
+    def search(self, queryset, query):
+        """Filter a Product queryset by query, best matches first"""
+        raise NotImplementedError
+
+    def rank_after(self, queryset, rank, pk):
+        raise NotImplementedError
+
+    def index_products(self, product_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class DatabaseLikeBackend(BaseSearchBackend):
+    """Plain icontains filter, works on every database but scans the table"""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(brand__icontains=query) |
+            Q(category__name__icontains=query)
+        )
+
+
+class SqliteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 inverted index ranked with bm25 and prefix matching"""
+
+    ranked = True
+    rank_sql = f'bm25({FTS_TABLE}, {", ".join(str(weight) for weight in BM25_WEIGHTS)})'
+
+    def match_expression(self, query):
+        # Every token must match, as a prefix so partial words hit while typing
+        tokens = tokenize(query)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.rowid = shop_product.id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[expression],
+            select={'search_rank': self.rank_sql},
+            order_by=['search_rank', 'id'],
+        )
+
+    def rank_after(self, queryset, rank, pk):
+        # Keyset condition on (search_rank, id) for paging through ranked results
+        return queryset.extra(
+            where=[f'({self.rank_sql} > %s OR ({self.rank_sql} = %s AND shop_product.id > %s))'],
+            params=[rank, rank, pk],
+        )
+
+    def _insert_sql(self, where):
+        return (
+            f'INSERT INTO {FTS_TABLE} (rowid, name, brand, description, category) '
+            f'SELECT p.id, p.name, p.brand, p.description, c.name '
+            f'FROM shop_product p INNER JOIN shop_category c ON c.id = p.category_id '
+            f'{where}'
+        )
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(self._insert_sql(f'WHERE p.id IN ({placeholders})'), product_ids)
+
+    def index_category(self, category_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+                f'(SELECT id FROM shop_product WHERE category_id = %s)',
+                [category_id],
+            )
+            cursor.execute(self._insert_sql('WHERE p.category_id = %s'), [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(self._insert_sql(''))
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+            return cursor.fetchone()[0]
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Return the configured backend (SHOP_SEARCH_BACKEND) or pick one for the database"""
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == 'sqlite':
+            _backend = SqliteFTSBackend()
+        else:
+            _backend = DatabaseLikeBackend()
+    return _backend
+
+
+def search_products(queryset, query):
+    return get_search_backend().search(queryset, query)
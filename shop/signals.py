@@ -0,0 +1,119 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cards import invalidate_all_cards, invalidate_cards
+from .facets import invalidate_facets
+from .images import schedule
+from .models import Category, CustomUser, Product
+from .page_cache import CATALOG_TAG, category_tag, invalidate_tags, product_tag
+from .ranking import invalidate_ranking, ranking
+from .referrals import attach, move
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created=False, raw=False, **kwargs):
+    # Category name is part of every product document in that category
+    if raw or created:
+        return
+    get_search_backend().index_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    # After the commit: a read in between would cache the old rows under the new generation
+    transaction.on_commit(invalidate_facets)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_card_changed(sender, instance, **kwargs):
+    # Covers the admin's list_editable price/stock edits, saved one object at a time
+    invalidate_cards([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_pages_changed(sender, instance, **kwargs):
+    categories = {instance.category_id, getattr(instance, '_stored_category_id', None)} - {None}
+    invalidate_tags(CATALOG_TAG, product_tag(instance.pk), *[category_tag(pk) for pk in categories])
+    instance._stored_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_pages_changed(sender, instance, **kwargs):
+    invalidate_tags(CATALOG_TAG, category_tag(instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_card_changed(sender, created=False, **kwargs):
+    # Cards show their category's name
+    if not created:
+        invalidate_all_cards()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def image_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Resized copies of a new upload, made after the commit
+    schedule(instance)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_points_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        ranking.user_added(instance.points)
+    elif update_fields is None or 'points' in update_fields:
+        stored = getattr(instance, '_stored_points', None)
+        if stored is None:
+            # Unknown previous value: every process rebuilds its tree
+            transaction.on_commit(invalidate_ranking)
+        else:
+            ranking.points_changed(stored, instance.points)
+    instance._stored_points = instance.points
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    ranking.user_removed(instance.points)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_referrer_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        attach(instance)
+    elif update_fields is None or 'referred_by' in update_fields:
+        stored = getattr(instance, '_stored_referred_by', instance.referred_by_id)
+        if stored != instance.referred_by_id:
+            move(instance, instance.referred_by_id)
+    instance._stored_referred_by = instance.referred_by_id
+
+
+@receiver(pre_delete, sender=CustomUser)
+def user_leaving_referral_tree(sender, instance, **kwargs):
+    # Referrals become roots (referred_by is SET_NULL): take the subtree out of the stats above
+    move(instance, None)
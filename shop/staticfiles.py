@@ -0,0 +1,98 @@
+"""
+Hashed, precompressed static files and the view that serves them.
+
+PrecompressedManifestStaticFilesStorage is Django's manifest storage
+(collectstatic copies css/site.css to css/site.<hash>.css and {% static %}
+links the hashed name) that also writes a gzip copy next to each text
+file, compressed once at deploy time instead of on every request. Before
+collectstatic has run (development, tests) {% static %} links the plain
+names instead of failing.
+
+serve() answers /static/ when Django serves the files itself (no web server
+in front): the .gz copy to clients that accept gzip, and a far-future
+immutable Cache-Control for hashed names, whose content never changes
+under the same URL.
+"""
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+# A year: the longest lifetime browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Unhashed names can change under the same URL
+PLAIN_MAX_AGE = 60 * 60
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # No manifest yet (development, tests): link the plain names
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()) | set(paths):
+            if name.endswith(COMPRESSED_EXTENSIONS) and self.exists(name):
+                self._compress(name)
+
+    def _compress(self, name):
+        with self.open(name) as source:
+            content = source.read()
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            with open(self.path(name) + '.gz', 'wb') as target:
+                target.write(compressed)
+
+
+def is_hashed(name):
+    """Whether name is a hashed copy collectstatic wrote"""
+    return name in set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def serve(request, path):
+    """A collected static file, precompressed when possible, cached for a year when hashed"""
+    if not settings.STATIC_ROOT:
+        raise Http404
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(full_path)
+        compressed = full_path + '.gz'
+        accepts_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if accepts_gzip and os.path.isfile(compressed):
+            response = FileResponse(open(compressed, 'rb'), content_type=content_type)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response.headers['Last-Modified'] = http_date(stat.st_mtime)
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if is_hashed(path.replace(os.sep, '/')):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PLAIN_MAX_AGE)
+    return response
@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from shop.images import srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(instance, rendition='card', **attrs):
+    """
+    <picture> with the WebP and JPEG renditions of instance.image, a plain
+    <img> of the original upload while they are pending. Attribute names
+    take - for _ (data_full=... gives data-full="...")
+    """
+    src, jpeg_srcset = srcset(instance, rendition, 'jpeg')
+    if src is None:
+        return ''
+    attributes = format_html_join('', ' {}="{}"', sorted((name.replace('_', '-'), value) for name, value in attrs.items()))
+    if not jpeg_srcset:
+        return format_html('<img src="{}"{}>', src, attributes)
+    _, webp_srcset = srcset(instance, rendition, 'webp')
+    return format_html(
+        # display: contents keeps the <img> in its parent's layout
+        '<picture style="display: contents"><source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}"{}></picture>',
+        webp_srcset, src, jpeg_srcset, attributes,
+    )
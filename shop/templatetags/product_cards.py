@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from shop.cards import CARD_TEMPLATE, render_cards
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, template_name=CARD_TEMPLATE):
+    """The cached cards of products, one cache round-trip for the whole list"""
+    return mark_safe(''.join(render_cards(products, template_name, context.get('request'))))
@@ -0,0 +1,43 @@
+"""
+Helpers shared by the shop and cart tests.
+
+make_product() creates a product with every required field filled in.
+urlpatterns are the URLs core.asgi serves (settings.ASYNC_VIEWS): the async
+catalog and cart views in front of the rest. Tests of the async views run
+with @override_settings(ROOT_URLCONF='shop.testing').
+"""
+from decimal import Decimal
+
+from django.conf.urls.i18n import i18n_patterns
+from django.urls import path
+
+from cart import views as cart_views
+from core import urls as core_urls
+
+from . import views
+from .models import Product
+
+
+def make_product(category, **kwargs):
+    defaults = {
+        'name': 'Produit',
+        'description': 'Description',
+        'price': Decimal('1000.00'),
+        'brand': 'Marque',
+        'color': 'Noir',
+        'size': '42',
+        'stock': 5,
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(category=category, **defaults)
+
+
+urlpatterns = i18n_patterns(
+    path('', views.ahome, name='home'),
+    path('products/', views.aproducts, name='products'),
+    path('product/<int:product_id>/', views.aproduct_detail, name='product_detail'),
+    path('cart/add/<int:product_id>/', cart_views.aadd_to_cart, name='add_to_cart'),
+    path('cart/remove/<int:item_id>/', cart_views.aremove_from_cart, name='remove_from_cart'),
+    path('cart/count/', cart_views.aupdate_cart_count, name='cart_count'),
+    prefix_default_language=True,
+) + core_urls.urlpatterns
@@ -1,3 +1,1705 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.middleware.csrf import _unmask_cipher_token
+from django.db.models import F, Q
+from django.template import Context, Template, engines
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, resolve, reverse
+from django.utils import timezone, translation
+from django.utils.translation import trans_real
+from PIL import Image
+
+from cart.captcha_stub import StubVerifier
+from cart.models import Cart
+from cart.reservations import reserve
+
+from . import assets, cards, exports, images, loadtest, metrics, page_cache, replicas, views, warmup
+from .cards import render_cards
+from .facets import CatalogFilters, compute_facets, get_facets
+from .forms import CustomUserCreationForm
+from .leaderboard import SnapshotError, snapshot_month
+from .management.commands.loadtest_replay import Command as LoadTestReplayCommand
+from .models import (
+    Category, CustomUser, LeaderboardSnapshot, MonthlyLeaderboard, Order, OrderItem, PointsTransaction, Product,
+    ReferralPath, ReferralStats,
+)
+from .pagination import EstimatedCountPaginator, decode_cursor, estimated_row_count, paginate_keyset
+from .parallel import gather_reads
+from .points import award, earned_by, month_window
+from .ranking import PointsHistogram, invalidate_ranking, ranking
+from .referrals import ReferralCycle, move, rebuild
+from .search import DatabaseLikeBackend, SqliteFTSBackend, tokenize
+from .testing import make_product
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.bags = Category.objects.create(name='Sacs')
+        cls.air_max = make_product(cls.shoes, name='Air Max 90', brand='Nike', description='Running classique')
+        cls.runner = make_product(cls.shoes, name='Runner', brand='Adidas', description='Inspiré de la Air Max')
+        cls.tote = make_product(cls.bags, name='Tote', brand='Zara', description='Sac en cuir')
+
+    def search(self, query):
+        return list(SqliteFTSBackend().search(Product.objects.all(), query))
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Air-Max  90!'), ['air', 'max', '90'])
+        self.assertEqual(tokenize('   '), [])
+
+    def test_ranked_by_bm25(self):
+        # A name hit outranks a description hit
+        self.assertEqual(self.search('air max'), [self.air_max, self.runner])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('ru'), [self.runner, self.air_max])
+        self.assertEqual(self.search('cui'), [self.tote])
+
+    def test_category_name_is_indexed(self):
+        self.assertEqual(self.search('sacs'), [self.tote])
+
+    def test_accents_are_folded(self):
+        self.assertEqual(self.search('inspire'), [self.runner])
+
+    def test_index_follows_save_and_delete(self):
+        self.air_max.name = 'Pegasus'
+        self.air_max.save()
+        self.assertEqual(self.search('pegasus'), [self.air_max])
+        self.air_max.delete()
+        self.assertEqual(self.search('pegasus'), [])
+
+    def test_index_follows_category_rename(self):
+        self.bags.name = 'Maroquinerie'
+        self.bags.save()
+        self.assertEqual(self.search('maroquinerie'), [self.tote])
+
+    def test_rebuild(self):
+        Product.objects.filter(pk=self.tote.pk).update(name='Cabas')
+        self.assertEqual(self.search('cabas'), [])
+        self.assertEqual(SqliteFTSBackend().rebuild(), 3)
+        self.assertEqual(self.search('cabas'), [self.tote])
+
+    def test_punctuation_only_query_matches_nothing(self):
+        self.assertEqual(self.search('"*'), [])
+
+    def test_like_backend_agrees(self):
+        found = DatabaseLikeBackend().search(Product.objects.all(), 'Air Max')
+        self.assertEqual(set(found), {self.air_max, self.runner})
+
+    def test_products_view_search(self):
+        response = self.client.get(reverse('products'), {'search': 'nike'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['products']), [self.air_max])
+        self.assertEqual(response.context['total_products'], 1)
+        self.assertEqual(response.context['total_stock'], 5)
+
+
+def card_ids(html):
+    """Product ids of the cards in a rendered fragment, in order"""
+    return [int(pk) for pk in dict.fromkeys(re.findall(r'/product/(\d+)/', html))]
+
+
+@override_settings(PRODUCTS_PER_PAGE=5)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.bags = Category.objects.create(name='Sacs')
+        cls.products = []
+        for index in range(23):
+            category = cls.shoes if index % 2 else cls.bags
+            cls.products.append(make_product(
+                category, name=f'Modèle {index}', price=1000 + (index * 7) % 11 * 100,
+            ))
+        make_product(cls.shoes, name='Épuisé', stock=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, **params):
+        """Follow next_page_url through the fragment endpoint, returning ids in order"""
+        seen = []
+        url = reverse('products_more')
+        next_query = '?' + urlencode(params)
+        while next_query:
+            data = self.client.get(url + next_query).json()
+            seen.extend(card_ids(data['html']))
+            next_query = data['next_page_url']
+        return seen
+
+    def test_newest_walk_covers_every_product_once(self):
+        expected = [p.pk for p in sorted(self.products, key=lambda p: (p.created_at, p.pk), reverse=True)]
+        self.assertEqual(self.walk(), expected)
+
+    def test_price_sort_with_category_filter(self):
+        shoes = [p for p in self.products if p.category_id == self.shoes.pk]
+        expected = [p.pk for p in sorted(shoes, key=lambda p: (p.price, p.pk))]
+        self.assertEqual(self.walk(sort='price_asc', category=self.shoes.pk), expected)
+        self.assertEqual(self.walk(sort='price_desc', category=self.shoes.pk), expected[::-1])
+
+    def test_relevance_walk_with_search(self):
+        found = self.walk(search='modele')
+        self.assertCountEqual(found, [p.pk for p in self.products])
+
+    def test_page_renders_only_first_page(self):
+        response = self.client.get(reverse('products'))
+        self.assertEqual(len(response.context['products']), 5)
+        self.assertEqual(response.context['total_products'], 23)
+        self.assertIn('after=', response.context['next_page_url'])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        first = self.client.get(reverse('products_more')).json()
+        forged = self.client.get(reverse('products_more'), {'after': 'garbage'}).json()
+        self.assertEqual(card_ids(first['html']), card_ids(forged['html']))
+
+    def test_page_n_costs_the_same_as_page_1(self):
+        url = reverse('products_more')
+        queries = []
+        next_query = '?sort=newest'
+        while next_query:
+            with CaptureQueriesContext(connection) as captured:
+                next_query = self.client.get(url + next_query).json()['next_page_url']
+            queries.append(captured.captured_queries)
+
+        self.assertEqual(len(queries), 5)
+        self.assertEqual({len(page) for page in queries}, {1})
+        for page in queries:
+            sql = page[0]['sql']
+            self.assertNotIn('OFFSET', sql.upper())
+            self.assertIn('LIMIT 6', sql)
+
+        # The deepest page is an index range read, not a sort of the whole table
+        products_list = Product.objects.filter(stock__gt=0)
+        page = paginate_keyset(products_list, 'newest', per_page=5)
+        for _ in range(3):
+            page = paginate_keyset(products_list, 'newest', after=page.next_cursor, per_page=5)
+        position = decode_cursor(page.next_cursor, 'newest')
+        deep = products_list.filter(
+            Q(created_at__lt=position[0]) | Q(created_at=position[0], pk__lt=position[1])
+        ).order_by('-created_at', '-pk')[:6]
+        plan = deep.explain()
+        self.assertIn('product_created_keyset_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.bags = Category.objects.create(name='Sacs')
+        make_product(cls.shoes, name='Air Max', brand='Nike', size='42', price=9000, stock=3)
+        make_product(cls.shoes, name='Pegasus', brand='Nike', size='44', price=12000, stock=2)
+        make_product(cls.shoes, name='Samba', brand='Adidas', size='42', price=10000, stock=4)
+        make_product(cls.bags, name='Tote', brand='Zara', product_type='sac', size='large', price=5000, stock=1)
+        make_product(cls.bags, name='Épuisé', brand='Zara', product_type='sac', stock=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, **params):
+        return compute_facets(CatalogFilters(**params))
+
+    def counts(self, items):
+        return {item['value']: item['count'] for item in items}
+
+    def test_totals_and_counts_without_filters(self):
+        facets = self.facets()
+        self.assertEqual(facets['total_products'], 4)
+        self.assertEqual(facets['total_stock'], 10)
+        self.assertEqual(facets['total_categories'], 2)
+        self.assertEqual(self.counts(facets['brands']), {'Nike': 2, 'Adidas': 1, 'Zara': 1})
+        self.assertEqual(self.counts(facets['sizes']), {'42': 2, '44': 1, 'large': 1})
+        self.assertEqual(
+            {category['name']: category['count'] for category in facets['categories']},
+            {'Chaussures': 3, 'Sacs': 1},
+        )
+
+    def test_dimension_counts_ignore_their_own_selection(self):
+        facets = self.facets(brand='Nike')
+        self.assertEqual(facets['total_products'], 2)
+        # Other brands stay visible with the counts they would give
+        self.assertEqual(self.counts(facets['brands']), {'Nike': 2, 'Adidas': 1, 'Zara': 1})
+        self.assertEqual(self.counts(facets['sizes']), {'42': 1, '44': 1})
+
+    def test_price_range(self):
+        facets = self.facets(price_min=Decimal('9500'))
+        self.assertEqual(facets['total_products'], 2)
+        self.assertEqual((facets['price_min'], facets['price_max']), (Decimal('10000'), Decimal('12000')))
+
+    def test_single_grouped_query(self):
+        with self.assertNumQueries(2):
+            # the grouped facet query and the category names
+            self.facets(search='nike', size='42')
+
+    def test_cached_and_invalidated_on_product_change(self):
+        filters = CatalogFilters()
+        self.assertEqual(get_facets(filters)['total_products'], 4)
+        with self.assertNumQueries(0):
+            get_facets(filters)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product(self.bags, name='Cabas', brand='Zara')
+            # Not before the commit: this read would cache the old rows under the new generation
+            self.assertEqual(get_facets(filters)['total_products'], 4)
+        self.assertEqual(get_facets(filters)['total_products'], 5)
+
+    def test_cache_key_varies_by_language(self):
+        filters = CatalogFilters(brand='Nike')
+        with translation.override('fr'):
+            french = filters.cache_key()
+        with translation.override('ar'):
+            arabic = filters.cache_key()
+        self.assertNotEqual(french, arabic)
+
+    def test_products_view_filters(self):
+        response = self.client.get(reverse('products'), {'category': self.shoes.pk, 'size': '42'})
+        self.assertEqual(response.context['total_products'], 2)
+        self.assertEqual(response.context['current_category']['name'], 'Chaussures')
+        self.assertEqual({p.name for p in response.context['products']}, {'Air Max', 'Samba'})
+
+    def test_products_view_ignores_bad_category(self):
+        response = self.client.get(reverse('products'), {'category': 'abc', 'price_min': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['current_category'])
+
+
+class RankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {
+            name: CustomUser.objects.create_user(name, password='secret-pass-123', points=points)
+            for name, points in [('amine', 12), ('sara', 30), ('yacine', 12), ('lina', 5), ('omar', 0), ('nour', 30)]
+        }
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+
+    def legacy_rank(self, user):
+        return CustomUser.objects.filter(points__gt=user.points).count() + 1
+
+    def test_histogram_counts(self):
+        histogram = PointsHistogram({-3: 1, 0: 2, 7: 4, 5_000_000: 1})
+        self.assertEqual(histogram.count_above(-10), 8)
+        self.assertEqual(histogram.count_above(0), 5)
+        self.assertEqual(histogram.count_above(7), 1)
+        self.assertEqual(histogram.count_above(5_000_000), 0)
+        histogram.add(7, -1)
+        histogram.add(9_000_000)
+        self.assertEqual(histogram.count_above(6), 5)
+        self.assertEqual((histogram.users, histogram.points), (8, -3 + 3 * 7 + 14_000_000))
+
+    def test_ranks_match_the_count_definition(self):
+        for user in self.users.values():
+            self.assertEqual(ranking.rank_of(user), self.legacy_rank(user))
+        self.assertEqual(ranking.totals(), (6, 89))
+
+    def test_top_and_around(self):
+        self.assertEqual([user.username for user in ranking.top(3)], ['sara', 'nour', 'amine'])
+        around = ranking.around(self.users['yacine'])
+        self.assertEqual(
+            [(rank, user.username) for rank, user in around],
+            [(1, 'nour'), (3, 'amine'), (3, 'yacine'), (5, 'lina'), (6, 'omar')],
+        )
+
+    def test_point_changes_update_the_tree_incrementally(self):
+        ranking.rank(0)
+        lina = CustomUser.objects.get(username='lina')
+        lina.points = 40
+        with self.captureOnCommitCallbacks(execute=True):
+            lina.save(update_fields=['points'])
+            new = CustomUser.objects.create_user('karim', password='secret-pass-123', points=20)
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.rank(40), 1)
+            self.assertEqual(ranking.rank(20), 4)
+            self.assertEqual(ranking.rank(12), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            new.delete()
+        self.assertEqual(ranking.rank(12), 4)
+        for user in CustomUser.objects.all():
+            self.assertEqual(ranking.rank_of(user), self.legacy_rank(user))
+
+    @override_settings(RANKING_REFRESH=0)
+    def test_tree_is_rebuilt_only_when_invalidated(self):
+        ranking.rank(0)
+        with self.assertNumQueries(0):
+            ranking.rank(0)
+        invalidate_ranking()
+        with self.assertNumQueries(1):
+            ranking.rank(0)
+
+    @override_settings(RANKING_REFRESH=0)
+    def test_one_thread_rebuilds_while_the_others_read_the_previous_tree(self):
+        previous = ranking._current()
+        invalidate_ranking()
+        rebuilding, finish = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_rebuild(generation=None):
+            calls.append(generation)
+            rebuilding.set()
+            finish.wait(5)
+            return previous
+
+        with mock.patch.object(ranking, 'rebuild', slow_rebuild):
+            worker = threading.Thread(target=ranking._current)
+            worker.start()
+            rebuilding.wait(5)
+            self.assertIs(ranking._current(), previous)
+            finish.set()
+            worker.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_profile_uses_the_ranking_index(self):
+        amine = self.users['amine']
+        self.client.force_login(amine)
+        ranking.rank(0)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['user_rank'], 3)
+        self.assertContains(response, '#3 amine')
+        for query in captured.captured_queries:
+            self.assertFalse('COUNT(' in query['sql'] and '"points" >' in query['sql'], query['sql'])
+
+    def test_leaderboard(self):
+        # The current month ranks what was earned in it, like the profile, not the balances
+        award(self.users['lina'], 8, PointsTransaction.PURCHASE)
+        award(self.users['omar'], 8, PointsTransaction.REFERRAL)
+        award(self.users['amine'], 3, PointsTransaction.PURCHASE)
+        award(self.users['sara'], 20, PointsTransaction.ADJUSTMENT)
+        response = self.client.get(reverse('leaderboard'))
+        self.assertEqual(
+            [(row['username'], row['points'], row['rank']) for row in response.context['top_users']],
+            [('lina', 8, 1), ('omar', 8, 1), ('amine', 3, 3)],
+        )
+        self.assertContains(response, 'Top 10 du Mois')
+        self.assertEqual(response.context['total_points'], 89 + 8 + 8 + 3 + 20)
+
+
+class LeaderboardSnapshotTests(TestCase):
+    month = date(2025, 3, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.points = {'amine': 12, 'sara': 30, 'yacine': 12, 'lina': 5, 'omar': 0, 'nour': 30, 'karim': 12}
+        for name, points in cls.points.items():
+            user = CustomUser.objects.create_user(name, password='secret-pass-123')
+            if points:
+                cls.earn(user, points, datetime(2025, 3, 14, tzinfo=dt_timezone.utc))
+
+    @staticmethod
+    def earn(user, points, at):
+        # Earned at the given time: in the ledger, and in the balance
+        PointsTransaction.objects.create(user=user, delta=points, reason=PointsTransaction.PURCHASE, created_at=at)
+        CustomUser.objects.filter(pk=user.pk).update(points=F('points') + points)
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+
+    def ranks(self):
+        return dict(
+            MonthlyLeaderboard.objects.filter(month=self.month).values_list('user__username', 'rank')
+        )
+
+    def expected_ranks(self):
+        return {
+            name: 1 + sum(other > points for other in self.points.values())
+            for name, points in self.points.items() if points > 0
+        }
+
+    def test_ranks_span_chunks_and_ties(self):
+        snapshot = snapshot_month(self.month, chunk_size=2)
+        self.assertEqual(snapshot.status, LeaderboardSnapshot.DONE)
+        self.assertEqual(snapshot.ranked, 6)
+        self.assertEqual(self.ranks(), self.expected_ranks())
+        # Points are left alone without --reset / --decay
+        self.assertEqual(CustomUser.objects.get(username='sara').points, 30)
+
+    def test_rerun_is_a_no_op(self):
+        snapshot_month(self.month, chunk_size=2)
+        with self.assertNumQueries(1):
+            snapshot_month(self.month, chunk_size=2)
+        self.assertEqual(MonthlyLeaderboard.objects.count(), 6)
+        with self.assertRaises(SnapshotError):
+            snapshot_month(self.month, keep=0.0)
+
+    def test_interrupted_run_resumes(self):
+        original = MonthlyLeaderboard.objects.bulk_update
+        calls = []
+
+        def crash_on_second_chunk(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('worker killed')
+            return original(*args, **kwargs)
+
+        with mock.patch.object(MonthlyLeaderboard.objects, 'bulk_update', crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                snapshot_month(self.month, chunk_size=2)
+        snapshot = LeaderboardSnapshot.objects.get(month=self.month)
+        self.assertEqual((snapshot.status, snapshot.ranked), (LeaderboardSnapshot.RANKING, 2))
+
+        snapshot = snapshot_month(self.month, chunk_size=2)
+        self.assertEqual(snapshot.ranked, 6)
+        self.assertEqual(self.ranks(), self.expected_ranks())
+
+    def test_decay_and_reset(self):
+        out = StringIO()
+        call_command('snapshot_leaderboard', month='2025-03', decay=0.5, chunk_size=3, stdout=out)
+        self.assertIn('2025-03: 6 user(s) ranked', out.getvalue())
+        self.assertEqual(
+            dict(CustomUser.objects.values_list('username', 'points')),
+            {'amine': 6, 'sara': 15, 'yacine': 6, 'lina': 2, 'omar': 0, 'nour': 15, 'karim': 6},
+        )
+        self.earn(CustomUser.objects.get(username='lina'), 4, datetime(2025, 4, 2, tzinfo=dt_timezone.utc))
+        call_command('snapshot_leaderboard', month='2025-04', reset=True, stdout=out)
+        # Only April's points are taken; what carried over from March stays
+        self.assertEqual(CustomUser.objects.get(username='lina').points, 2)
+        self.assertEqual(CustomUser.objects.get(username='sara').points, 15)
+        self.assertEqual(ranking.rank(2), 6)
+
+    def test_points_earned_after_the_month_are_kept(self):
+        sara = CustomUser.objects.get(username='sara')
+        # The March snapshot runs late, after sara earned points in April
+        self.earn(sara, 7, datetime(2025, 4, 1, 9, tzinfo=dt_timezone.utc))
+        snapshot_month(self.month, keep=0.0)
+        self.assertEqual(MonthlyLeaderboard.objects.get(month=self.month, user=sara).points, 30)
+        sara.refresh_from_db()
+        self.assertEqual(sara.points, 7)
+        self.assertEqual(sum(sara.points_transactions.values_list('delta', flat=True)), 7)
+
+    def test_leaderboard_serves_past_months_from_the_snapshot(self):
+        snapshot_month(self.month)
+        award(CustomUser.objects.get(username='lina'), 100, PointsTransaction.PURCHASE)
+        response = self.client.get(reverse('leaderboard'), {'month': '2025-03'})
+        self.assertEqual(response.context['selected_month'], self.month)
+        top = [(entry.username, entry.rank) for entry in response.context['top_users']]
+        self.assertEqual(top[:3], [('sara', 1), ('nour', 1), ('amine', 3)])
+        self.assertContains(response, 'Top 10 de')
+
+        response = self.client.get(reverse('leaderboard'), {'month': '2024-01'})
+        self.assertIsNone(response.context['selected_month'])
+        self.assertEqual(response.context['top_users'][0]['username'], 'lina')
+
+
+class PointsLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.category = Category.objects.create(name='Chaussures')
+        cls.shoe = make_product(cls.category, name='Air Max', stock=5)
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+
+    def ledger_total(self, user):
+        return sum(user.points_transactions.values_list('delta', flat=True))
+
+    def test_award_records_the_row_and_moves_the_balance(self):
+        award(self.user, 3, PointsTransaction.ADJUSTMENT)
+        award(self.user, -1, PointsTransaction.ADJUSTMENT)
+        self.assertEqual(self.user.points, 2)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 2)
+        self.assertEqual(self.ledger_total(self.user), 2)
+
+    def test_award_does_not_lose_a_concurrent_change(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        award(self.user, 2, PointsTransaction.PURCHASE)
+        award(stale, 1, PointsTransaction.PURCHASE)
+        self.assertEqual(stale.points, 3)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 3)
+
+    def open_admin_form(self):
+        """GET the user's admin change form as a staff member: its URL and the data it would post back"""
+        self.client.force_login(CustomUser.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123'))
+        url = reverse('admin:shop_customuser_change', args=[self.user.pk])
+        form = self.client.get(url).context['adminform'].form
+        self.assertNotIn('points', form.fields)
+        user = self.user
+        return url, {
+            'username': user.username, 'email': user.email, 'is_active': 'on',
+            'date_joined_0': f'{user.date_joined:%Y-%m-%d}', 'date_joined_1': f'{user.date_joined:%H:%M:%S}',
+            'referral_code': user.referral_code, 'points_adjustment': '',
+        }
+
+    def test_admin_edit_does_not_overwrite_a_concurrent_award(self):
+        url, data = self.open_admin_form()
+        # Earned while the form was open
+        award(self.user, 5, PointsTransaction.PURCHASE)
+        response = self.client.post(url, {**data, 'email': 'amine@example.com'})
+        self.assertEqual(response.status_code, 302)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual((user.email, user.points), ('amine@example.com', 5))
+        self.assertEqual(list(user.points_transactions.values_list('reason', 'delta')), [(PointsTransaction.PURCHASE, 5)])
+
+    def test_admin_adjusts_points_through_the_ledger(self):
+        award(self.user, 5, PointsTransaction.PURCHASE)
+        url, data = self.open_admin_form()
+        response = self.client.post(url, {**data, 'points_adjustment': '-2'})
+        self.assertEqual(response.status_code, 302)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(user.points, 3)
+        self.assertEqual(self.ledger_total(user), 3)
+        self.assertEqual(user.points_transactions.get(reason=PointsTransaction.ADJUSTMENT).delta, -2)
+
+    @override_settings(RECAPTCHA_SITE_KEY='', RECAPTCHA_SECRET_KEY='')
+    def test_referral_signup_writes_both_entries(self):
+        form = CustomUserCreationForm({
+            'username': 'sara',
+            'email': 'sara@example.com',
+            'password1': 'a-Long-pass-123',
+            'password2': 'a-Long-pass-123',
+            'referral_code_input': self.user.referral_code,
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        sara = form.save()
+        self.assertEqual(
+            list(PointsTransaction.objects.order_by('pk').values_list('user__username', 'reason', 'referral__username')),
+            [('amine', PointsTransaction.REFERRAL, 'sara'), ('sara', PointsTransaction.WELCOME, 'amine')],
+        )
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 1)
+        self.assertEqual(sara.points, 1)
+
+    def test_purchase_is_recorded_with_its_order(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('purchase_product', args=[self.shoe.pk]))
+        entry = PointsTransaction.objects.get(user=self.user)
+        self.assertEqual((entry.delta, entry.reason), (1, PointsTransaction.PURCHASE))
+        self.assertEqual(entry.order.user, self.user)
+
+    def test_earnings_are_windowed_by_month(self):
+        march = datetime(2025, 3, 15, 12, tzinfo=dt_timezone.utc)
+        award(self.user, 4, PointsTransaction.PURCHASE)
+        award(self.user, 2, PointsTransaction.ADJUSTMENT)
+        PointsTransaction.objects.filter(delta=4).update(created_at=march)
+        award(self.user, 1, PointsTransaction.PURCHASE)
+
+        self.assertEqual(earned_by(self.user, *month_window(march)), 4)
+        # Adjustments are not earnings
+        self.assertEqual(earned_by(self.user, *month_window()), 1)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['points_this_month'], 1)
+        self.assertEqual(len(response.context['points_history']), 3)
+
+    def test_reconcile_repairs_drifted_balances(self):
+        award(self.user, 5, PointsTransaction.PURCHASE)
+        other = CustomUser.objects.create_user('sara', password='secret-pass-123')
+        # Balances written behind the ledger's back
+        CustomUser.objects.filter(pk=self.user.pk).update(points=50)
+        CustomUser.objects.filter(pk=other.pk).update(points=7)
+
+        out = StringIO()
+        call_command('reconcile_points', dry_run=True, chunk_size=1, stdout=out)
+        self.assertIn('2 user(s) checked, 2 would be repaired', out.getvalue())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).points, 50)
+
+        call_command('reconcile_points', chunk_size=1, stdout=out)
+        self.assertEqual(
+            dict(CustomUser.objects.values_list('username', 'points')), {'amine': 5, 'sara': 0},
+        )
+        out = StringIO()
+        call_command('reconcile_points', stdout=out)
+        self.assertIn('0 repaired', out.getvalue())
+
+    def test_monthly_reset_goes_through_the_ledger(self):
+        award(self.user, 9, PointsTransaction.PURCHASE)
+        # The month the points were earned in
+        call_command('snapshot_leaderboard', month=f'{timezone.localdate():%Y-%m}', decay=0.5, stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points, 4)
+        self.assertEqual(self.ledger_total(self.user), 4)
+        self.assertEqual(
+            self.user.points_transactions.get(reason=PointsTransaction.MONTHLY_RESET).delta, -5,
+        )
+
+
+class ReferralTreeTests(TestCase):
+    # amine <- sara <- nour <- lina, amine <- omar
+    @classmethod
+    def setUpTestData(cls):
+        cls.amine = CustomUser.objects.create_user('amine', password='secret-pass-123')
+        cls.sara = CustomUser.objects.create_user('sara', password='secret-pass-123', referred_by=cls.amine)
+        cls.nour = CustomUser.objects.create_user('nour', password='secret-pass-123', referred_by=cls.sara)
+        cls.lina = CustomUser.objects.create_user('lina', password='secret-pass-123', referred_by=cls.nour)
+        cls.omar = CustomUser.objects.create_user('omar', password='secret-pass-123', referred_by=cls.amine)
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+
+    def stats(self):
+        return {
+            stats.user.username: (stats.direct_referrals, stats.indirect_referrals, stats.depth, stats.downstream_points)
+            for stats in ReferralStats.objects.select_related('user')
+        }
+
+    def paths(self):
+        return set(ReferralPath.objects.values_list('ancestor__username', 'descendant__username', 'depth'))
+
+    def test_registration_maintains_the_closure_table(self):
+        self.assertEqual(self.paths(), {
+            ('amine', 'sara', 1), ('amine', 'nour', 2), ('amine', 'lina', 3), ('amine', 'omar', 1),
+            ('sara', 'nour', 1), ('sara', 'lina', 2), ('nour', 'lina', 1),
+        })
+        self.assertEqual(self.stats(), {
+            'amine': (2, 2, 3, 0), 'sara': (1, 1, 2, 0), 'nour': (1, 0, 1, 0),
+        })
+
+    def test_earned_points_flow_up_the_tree(self):
+        award(self.lina, 4, PointsTransaction.PURCHASE)
+        award(self.sara, 2, PointsTransaction.PURCHASE)
+        # Not earnings
+        award(self.lina, 10, PointsTransaction.ADJUSTMENT)
+        self.assertEqual(self.stats(), {
+            'amine': (2, 2, 3, 6), 'sara': (1, 1, 2, 4), 'nour': (1, 0, 1, 4),
+        })
+
+    def test_rebuild_matches_the_incremental_tables(self):
+        award(self.nour, 3, PointsTransaction.PURCHASE)
+        paths, stats = self.paths(), self.stats()
+        out = StringIO()
+        call_command('rebuild_referral_tree', stdout=out)
+        self.assertIn('7 referral path(s), 3 referrer(s)', out.getvalue())
+        self.assertEqual(self.paths(), paths)
+        self.assertEqual(self.stats(), stats)
+
+    def test_changing_a_referrer_moves_the_subtree(self):
+        award(self.lina, 5, PointsTransaction.PURCHASE)
+        self.nour.referred_by = self.omar
+        self.nour.save()
+        self.assertEqual(self.stats(), {
+            'amine': (2, 2, 3, 5), 'omar': (1, 1, 2, 5), 'nour': (1, 0, 1, 5),
+        })
+        self.assertNotIn(('sara', 'lina', 2), self.paths())
+
+        with self.assertRaises(ReferralCycle):
+            move(self.amine, self.lina.pk)
+        self.amine.referred_by = self.lina
+        with self.assertRaises(ValidationError):
+            self.amine.full_clean()
+
+    def test_deleting_a_referrer_turns_their_referrals_into_roots(self):
+        self.sara.delete()
+        self.assertEqual(self.stats(), {'amine': (1, 0, 1, 0), 'nour': (1, 0, 1, 0)})
+        self.assertIsNone(CustomUser.objects.get(pk=self.nour.pk).referred_by)
+        rebuild()
+        self.assertEqual(self.stats(), {'amine': (1, 0, 1, 0), 'nour': (1, 0, 1, 0)})
+
+    @override_settings(REFERRALS_PER_PAGE=1)
+    def test_profile_reads_stats_and_pages_referrals(self):
+        self.client.force_login(self.amine)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['referral_stats'].indirect_referrals, 2)
+        self.assertEqual([user.username for user in response.context['referred_users']], ['omar'])
+
+        response = self.client.get(reverse('profile') + response.context['next_page_url'])
+        self.assertEqual([user.username for user in response.context['referred_users']], ['sara'])
+        self.assertIsNone(response.context['next_page_url'])
+
+        # Somebody without referrals gets zeros without a stats row
+        self.client.force_login(self.lina)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['referral_stats'].direct_referrals, 0)
+
+
+@override_settings(ROOT_URLCONF='shop.testing')
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(cls.shoes, name='Air Max')
+        cls.other = make_product(cls.shoes, name='Stan Smith')
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+
+    async def test_catalog_pages_render_from_the_async_client(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.product, response.context['featured_products'])
+
+        response = await self.async_client.get(reverse('products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Stan Smith')
+
+        response = await self.async_client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertEqual(response.context['product'], self.product)
+        self.assertEqual(list(response.context['related_products']), [self.other])
+
+    async def test_async_views_are_the_ones_served(self):
+        self.assertIs(resolve(reverse('home')).func, views.ahome)
+        self.assertIs(resolve(reverse('products')).func, views.aproducts)
+
+    async def test_unknown_product_is_a_404(self):
+        response = await self.async_client.get(reverse('product_detail', args=[self.other.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_gather_reads_runs_in_turn_inside_a_transaction(self):
+        # TestCase wraps every test in a transaction: the reads must see its rows
+        counts = await gather_reads(
+            lambda: Product.objects.count(),
+            lambda: Category.objects.count(),
+        )
+        self.assertEqual(counts, [2, 1])
+
+
+class GatherReadsTests(TransactionTestCase):
+    async def test_reads_overlap_outside_a_transaction(self):
+        # Both callables must be waiting at the barrier at once, or it times out
+        barrier = threading.Barrier(2, timeout=5)
+        results = await gather_reads(
+            lambda: barrier.wait() is not None and 'a',
+            lambda: barrier.wait() is not None and 'b',
+        )
+        self.assertEqual(results, ['a', 'b'])
+
+
+class ProductCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(cls.shoes, name='Air Max', price=9000)
+        cls.other = make_product(cls.shoes, name='Stan Smith', price=7000)
+
+    def setUp(self):
+        cache.clear()
+
+    def rendered(self, products, **kwargs):
+        with mock.patch('shop.cards.render_to_string', wraps=cards.render_to_string) as render:
+            html = render_cards(products, **kwargs)
+        return html, render.call_count
+
+    def test_cards_are_rendered_once_and_fetched_together(self):
+        _, renders = self.rendered([self.product, self.other])
+        self.assertEqual(renders, 2)
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            html, renders = self.rendered([self.product, self.other])
+        self.assertEqual(renders, 0)
+        # Versions, then the cards
+        self.assertEqual(get_many.call_count, 2)
+        self.assertIn('Air Max', html[0])
+        self.assertIn('Stan Smith', html[1])
+
+    def test_saving_a_product_renders_its_card_again(self):
+        self.rendered([self.product, self.other])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 8500
+            self.product.save()
+        html, renders = self.rendered([self.product, self.other])
+        self.assertEqual(renders, 1)
+        self.assertIn('8500', html[0])
+
+    def test_admin_list_editable_edit_renders_the_card_again(self):
+        admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        self.client.force_login(admin)
+        self.rendered([self.product])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:shop_product_changelist'), {
+                'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+                'form-0-id': self.product.pk, 'form-0-price': '6500', 'form-0-stock': '5',
+                '_save': 'Save',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.product.refresh_from_db()
+        html, renders = self.rendered([self.product])
+        self.assertEqual(renders, 1)
+        self.assertIn('6500', html[0])
+
+    def test_renaming_a_category_renders_every_card_again(self):
+        self.rendered([self.product, self.other])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.name = 'Baskets'
+            self.shoes.save()
+        products = list(Product.objects.select_related('category').order_by('pk'))
+        html, renders = self.rendered(products)
+        self.assertEqual(renders, 2)
+        self.assertIn('Baskets', html[0])
+
+    def test_reserved_units_show_without_a_save(self):
+        self.rendered([self.product])
+        Product.objects.filter(pk=self.product.pk).update(reserved=F('stock'))
+        self.product.refresh_from_db()
+        html, renders = self.rendered([self.product])
+        self.assertEqual(renders, 1)
+        self.assertIn('Rupture', html[0])
+
+    def test_cards_are_per_language(self):
+        self.rendered([self.product], template_name='partials/product_card_home.html')
+        with translation.override('en'):
+            html, renders = self.rendered([self.product], template_name='partials/product_card_home.html')
+        self.assertEqual(renders, 1)
+        self.assertIn('/en/', html[0])
+
+    def test_each_visitor_gets_their_own_csrf_token(self):
+        tokens = []
+        for _ in range(2):
+            self.client.cookies.clear()
+            response = self.client.get(reverse('products'))
+            self.assertNotContains(response, cards.CSRF_PLACEHOLDER)
+            tokens.append(re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode())[1])
+        self.assertNotEqual(tokens[0], tokens[1])
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(cls.shoes, name='Air Max', price=9000)
+        cls.user = CustomUser.objects.create_user('amine', password='secret-pass-123', points=42)
+
+    def setUp(self):
+        cache.clear()
+        ranking.clear()
+        page_cache.reset_stats()
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_second_anonymous_visit_is_served_from_the_cache(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        self.assertEqual(self.get(url)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Air Max')
+        self.assertIn('pagecache;desc="hit"', response['Server-Timing'])
+
+    def test_pages_are_per_language_and_normalized_query(self):
+        self.get(reverse('products') + '?sort=price&brand=Marque')
+        self.assertEqual(self.get(reverse('products') + '?brand=Marque&sort=price')['X-Page-Cache'], 'hit')
+        with translation.override('en'):
+            self.assertEqual(self.get(reverse('products') + '?brand=Marque&sort=price')['X-Page-Cache'], 'miss')
+
+    def test_catalog_changes_drop_the_pages_showing_them(self):
+        detail = reverse('product_detail', args=[self.product.pk])
+        self.get(detail)
+        self.get(reverse('products'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 8500
+            self.product.save()
+        response = self.get(detail)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '8500')
+        self.assertEqual(self.get(reverse('products'))['X-Page-Cache'], 'miss')
+
+    def test_renaming_the_category_drops_its_product_pages(self):
+        detail = reverse('product_detail', args=[self.product.pk])
+        self.get(detail)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.name = 'Baskets'
+            self.shoes.save()
+        self.assertEqual(self.get(detail)['X-Page-Cache'], 'miss')
+
+    def test_stock_held_by_a_cart_drops_the_product_page(self):
+        detail = reverse('product_detail', args=[self.product.pk])
+        self.get(detail)
+        cart = Cart.objects.create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve(cart, self.product)
+        self.assertEqual(self.get(detail)['X-Page-Cache'], 'miss')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.get(reverse('home'))
+        self.client.force_login(self.user)
+        response = self.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'bypass')
+        self.assertContains(response, '42 pts')
+
+    def test_pending_messages_bypass_the_cache(self):
+        self.get(reverse('products'))
+        self.client.cookies['messages'] = 'pending'
+        self.assertEqual(self.get(reverse('products'))['X-Page-Cache'], 'bypass')
+
+    def test_cached_forms_carry_each_visitor_own_csrf_token(self):
+        self.get(reverse('products'))
+        self.client.cookies.clear()
+        response = self.get(reverse('products'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, page_cache.CSRF_PLACEHOLDER)
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertIn('csrftoken', response.cookies)
+
+    @override_settings(PRODUCTS_PER_PAGE=1)
+    def test_cached_fragments_carry_each_visitor_own_csrf_token(self):
+        make_product(self.shoes, name='Stan Smith', price=7000)
+        url = reverse('products_more') + self.get(reverse('products')).context['next_page_url']
+        tokens = []
+        for visitor in (Client(), Client()):
+            # A visitor who already has a token, from an earlier page
+            visitor.get(reverse('products'))
+            response = visitor.get(url)
+            html = response.json()['html']
+            self.assertNotIn(page_cache.CSRF_PLACEHOLDER, html)
+            token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html)[1]
+            self.assertEqual(_unmask_cipher_token(token), visitor.cookies['csrftoken'].value)
+            tokens.append(token)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    def test_pages_without_tags_are_left_alone(self):
+        response = self.get(reverse('leaderboard'))
+        self.assertNotIn('X-Page-Cache', response)
+
+    def test_stats(self):
+        url = reverse('products')
+        self.get(url)
+        self.get(url)
+        self.get(url)
+        current = page_cache.stats()
+        self.assertEqual(current['hit']['requests'], 2)
+        self.assertEqual(current['miss']['requests'], 1)
+        self.assertAlmostEqual(current['hit_ratio'], 2 / 3)
+        out = StringIO()
+        call_command('page_cache_stats', '--reset', stdout=out)
+        self.assertIn('Hit ratio: 66.7%', out.getvalue())
+        self.assertEqual(page_cache.stats()['hit']['requests'], 0)
+
+
+def image_upload(width=1200, height=800, name='photo.jpg', mode='RGB', image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), 'red').save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageRenditionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media, IMAGE_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def create(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product(self.shoes, **kwargs)
+        product.refresh_from_db()
+        return product
+
+    def size_of(self, product, rendition, image_format, density):
+        name = product.image_renditions['files'][rendition][image_format][density]
+        with product.image.storage.open(name) as f:
+            return Image.open(f).size
+
+    def test_upload_gets_webp_and_jpeg_renditions(self):
+        product = self.create(image=image_upload())
+        self.assertTrue(images.is_current(product))
+        self.assertEqual(self.size_of(product, 'card', 'webp', '1'), (400, 267))
+        self.assertEqual(self.size_of(product, 'card', 'jpeg', '2'), (800, 533))
+        self.assertEqual(self.size_of(product, 'thumb', 'webp', '2'), (320, 213))
+
+        html = Template("{% load images %}{% responsive_image product 'card' alt='AF1' loading='lazy' %}").render(
+            Context({'product': product}),
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/products/photo/card-1x.webp 1x, ', html)
+        self.assertIn('src="/media/derivatives/products/photo/card-1x.jpg"', html)
+        self.assertIn('alt="AF1"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_small_images_are_never_upscaled(self):
+        product = self.create(image=image_upload(300, 200, mode='RGBA', name='small.png', image_format='PNG'))
+        self.assertEqual(self.size_of(product, 'card', 'jpeg', '1'), (300, 200))
+        self.assertNotIn('2', product.image_renditions['files']['card']['webp'])
+        self.assertEqual(self.size_of(product, 'thumb', 'webp', '2'), (300, 200))
+
+    def test_original_is_served_while_renditions_are_pending(self):
+        with override_settings(IMAGE_WORKERS=2), mock.patch.object(images, '_get_executor') as executor:
+            product = self.create(image=image_upload())
+        executor.return_value.submit.assert_called_once_with(images._run_in_worker, 'shop.Product', product.pk)
+        self.assertEqual(images.srcset(product), (product.image.url, ''))
+        html = Template("{% load images %}{% responsive_image product %}").render(Context({'product': product}))
+        self.assertEqual(html, f'<img src="{product.image.url}">')
+
+    def test_new_upload_replaces_the_renditions(self):
+        product = self.create(image=image_upload())
+        old = product.image_renditions['files']['card']['webp']['1']
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = image_upload(name='other.jpg')
+            product.save()
+        product.refresh_from_db()
+        self.assertTrue(images.is_current(product))
+        self.assertIn('other', product.image_renditions['files']['card']['webp']['1'])
+        self.assertFalse(product.image.storage.exists(old))
+
+    def test_unreadable_image_keeps_the_original(self):
+        with self.assertLogs('shop.images', 'WARNING'):
+            product = self.create(image=SimpleUploadedFile('broken.jpg', b'not an image'))
+        self.assertTrue(images.is_current(product))
+        self.assertEqual(images.srcset(product)[0], product.image.url)
+
+    def test_backfill_command(self):
+        product = make_product(self.shoes, image=image_upload())
+        self.assertFalse(images.is_current(product))
+        out = StringIO()
+        call_command('generate_image_derivatives', '--workers', '1', stdout=out)
+        product.refresh_from_db()
+        self.assertTrue(images.is_current(product))
+        self.assertIn('1 image(s)', out.getvalue())
+        self.assertIn('Card images of 1 product(s)', out.getvalue())
+
+
+class ParallelBackfillTests(TransactionTestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media, IMAGE_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_workers_share_the_backfill(self):
+        shoes = Category.objects.create(name='Chaussures')
+        with mock.patch('shop.signals.schedule'):
+            for index in range(3):
+                make_product(shoes, image=image_upload(name=f'photo{index}.jpg'))
+        self.assertFalse(any(images.is_current(product) for product in Product.objects.all()))
+        out = StringIO()
+        call_command('generate_image_derivatives', '--workers', '3', stdout=out)
+        self.assertIn('3 image(s)', out.getvalue())
+        self.assertTrue(all(images.is_current(product) for product in Product.objects.all()))
+
+
+class StaticAssetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stylesheet_is_up_to_date(self):
+        self.assertEqual(
+            assets.stylesheet_path().read_text(encoding='utf-8'), assets.build(),
+            'static/css/site.css is stale: run manage.py build_assets',
+        )
+
+    def test_compiles_variants_and_modifiers(self):
+        screen, _, _, rule, _ = assets.compile_class('md:hover:bg-white/20')
+        self.assertEqual(screen, 'md')
+        self.assertEqual(rule, '.md\\:hover\\:bg-white\\/20:hover { background-color: rgb(255 255 255 / 0.2); }')
+        rule = assets.compile_class('group-hover/btn:scale-110')[3]
+        self.assertTrue(rule.startswith('.group\\/btn:hover .group-hover\\/btn\\:scale-110 {'))
+        self.assertIn('z-index: 100', assets.compile_class('z-[100]')[3])
+        self.assertIsNone(assets.compile_class('message.tags'))
+        self.assertIsNone(assets.compile_class('text-md'))
+
+    def test_later_utilities_win_the_cascade(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.html') as template:
+            template.write('<div class="duration-300 transition bg-opacity-50 bg-white border-b-2 border-0 md:p-4 p-2">')
+            template.flush()
+            css = assets.build_css([template.name])
+        self.assertLess(css.index('.transition {'), css.index('.duration-300 {'))
+        self.assertLess(css.index('.bg-white {'), css.index('.bg-opacity-50 {'))
+        self.assertLess(css.index('.border-0 {'), css.index('.border-b-2 {'))
+        self.assertLess(css.index('.p-2 {'), css.index('.md\\:p-4 {'))
+        self.assertNotIn('.fa-', css)
+
+    def test_pages_need_no_network(self):
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertNotRegex(content, r'(src|href)="(https?:)?//')
+        self.assertIn('href="/static/css/site.css"', content)
+        self.assertIn('src="/static/js/site.js"', content)
+
+
+class CollectedStaticTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        override = override_settings(STATIC_ROOT=root)
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def get(self, path, **headers):
+        response = self.client.get(path, headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else b''
+
+    def test_hashed_gzipped_and_cached_for_a_year(self):
+        content = self.client.get(reverse('home')).content.decode()
+        url = re.search(r'href="(/static/css/site\.[0-9a-f]{12}\.css)"', content).group(1)
+        self.assertRegex(content, r'src="/static/js/site\.[0-9a-f]{12}\.js"')
+
+        response, body = self.get(url, accept_encoding='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('immutable', response['Cache-Control'])
+        css = assets.stylesheet_path().read_bytes()
+        self.assertEqual(gzip.decompress(body), css)
+        self.assertLess(len(body), len(css) / 3)
+
+        response, body = self.get(url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(body, css)
+
+    def test_plain_names_are_not_immutable(self):
+        response, _ = self.get('/static/css/site.css', accept_encoding='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_outside_the_static_root_is_not_found(self):
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+
+
+class WarmUpTests(TestCase):
+    def test_primes_catalogs_resolvers_and_templates(self):
+        loader = engines['django'].engine.template_loaders[0]
+        loader.reset()
+        report = warmup.warm_up()
+
+        self.assertEqual(list(report), ['translations', 'urls', 'templates', 'static'])
+        for code, _ in settings.LANGUAGES:
+            self.assertIn(code, trans_real._translations)
+            self.assertIn(code, get_resolver()._reverse_dict)
+        for name in ('base.html', 'home.html', 'cart/cart.html', 'partials/product_card.html'):
+            self.assertIn(name, loader.get_template_cache)
+        # Contrib apps' templates are left alone
+        self.assertNotIn('admin/base.html', loader.get_template_cache)
+        self.assertEqual(report['templates'][0], len(warmup.project_templates()))
+
+    def test_broken_template_does_not_stop_the_worker(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        with open(f'{folder}/broken.html', 'w') as f:
+            f.write('{% if %}')
+        templates = [{**settings.TEMPLATES[0], 'DIRS': [folder, *settings.TEMPLATES[0]['DIRS']]}]
+        with override_settings(TEMPLATES=templates), self.assertLogs('shop.warmup', 'ERROR'):
+            self.assertIn('broken.html', warmup.project_templates())
+            report = warmup.warm_up()
+            self.assertEqual(report['templates'][0], len(warmup.project_templates()) - 1)
+
+    def test_command_reports_each_step(self):
+        out = StringIO()
+        call_command('warm_up', stdout=out)
+        self.assertIn('templates', out.getvalue())
+        self.assertIn('Warmed up in', out.getvalue())
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        replica = connections['replica']
+        mirror_name = replica.settings_dict['NAME']
+        replica.settings_dict['NAME'] = f'{folder}/replica.sqlite3'
+        self.addCleanup(replica.settings_dict.__setitem__, 'NAME', mirror_name)
+        self.addCleanup(replica.close)
+
+        shoes = Category.objects.create(name='Chaussures')
+        self.copied = make_product(shoes, name='Copiée')
+        replicas.refresh_sqlite_replica()
+        # Written after the copy: only on the primary
+        self.recent = make_product(shoes, name='Récente')
+
+    def detail(self, product):
+        return self.client.get(reverse('product_detail', args=[product.pk]))
+
+    def test_catalog_reads_go_to_the_replica(self):
+        self.assertEqual(self.detail(self.copied).status_code, 200)
+        self.assertEqual(self.detail(self.recent).status_code, 404)
+        # Not a replica_reads view
+        self.client.force_login(CustomUser.objects.create_user('acheteur', password='motdepasse123'))
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def test_visitor_who_wrote_reads_the_primary(self):
+        CustomUser.objects.create_user('acheteur', password='motdepasse123')
+        response = self.client.post(reverse('login'), {'username': 'acheteur', 'password': 'motdepasse123'})
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], settings.REPLICA_MAX_LAG)
+        self.assertEqual(self.detail(self.recent).status_code, 200)
+
+    def test_stale_or_missing_copy_is_not_used(self):
+        stale = time.time() - settings.REPLICA_MAX_LAG - 1
+        os.utime(connections['replica'].settings_dict['NAME'], (stale, stale))
+        self.assertEqual(self.detail(self.recent).status_code, 200)
+        os.remove(connections['replica'].settings_dict['NAME'])
+        self.assertEqual(self.detail(self.recent).status_code, 200)
+
+    def test_pages_older_than_their_tags_are_not_cached(self):
+        # The product's tag is minted by this first visit, after the copy was made
+        self.assertEqual(self.detail(self.copied)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.detail(self.copied)['X-Page-Cache'], 'miss')
+        call_command('refresh_replica', stdout=StringIO())
+        self.assertEqual(self.detail(self.copied)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.detail(self.copied)['X-Page-Cache'], 'hit')
+
+    def test_facets_are_computed_on_the_primary(self):
+        # Cached under the generation until FACET_CACHE_TIMEOUT: the copy would miss Récente
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.context['total_products'], 2)
+
+    def test_ranking_tree_is_built_on_the_primary(self):
+        CustomUser.objects.create_user('amine', password='secret-pass-123', points=5)
+        ranking.clear()
+        response = self.client.get(reverse('leaderboard'))
+        self.assertEqual((response.context['total_users'], response.context['total_points']), (1, 5))
+
+    def test_replica_is_read_only(self):
+        with self.assertRaises(OperationalError):
+            Product.objects.using('replica').filter(pk=self.copied.pk).update(name='Modifiée')
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries read an index range, not the whole table, however large it grows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(cls.shoes)
+        make_product(cls.shoes, name='Épuisé', stock=0)
+        cls.user = CustomUser.objects.create_user('acheteur', password='motdepasse123', points=10)
+        CustomUser.objects.create_user('voisin', password='motdepasse123', points=20)
+        cls.order = Order.objects.create(user=cls.user, total_price=1000)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        # A full scan is a SCAN of a table without an index
+        self.assertIsNone(re.search(r'\bSCAN \w+$', plan, re.MULTILINE), plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_available_products(self):
+        available = Product.objects.filter(stock__gt=F('reserved'))
+        # Home page: only the available products' entries are read
+        self.assertUsesIndex(available[:6], 'product_available_idx')
+        self.assertUsesIndex(
+            available.filter(category=self.shoes).order_by('-created_at', '-id')[:24], 'product_available_idx',
+        )
+
+    def test_related_products(self):
+        related = Product.objects.filter(category__products=self.product.pk).exclude(id=self.product.pk)[:4]
+        self.assertUsesIndex(related, 'shop_product_category_id')
+
+    def test_latest_orders_of_a_user(self):
+        self.assertUsesIndex(Order.objects.filter(user=self.user).order_by('-created_at')[:5], 'order_user_created_idx')
+
+    def test_order_by_number(self):
+        self.assertUsesIndex(
+            Order.objects.filter(order_number=self.order.order_number, user=self.user), 'sqlite_autoindex_shop_order',
+        )
+
+    def test_users_by_points(self):
+        self.assertUsesIndex(CustomUser.objects.order_by('-points', 'id')[:10], 'user_points_rank_idx')
+        self.assertUsesIndex(
+            CustomUser.objects.filter(points__gt=self.user.points).order_by('points', '-id')[:2], 'user_points_rank_idx',
+        )
+        self.assertUsesIndex(CustomUser.objects.filter(points__gt=self.user.points).values('pk'), 'user_points_rank_idx')
+
+    def test_order_changelist(self):
+        self.assertUsesIndex(Order.objects.order_by('-created_at')[:100], 'order_created_idx')
+        self.assertUsesIndex(
+            Order.objects.filter(status='pending').order_by('-created_at')[:100], 'order_status_created_idx',
+        )
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        # Counts left pending by earlier tests go to the cache this clears
+        metrics.registry.flush()
+        cache.clear()
+        self.shoes = Category.objects.create(name='Chaussures')
+        make_product(self.shoes)
+
+    def test_records_queries_db_and_render_time_per_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('products')).status_code, 200)
+        recorded = metrics.snapshot()['products']
+
+        self.assertEqual(recorded['requests'], 1)
+        self.assertEqual(recorded['queries']['count'], 1)
+        self.assertEqual(recorded['queries']['sum'], len(queries))
+        self.assertGreater(recorded['db']['sum'], 0)
+        self.assertGreater(recorded['render']['sum'], 0)
+        self.assertGreaterEqual(recorded['duration']['sum'], recorded['render']['sum'])
+        self.assertEqual(sum(recorded['duration']['buckets']), 1)
+
+    def test_unsampled_requests_are_only_counted(self):
+        with override_settings(METRICS_SAMPLE_RATE=0):
+            self.client.get(reverse('home'))
+            self.client.get('/fr/introuvable/')
+        recorded = metrics.snapshot()
+        self.assertEqual(recorded['home']['requests'], 1)
+        self.assertEqual(recorded['home']['duration']['count'], 0)
+        self.assertEqual(recorded[metrics.UNRESOLVED]['requests'], 1)
+
+    @override_settings(METRICS_TOKEN='jeton-secret')
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer autre'}).status_code, 403)
+
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer jeton-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE shop_request_queries histogram', body)
+        self.assertIn('shop_requests_total{view="home"} 1', body)
+        self.assertIn('shop_request_duration_seconds_bucket{view="home",le="+Inf"} 1', body)
+        self.assertIn('shop_request_duration_seconds_count{view="home"} 1', body)
+
+        self.client.force_login(CustomUser.objects.create_user('equipe', password='motdepasse123', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_command_ranks_views_and_resets(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('products'))
+        out = StringIO()
+        call_command('metrics_top', '--by', 'queries', '--reset', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn('ranked by mean queries', lines[-1])
+        self.assertEqual(metrics.snapshot(), {})
+
+
+class LoadTestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shoes = Category.objects.create(name='Chaussures')
+        self.product = make_product(self.shoes, stock=10)
+        self.user = CustomUser.objects.create_user('acheteur', password='motdepasse123')
+        self.stub = StubVerifier().start()
+        self.addCleanup(self.stub.stop)
+        captcha = override_settings(
+            RECAPTCHA_SITE_KEY='site', RECAPTCHA_SECRET_KEY='secret', RECAPTCHA_VERIFY_URL=self.stub.url,
+        )
+        captcha.enable()
+        self.addCleanup(captcha.disable)
+
+    def test_recorded_traces_are_sanitized(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        path = os.path.join(folder, 'traces.jsonl')
+        with override_settings(LOADTEST_RECORD_PATH=path):
+            self.client.post(reverse('login'), {'username': 'acheteur', 'password': 'motdepasse123'})
+            self.client.get(reverse('products'), {'search': 'air'})
+            self.client.post(reverse('add_to_cart', args=[self.product.pk]))
+            self.client.get(reverse('checkout'))
+            self.client.post(reverse('confirm_order'), {
+                'full_name': 'Amine Benali', 'phone': '0661234567', 'wilaya': '16', 'commune': 'Hydra',
+                'address': '12 rue Didouche', 'g-recaptcha-response': 'token-1',
+            }, follow=True)
+        with open(path, encoding='utf-8') as f:
+            raw = f.read()
+        traces = loadtest.read_traces(path)
+
+        for secret in ('motdepasse123', 'acheteur', 'Amine', '0661234567', 'Didouche', 'token-1', 'sessionid'):
+            self.assertNotIn(secret, raw)
+        self.assertEqual(
+            [entry['view'] for entry in traces],
+            ['login', 'products', 'add_to_cart', 'checkout', 'confirm_order', 'checkout_success'],
+        )
+        login, search, add, _, confirm, success = traces
+        self.assertEqual(login['form'], {'username': [loadtest.REDACTED]})
+        self.assertEqual(search['query'], {'search': ['air']})
+        self.assertEqual(add['kwargs'], {'product_id': self.product.pk})
+        self.assertEqual(confirm['form']['wilaya'], ['16'])
+        self.assertEqual(confirm['form']['phone'], [loadtest.REDACTED])
+        self.assertEqual(success['kwargs'], {'order_number': loadtest.REDACTED})
+        # Logged in by the time it is recorded: all the visitor's requests share one pseudonym
+        self.assertEqual(len({entry['visitor'] for entry in traces}), 1)
+
+    def test_recorder_is_off_without_a_path(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            loadtest.TraceRecorderMiddleware(lambda request: request)
+
+    def test_generated_journeys_replay_against_the_catalog(self):
+        traces = loadtest.generate_scenarios(40, seed=1)
+        self.assertEqual(traces, loadtest.generate_scenarios(40, seed=1))
+        views = {entry['view'] for entry in traces}
+        self.assertLessEqual({'home', 'products', 'product_detail', 'add_to_cart', 'confirm_order', 'leaderboard'}, views)
+
+        sessions, skipped = loadtest.build_sessions(traces, [self.product.pk])
+        self.assertEqual(skipped, 0)
+        checkout = next(steps for steps in sessions.values() if any(step[0] == 'confirm_order' for step in steps))
+        self.client.force_login(self.user)
+        for view, method, path, form, ajax, authenticated, delay in checkout:
+            headers = {'X-Requested-With': 'XMLHttpRequest'} if ajax else {}
+            response = self.client.post(path, form, headers=headers) if method == 'POST' else self.client.get(path)
+            self.assertLess(response.status_code, 400, view)
+        self.assertTrue(Order.objects.filter(user=self.user, phone=loadtest.REPLAY_FORM['phone']).exists())
+
+    def test_redacted_arguments_are_not_replayed(self):
+        traces = [
+            loadtest._step('a', 1, 'checkout_success', authenticated=True, kwargs={'order_number': loadtest.REDACTED}),
+            loadtest._step('a', 3, 'product_detail', kwargs={'product_id': 7}),
+            loadtest._step('b', 2, 'logout', 'POST'),
+        ]
+        sessions, skipped = loadtest.build_sessions(traces, [self.product.pk, self.product.pk + 1])
+        self.assertEqual(skipped, 2)
+        self.assertEqual(sessions['a'][0][2], f'/fr/product/{self.product.pk + 1}/')
+        # First request of the visitor after the skipped one: paced from the previous replayed one
+        self.assertEqual(sessions['a'][0][6], 0)
+
+    def test_budgets_fail_the_replay(self):
+        summary = loadtest.summarize_replay([('home', 0.010), ('home', 0.300), ('products', 0.020)], [('home', 500)], 2.0)
+        self.assertEqual(summary['*']['requests'], 3)
+        self.assertEqual(summary['home']['errors'], 1)
+        self.assertAlmostEqual(summary['products']['per_second'], 0.5)
+        command = LoadTestReplayCommand(stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'home p95 300.0ms > 100ms'):
+            command.check_budgets(summary, 100, None)
+        command.check_budgets(summary, 500, 0.5)
+
+
+class QueryBudgetTests(TestCase):
+    """Every shop page runs the same number of queries whatever the size of the catalog and the customer's history"""
+
+    # Categories, products per category, referrals and orders of the customer
+    SCALES = {'small': (1, 2, 1, 1), 'large': (20, 5, 30, 30)}
+    # Page -> queries on cold caches (the logged-in customer unless anonymous)
+    BUDGETS = {
+        'home': 5,
+        'home (anonymous)': 2,
+        'products': 6,
+        'products_in_category': 6,
+        'products (anonymous)': 3,
+        'products_more': 4,
+        'product_detail': 5,
+        'product_detail (anonymous)': 2,
+        'leaderboard': 6,
+        'profile': 12,
+        'purchase_product': 16,
+        'set_language': 4,
+        'logout': 4,
+        'login (anonymous)': 0,
+        'register (anonymous)': 0,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = CustomUser.objects.create_user('acheteur', password='motdepasse123')
+
+    def grow(self, categories, per_category, referrals, orders):
+        """Bring the data up to the scale"""
+        for index in range(Category.objects.count(), categories):
+            category = Category.objects.create(name=f'Catégorie {index}')
+            for number in range(per_category):
+                make_product(category, name=f'Produit {index}-{number}', brand=f'Marque {number}', price=1000 + number)
+        for index in range(self.customer.referrals.count(), referrals):
+            CustomUser.objects.create_user(f'filleul{index}', referred_by=self.customer)
+        product = Product.objects.first()
+        for _ in range(Order.objects.filter(user=self.customer).count(), orders):
+            order = Order.objects.create(user=self.customer, total_price=product.price)
+            award(self.customer, 1, PointsTransaction.PURCHASE, order=order)
+
+    def pages(self):
+        product = Product.objects.order_by('pk').first()
+        catalog = {
+            'home': lambda client: client.get(reverse('home')),
+            'products': lambda client: client.get(reverse('products')),
+            'product_detail': lambda client: client.get(reverse('product_detail', args=[product.pk])),
+        }
+        return {
+            **catalog,
+            **{f'{name} (anonymous)': page for name, page in catalog.items()},
+            'products_in_category': lambda client: client.get(reverse('products'), {'category': product.category_id}),
+            'products_more': lambda client: client.get(reverse('products_more'), {'sort': 'price_asc'}),
+            'leaderboard': lambda client: client.get(reverse('leaderboard')),
+            'profile': lambda client: client.get(reverse('profile')),
+            'purchase_product': lambda client: client.get(reverse('purchase_product', args=[product.pk])),
+            'set_language': lambda client: client.get(reverse('set_language', args=['en'])),
+            'logout': lambda client: client.post(reverse('logout')),
+            'login (anonymous)': lambda client: client.get(reverse('login')),
+            'register (anonymous)': lambda client: client.get(reverse('register')),
+        }
+
+    def queries(self, name, page):
+        # Cold caches: the budget holds on a miss
+        cache.clear()
+        ranking.clear()
+        if name.endswith('(anonymous)'):
+            self.client.logout()
+        else:
+            self.client.force_login(self.customer)
+        # set_language activates its language for the rest of the thread
+        with translation.override(translation.get_language()), CaptureQueriesContext(connection) as captured:
+            response = page(self.client)
+        self.assertLess(response.status_code, 400, name)
+        return len(captured)
+
+    def test_every_page_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('shop.urls').url_patterns}
+        self.assertEqual(names, {name.partition(' ')[0] for name in self.BUDGETS} - {'products_in_category'})
+
+    def test_queries_do_not_grow_with_the_data(self):
+        for scale, size in self.SCALES.items():
+            self.grow(*size)
+            for name, page in self.pages().items():
+                with self.subTest(name, scale=scale):
+                    self.assertEqual(self.queries(name, page), self.BUDGETS[name])
+
+
+class OrderAdminTests(TestCase):
+    """Bulk status changes, and changelists costing the same however many orders there are"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_superuser('gerant', 'gerant@example.com', 'motdepasse123')
+        cls.shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(cls.shoes)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def add_orders(self, count, status='pending'):
+        orders = []
+        for _ in range(count):
+            user = CustomUser.objects.create(username=f'client{CustomUser.objects.count()}')
+            order = Order.objects.create(user=user, total_price=1000, status=status)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=1000)
+            orders.append(order)
+        return orders
+
+    def test_status_action_is_one_update(self):
+        pending = self.add_orders(3)
+        delivered = self.add_orders(1, status='delivered')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('admin:shop_order_changelist'), {
+                'action': 'mark_confirmed',
+                '_selected_action': [order.pk for order in pending + delivered],
+            }, follow=True)
+        updates = [query['sql'] for query in captured if query['sql'].startswith('UPDATE "shop_order"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Order.objects.filter(status='confirmed').count(), 3)
+        # Not a transition a delivered order can take
+        self.assertEqual(Order.objects.get(pk=delivered[0].pk).status, 'delivered')
+        self.assertContains(response, '3 commande(s) passée(s) à « Confirmée ». 1 ignorée(s)')
+
+    def test_status_action_on_the_filtered_orders(self):
+        self.add_orders(4)
+        confirmed = self.add_orders(2, status='confirmed')
+        self.client.post(reverse('admin:shop_order_changelist') + '?status__exact=confirmed', {
+            'action': 'mark_shipped',
+            'select_across': '1',
+            '_selected_action': [confirmed[0].pk],
+        })
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 2)
+        self.assertEqual(Order.objects.filter(status='pending').count(), 4)
+
+    def test_changelists_do_not_grow_with_the_data(self):
+        for url in (reverse('admin:shop_order_changelist'), reverse('admin:shop_orderitem_changelist')):
+            counts = []
+            for size in (2, 10):
+                self.add_orders(size)
+                cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                counts.append(len(captured))
+            self.assertEqual(counts[0], counts[1], url)
+
+    def test_estimated_count(self):
+        self.add_orders(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.add_orders(2)
+        self.assertEqual(estimated_row_count(Order), 3)
+        with mock.patch.object(EstimatedCountPaginator, 'EXACT_BELOW', 2):
+            # The statistics, until the next ANALYZE
+            self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 10).count, 3)
+            # A filtered list is counted
+            self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status='pending').order_by('pk'), 10).count, 5)
+        # A small table is counted
+        self.assertEqual(EstimatedCountPaginator(Order.objects.order_by('pk'), 10).count, 5)
+
+
+class OrderExportTests(TestCase):
+    """Courier and accounting manifests, streamed a chunk of orders at a time"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_superuser('gerant', 'gerant@example.com', 'motdepasse123')
+        shoes = Category.objects.create(name='Chaussures')
+        cls.product = make_product(shoes, name='Basket', size='42')
+        cls.orders = []
+        for day, status, wilaya in ((3, 'confirmed', '16'), (4, 'confirmed', '31'), (4, 'pending', '16'), (6, 'confirmed', '16')):
+            order = Order.objects.create(
+                user=cls.manager, total_price=2000, status=status, wilaya=wilaya, full_name=f'Client {day}',
+                phone='0555000000', commune='Alger Centre', address='1 rue des Tests', postal_code='16000',
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=datetime(2026, 3, day, 12, tzinfo=dt_timezone.utc))
+            OrderItem.objects.create(order=order, product=cls.product, quantity=2, price=1000)
+            cls.orders.append(order)
+
+    def setUp(self):
+        cache.clear()
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_orders', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_csv_manifest_filtered(self):
+        output = self.export('--status', 'confirmed', '--wilaya', '16', '--since', '2026-03-01', '--until', '2026-03-05')
+        header, *lines = output.splitlines()
+        self.assertEqual(header, ','.join([*exports.COLUMNS, 'items']))
+        self.assertEqual(len(lines), 1)
+        self.assertIn(self.orders[0].order_number, lines[0])
+        self.assertIn('16 - Alger', lines[0])
+        self.assertTrue(lines[0].endswith('2 x Basket (42)'))
+
+    def test_jsonl_manifest(self):
+        lines = [json.loads(line) for line in self.export('--format', 'jsonl', '--until', '2026-03-04').splitlines()]
+        # Oldest first; the last day is included
+        self.assertEqual([line['order_number'] for line in lines], [order.order_number for order in self.orders[:3]])
+        self.assertEqual(lines[0]['items'], [{
+            'product_id': self.product.pk, 'name': 'Basket', 'brand': 'Marque', 'size': '42', 'quantity': 2,
+            'price': '1000.00',
+        }])
+
+    def test_invalid_date(self):
+        with self.assertRaises(CommandError):
+            self.export('--since', '2026-02-30')
+
+    def test_formulas_are_kept_as_text(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(full_name='=HYPERLINK("http://example.com")')
+        self.assertIn('\'=HYPERLINK', self.export('--wilaya', '16'))
+
+    def test_items_read_per_chunk(self):
+        with CaptureQueriesContext(connection) as captured:
+            rows = list(exports.manifest_rows(Order.objects.all(), chunk_size=3))
+        self.assertEqual(len(rows), 4)
+        # The orders, then the items of each of the two chunks
+        self.assertEqual(len(captured), 1 + 2)
+
+    def test_admin_action_streams(self):
+        self.client.force_login(self.manager)
+        response = self.client.post(reverse('admin:shop_order_changelist') + '?wilaya__exact=16', {
+            'action': 'export_csv',
+            'select_across': '1',
+            '_selected_action': [self.orders[0].pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="commandes-', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
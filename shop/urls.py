@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
 
+# Async catalog views under ASGI only: under WSGI they would pay for an event loop per request
+if settings.ASYNC_VIEWS:
+    home, products, product_detail = views.ahome, views.aproducts, views.aproduct_detail
+else:
+    home, products, product_detail = views.home, views.products, views.product_detail
+
 urlpatterns = [
-    path('', views.home, name='home'),
-    path('products/', views.products, name='products'),
-    path('product/<int:product_id>/', views.product_detail, name='product_detail'),  # ADD THIS
+    path('', home, name='home'),
+    path('products/', products, name='products'),
+    path('products/more/', views.products_more, name='products_more'),
+    path('product/<int:product_id>/', product_detail, name='product_detail'),  # ADD THIS
     path('leaderboard/', views.leaderboard, name='leaderboard'),
     
     # Authentication URLs
@@ -2,13 +2,28 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Count, Sum
-from .models import Product, Category, CustomUser, Order, OrderItem
+from django.db import transaction
+from django.db.models import F
+from .models import Product, CustomUser, Order, OrderItem, PointsTransaction
 from .forms import CustomUserCreationForm, CustomLoginForm
+from .pagination import DEFAULT_SORT, RELEVANCE, SORTS, paginate_keyset
+from .parallel import arender, gather_reads
+from .facets import CatalogFilters, get_facets
+from .leaderboard import month_top, parse_month, snapshot_months
+from .page_cache import (
+    CATALOG_TAG, LEADERBOARD_TAG, acache_tags, cache_tags, category_tag, csrf_placeholders, product_tag,
+)
+from .points import award, earned_by, month_window, top_earners
+from .ranking import ranking
+from .referrals import stats_for
+from .replicas import replica_reads
+from .search import get_search_backend
 from django.utils import translation
-from django.http import HttpResponseRedirect
-from django.db.models import Q, Sum
+from django.http import HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
 from django.conf import settings
+from cart.checkout import take_stock
+from cart.exceptions import InsufficientStock
 
 
 def set_language_view(request, lang_code):
@@ -36,9 +51,20 @@ def set_language_view(request, lang_code):
 
 
 
+def _home_reads():
+    """Featured products and the top 3, as independent reads"""
+    return (
+        lambda: list(Product.objects.filter(stock__gt=F('reserved'))[:6]),
+        lambda: ranking.top(3),  # Top 3 for homepage
+    )
+
+def _home_tags(featured_products):
+    return CATALOG_TAG, LEADERBOARD_TAG, *[product_tag(product.pk) for product in featured_products]
+
+@replica_reads
 def home(request):
-    featured_products = Product.objects.filter(stock__gt=0)[:6]
-    top_users = CustomUser.objects.order_by('-points')[:3]  # Top 3 for homepage
+    featured_products, top_users = [read() for read in _home_reads()]
+    cache_tags(request, *_home_tags(featured_products))
     
     context = {
         'featured_products': featured_products,
@@ -46,54 +72,147 @@ def home(request):
     }
     return render(request, 'home.html', context)
 
-def products(request):
-    categories = Category.objects.all()
-    products_list = Product.objects.filter(stock__gt=0)
-    
-    # Filter by category if provided
-    category_id = request.GET.get('category')
-    if category_id:
-        products_list = products_list.filter(category_id=category_id)
-        current_category = Category.objects.get(id=category_id)
+@replica_reads
+async def ahome(request):
+    """home for ASGI: the independent reads run side by side"""
+    featured_products, top_users = await gather_reads(*_home_reads())
+    await acache_tags(request, *_home_tags(featured_products))
+    
+    context = {
+        'featured_products': featured_products,
+        'top_users': top_users,
+    }
+    return await arender(request, 'home.html', context)
+
+def _catalog_queryset(request):
+    """Available products narrowed by the category, facet, price and search filters of the request"""
+    filters = CatalogFilters.from_request(request)
+    return filters.queryset().select_related('category'), filters
+
+def _catalog_page(request, products_list, filters):
+    """One keyset page of products_list for the ?sort= and ?after= parameters"""
+    backend = get_search_backend()
+    sort = request.GET.get('sort')
+    if filters.search and backend.ranked and sort in (None, '', RELEVANCE):
+        sort = RELEVANCE
+    elif sort not in SORTS:
+        sort = DEFAULT_SORT
+    
+    return paginate_keyset(
+        products_list,
+        sort,
+        after=request.GET.get('after'),
+        per_page=settings.PRODUCTS_PER_PAGE,
+        search_backend=backend,
+    )
+
+def _next_page_url(request, page):
+    if not page.has_next:
+        return None
+    query = request.GET.copy()
+    query['after'] = page.next_cursor
+    query['sort'] = page.sort
+    return f'?{query.urlencode()}'
+
+def _facet_url(request, name, value=None):
+    """Current listing query with one facet toggled (or cleared), back on the first page"""
+    query = request.GET.copy()
+    query.pop('after', None)
+    if value is None or query.get(name) == str(value):
+        query.pop(name, None)
     else:
-        current_category = None
-    
-    # Search functionality
-    search_query = request.GET.get('search')
-    if search_query:
-        products_list = products_list.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        )
-    
-    # Calculate totals in the view, not template
-    total_products = products_list.count()
-    total_categories = categories.count()
-    total_stock = products_list.aggregate(total_stock=Sum('stock'))['total_stock'] or 0
+        query[name] = value
+    return f'?{query.urlencode()}'
+
+def _products_context(request, filters, facets, page):
+    """Template context of the products page"""
+    categories = [
+        dict(category, url=_facet_url(request, 'category', category['id']),
+             selected=category['id'] == filters.category_id)
+        for category in facets['categories']
+    ]
+    current_category = next((category for category in categories if category['selected']), None)
+    facet_groups = [
+        (label, name, [dict(item, url=_facet_url(request, name, item['value'])) for item in facets[key]])
+        for label, name, key in (('Marque', 'brand', 'brands'), ('Type', 'type', 'types'), ('Taille', 'size', 'sizes'))
+        if facets[key]
+    ]
     
     context = {
-        'products': products_list,
+        'products': page.items,
         'categories': categories,
         'current_category': current_category,
-        'total_products': total_products,
-        'total_categories': total_categories,
-        'total_stock': total_stock,
+        'clear_category_url': _facet_url(request, 'category'),
+        'facet_groups': facet_groups,
+        'total_products': facets['total_products'],
+        'total_categories': facets['total_categories'],
+        'total_stock': facets['total_stock'],
+        'facets': facets,
+        'filters': filters,
+        'sort': page.sort,
+        'next_page_url': _next_page_url(request, page),
     }
-    return render(request, 'products.html', context)
+    return context
+
+@replica_reads
+def products(request):
+    products_list, filters = _catalog_queryset(request)
+    
+    # Totals and sidebar counts come from one cached grouped query; only the
+    # first page is rendered, the rest streams in through products_more
+    facets = get_facets(filters)
+    page = _catalog_page(request, products_list, filters)
+    cache_tags(request, CATALOG_TAG, *[product_tag(product.pk) for product in page.items])
+    return render(request, 'products.html', _products_context(request, filters, facets, page))
+
+@replica_reads
+async def aproducts(request):
+    """products for ASGI: facets and the page don't need each other, so both are read at once"""
+    products_list, filters = _catalog_queryset(request)
+    facets, page = await gather_reads(
+        lambda: get_facets(filters),
+        lambda: _catalog_page(request, products_list, filters),
+    )
+    await acache_tags(request, CATALOG_TAG, *[product_tag(product.pk) for product in page.items])
+    return await arender(request, 'products.html', _products_context(request, filters, facets, page))
 
+@replica_reads
+def products_more(request):
+    """JSON fragment with the next page of product cards for infinite scroll"""
+    products_list, filters = _catalog_queryset(request)
+    page = _catalog_page(request, products_list, filters)
+    cache_tags(request, CATALOG_TAG, *[product_tag(product.pk) for product in page.items])
+    html = render_to_string('partials/product_card_list.html', {'products': page.items}, request=request)
+    # Once in JSON, the page cache could no longer find the tokens to keep them out of the stored copy
+    html = csrf_placeholders(request, html)
+    return JsonResponse({
+        'html': html,
+        'count': len(page),
+        'has_next': page.has_next,
+        'next_page_url': _next_page_url(request, page),
+    })
+
+@replica_reads
 def leaderboard(request):
-    # Get top 10 users by points for current month
-    top_users = CustomUser.objects.order_by('-points')[:10]
+    months = snapshot_months()
+    month = parse_month(request.GET.get('month'))
+    if month in months:
+        # A past month, straight from its snapshot
+        top_users = month_top(month, 10)
+    else:
+        month = None
+        # The current month, from the ledger like the profile's points of the month
+        top_users = top_earners(*month_window(), limit=10)
     
     # Get total users and total points in system
-    total_users = CustomUser.objects.count()
-    total_points = CustomUser.objects.aggregate(Sum('points'))['points__sum'] or 0
+    total_users, total_points = ranking.totals()
     
     context = {
         'top_users': top_users,
         'total_users': total_users,
         'total_points': total_points,
+        'months': months,
+        'selected_month': month,
     }
     return render(request, 'leaderboard.html', context)
 
@@ -149,32 +268,57 @@ def register(request):
 @login_required
 def profile(request):
     user = request.user
-    referred_users = CustomUser.objects.filter(referred_by=user)
+    # Referral counters come precomputed; the referrals themselves one keyset page at a time
+    referral_stats = stats_for(user)
+    referred_users = paginate_keyset(
+        CustomUser.objects.filter(referred_by=user),
+        'newest',
+        after=request.GET.get('after'),
+        per_page=settings.REFERRALS_PER_PAGE,
+    )
     user_orders = Order.objects.filter(user=user).order_by('-created_at')[:5]
     
-    # Calculate user's rank
-    users_with_more_points = CustomUser.objects.filter(points__gt=user.points).count()
-    user_rank = users_with_more_points + 1
+    # User's rank and neighbours, from the ranking index instead of a count over all users
+    user_rank = ranking.rank_of(user)
+    around_me = ranking.around(user)
     
-    # Calculate total points earned from referrals
-    referral_points = referred_users.count()
+    # 1 point per direct referral
+    referral_points = referral_stats.direct_referrals
+    
+    # Points history, and what this month brought, from the ledger
+    points_history = user.points_transactions.all()[:10]
+    points_this_month = earned_by(user, *month_window())
     
     context = {
         'referred_users': referred_users,
+        'referral_stats': referral_stats,
+        'next_page_url': _next_page_url(request, referred_users),
         'user_orders': user_orders,
         'user_rank': user_rank,
+        'around_me': around_me,
         'referral_points': referral_points,
+        'points_history': points_history,
+        'points_this_month': points_this_month,
     }
     return render(request, 'profile.html', context)
 
 # Add this new view for product details
+def _product_detail_reads(product_id):
+    # Related products (same category, excluding current product) are found through
+    # the product's id, so they don't wait for the product itself
+    return (
+        lambda: get_object_or_404(Product.objects.select_related('category'), id=product_id),
+        lambda: list(Product.objects.filter(category__products=product_id).exclude(id=product_id)[:4]),
+    )
+
+def _product_detail_tags(product):
+    # Related products come and go with the category
+    return product_tag(product.pk), category_tag(product.category_id)
+
+@replica_reads
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    
-    # Get related products (same category, excluding current product)
-    related_products = Product.objects.filter(
-        category=product.category
-    ).exclude(id=product.id)[:4]
+    product, related_products = [read() for read in _product_detail_reads(product_id)]
+    cache_tags(request, *_product_detail_tags(product))
     
     context = {
         'product': product,
@@ -182,37 +326,52 @@ def product_detail(request, product_id):
     }
     return render(request, 'product_detail.html', context)
 
+@replica_reads
+async def aproduct_detail(request, product_id):
+    """product_detail for ASGI: the product and its related products are read side by side"""
+    product, related_products = await gather_reads(*_product_detail_reads(product_id))
+    await acache_tags(request, *_product_detail_tags(product))
+    
+    context = {
+        'product': product,
+        'related_products': related_products,
+    }
+    return await arender(request, 'product_detail.html', context)
+
 
 @login_required
 def purchase_product(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     
-    if product.stock <= 0:
+    if product.available <= 0:
         messages.error(request, 'Désolé, ce produit est en rupture de stock.')
         return redirect('product_detail', product_id=product_id)
     
-    # Create order
-    order = Order.objects.create(
-        user=request.user,
-        total_price=product.price,
-        status='new'
-    )
-    
-    OrderItem.objects.create(
-        order=order,
-        product=product,
-        quantity=1,
-        price=product.price
-    )
-    
-    # Update user points
-    user = request.user
-    user.points += 1
-    user.save(update_fields=['points'])
-    
-    # Update product stock
-    product.stock -= 1
-    product.save(update_fields=['stock'])
+    try:
+        with transaction.atomic():
+            # Conditional decrement: never dips into the units held by carts
+            take_stock({product.pk: 1})
+            
+            # Create order
+            order = Order.objects.create(
+                user=request.user,
+                total_price=product.price,
+                status='new'
+            )
+            
+            OrderItem.objects.create(
+                order=order,
+                product=product,
+                quantity=1,
+                price=product.price
+            )
+            
+            # Update user points
+            user = request.user
+            award(user, 1, PointsTransaction.PURCHASE, order=order)
+    except InsufficientStock:
+        messages.error(request, 'Désolé, ce produit est en rupture de stock.')
+        return redirect('product_detail', product_id=product_id)
     
     messages.success(request, 
         f'Commande passée avec succès! Vous avez gagné 1 point. '
@@ -0,0 +1,112 @@
+"""
+Worker warm-up.
+
+A fresh worker pays on its first requests for work that is then cached for
+its lifetime: loading the .mo catalogs of a language on its first request
+in that language, the locale's date and number formats, populating the
+i18n_patterns URL resolver for each language prefix, importing the views,
+compiling every template (and its tag libraries) into the cached template
+loader, and reading the static files manifest. warm_up() does all of it up front; core.wsgi and core.asgi
+call it before the server takes traffic when WARMUP_ON_STARTUP is set
+(and with gunicorn --preload, once in the master before the fork).
+
+The warm_up command reports what each step costs, bench_cold_start measures
+the first response per language of fresh server processes with and
+without it.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template import TemplateSyntaxError, engines
+from django.urls import resolve, reverse
+from django.utils import formats, translation
+
+logger = logging.getLogger(__name__)
+
+# Pages reversed and resolved for every language
+WARM_URLS = ['home', 'products', 'leaderboard', 'cart']
+# Files every page links with {% static %}
+WARM_STATIC = ['css/site.css', 'js/site.js']
+
+
+def _warm_translations():
+    for code, _ in settings.LANGUAGES:
+        with translation.override(code):
+            # Loads the language's catalogs, merged over all apps and LOCALE_PATHS
+            translation.gettext('Home')
+            for name in ('DATE_FORMAT', 'DECIMAL_SEPARATOR', 'THOUSAND_SEPARATOR'):
+                formats.get_format(name, lang=code)
+    return len(settings.LANGUAGES)
+
+
+def _warm_urls():
+    count = 0
+    for code, _ in settings.LANGUAGES:
+        with translation.override(code):
+            # Reversing populates the resolver's per-language tables; resolving imports the views
+            for name in WARM_URLS:
+                resolve(reverse(name))
+                count += 1
+    return count
+
+
+def project_templates():
+    """Names of the templates of the project's own directories (not those of contrib apps)"""
+    base = Path(settings.BASE_DIR).resolve()
+    folders = [Path(folder) for folder in engines['django'].engine.dirs]
+    folders += [
+        Path(config.path) / 'templates' for config in apps.get_app_configs()
+        if Path(config.path).resolve().is_relative_to(base)
+    ]
+    names = set()
+    for folder in folders:
+        names.update(path.relative_to(folder).as_posix() for path in folder.glob('**/*.html'))
+    return sorted(names)
+
+
+def _warm_templates():
+    engine = engines['django']
+    count = 0
+    for name in project_templates():
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError:
+            # Leave it to fail on its own page rather than keep the worker from starting
+            logger.exception('Template %s does not compile', name)
+            continue
+        count += 1
+    return count
+
+
+def _warm_static():
+    # Reads the manifest of hashed names
+    for name in WARM_STATIC:
+        staticfiles_storage.url(name)
+    return len(WARM_STATIC)
+
+
+STEPS = [
+    ('translations', _warm_translations),
+    ('urls', _warm_urls),
+    ('templates', _warm_templates),
+    ('static', _warm_static),
+]
+
+
+def warm_up():
+    """Run every warm-up step, {step: (items warmed, seconds)}"""
+    report = {}
+    for name, step in STEPS:
+        start = time.perf_counter()
+        count = step()
+        report[name] = (count, time.perf_counter() - start)
+    logger.info(
+        'Warm-up done in %.0fms (%s)',
+        sum(elapsed for _, elapsed in report.values()) * 1000,
+        ', '.join(f'{name}: {count}' for name, (count, _) in report.items()),
+    )
+    return report
@@ -0,0 +1,127 @@
+// Mobile menu functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const mobileMenuButton = document.getElementById('mobileMenuButton');
+    const closeMobileMenu = document.getElementById('closeMobileMenu');
+    const mobileMenu = document.getElementById('mobileMenu');
+    const menuOverlay = document.getElementById('menuOverlay');
+
+    function openMobileMenu() {
+        mobileMenu.classList.add('open');
+        menuOverlay.classList.add('open');
+        document.body.style.overflow = 'hidden';
+    }
+
+    function closeMobileMenuFunc() {
+        mobileMenu.classList.remove('open');
+        menuOverlay.classList.remove('open');
+        document.body.style.overflow = 'auto';
+    }
+
+    if (mobileMenuButton) {
+        mobileMenuButton.addEventListener('click', openMobileMenu);
+    }
+    if (closeMobileMenu) {
+        closeMobileMenu.addEventListener('click', closeMobileMenuFunc);
+    }
+    if (menuOverlay) {
+        menuOverlay.addEventListener('click', closeMobileMenuFunc);
+    }
+
+    // Close menu on escape key
+    document.addEventListener('keydown', function(e) {
+        if (e.key === 'Escape') {
+            closeMobileMenuFunc();
+        }
+    });
+
+    // Update cart counts
+    function updateCartCount(count) {
+        const cartCounters = document.querySelectorAll('#cart-count, #mobile-cart-count');
+        cartCounters.forEach(counter => {
+            counter.textContent = count;
+            // Add animation
+            counter.classList.add('animate-ping');
+            setTimeout(() => {
+                counter.classList.remove('animate-ping');
+            }, 1000);
+        });
+    }
+
+    // The initial cart count is rendered server side (cart.context_processors.cart_count)
+});
+
+// AJAX add to cart functionality
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('.add-to-cart-form').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            
+            const formData = new FormData(this);
+            const submitButton = this.querySelector('button[type="submit"]');
+            const originalHTML = submitButton.innerHTML;
+            
+            // Show loading state
+            submitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+            submitButton.disabled = true;
+            
+            fetch(this.action, {
+                method: 'POST',
+                body: formData,
+                headers: {
+                    'X-Requested-With': 'XMLHttpRequest',
+                }
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    updateCartCount(data.cart_count);
+                    showNotification(data.message, 'success');
+                } else {
+                    showNotification(data.message, 'error');
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                showNotification('Une erreur est survenue', 'error');
+            })
+            .finally(() => {
+                submitButton.innerHTML = originalHTML;
+                submitButton.disabled = false;
+            });
+        });
+    });
+});
+
+function showNotification(message, type) {
+    // Create a temporary notification
+    const notification = document.createElement('div');
+    notification.className = `fixed top-4 right-4 p-4 rounded-lg shadow-lg z-50 ${
+        type === 'success' ? 'bg-green-500 text-white' : 'bg-red-500 text-white'
+    }`;
+    notification.innerHTML = `
+        <div class="flex items-center space-x-2">
+            <i class="fas ${type === 'success' ? 'fa-check' : 'fa-exclamation-triangle'}"></i>
+            <span>${message}</span>
+        </div>
+    `;
+    
+    document.body.appendChild(notification);
+    
+    // Remove after 3 seconds
+    setTimeout(() => {
+        notification.remove();
+    }, 3000);
+}
+
+// Global updateCartCount function
+function updateCartCount(count) {
+    const cartCounters = document.querySelectorAll('#cart-count, #mobile-cart-count');
+    cartCounters.forEach(counter => {
+        counter.textContent = count;
+        // Add animation
+        counter.classList.add('animate-ping');
+        setTimeout(() => {
+            counter.classList.remove('animate-ping');
+        }, 1000);
+    });
+}